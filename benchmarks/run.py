@@ -0,0 +1,226 @@
+"""
+Benchmarks of the client against a local mock API server. Run from the root
+of the repository:
+
+    python benchmarks/run.py [-o results.json] [--only submit,pickle]
+
+Results are printed as JSON, and also written to the output file if one is
+given, so that they can be compared across versions.
+"""
+
+import base64
+import calendar
+import datetime
+import json
+import optparse
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_benchmarks = []
+
+def benchmark(f):
+    """Registers a benchmark. It takes a Multyvac object connected to a
+    MockServer, and returns a dict of measurements."""
+    _benchmarks.append(f)
+    return f
+
+def _rate(n, seconds):
+    return n / seconds if seconds else None
+
+def _add(x, y):
+    return x + y
+
+@benchmark
+def submit(m, server, n=200):
+    """Jobs submitted per second, one at a time."""
+    start = time.time()
+    for i in range(n):
+        m.job.submit(_add, i, 1, _ignore_module_dependencies=True)
+    python_elapsed = time.time() - start
+    start = time.time()
+    for i in range(n):
+        m.job.shell_submit('true')
+    shell_elapsed = time.time() - start
+    return {'jobs': n,
+            'submit_per_second': _rate(n, python_elapsed),
+            'shell_submit_per_second': _rate(n, shell_elapsed)}
+
+def _sleep(seconds):
+    import time
+    time.sleep(seconds)
+
+def _finished_at(job):
+    # finished_at is in UTC, in the API's date format
+    t = datetime.datetime.strptime(job.finished_at, '%Y-%m-%d %H:%M:%S.%f')
+    return calendar.timegm(t.timetuple()) + t.microsecond / 1e6
+
+@benchmark
+def wait(m, server, n=5, job_seconds=0.5):
+    """Seconds between a job finishing and wait() returning it."""
+    latencies = []
+    for _ in range(n):
+        jid = m.job.submit(_sleep, job_seconds,
+                           _ignore_module_dependencies=True)
+        job = m.job.wait([jid])[0]
+        latencies.append(time.time() - _finished_at(job))
+    latencies.sort()
+    return {'jobs': n,
+            'latency_mean': sum(latencies) / len(latencies),
+            'latency_max': latencies[-1]}
+
+@benchmark
+def file_io(m, server, n=20, size=1024 * 1024):
+    """Bytes per second of Volume.put_contents() and get_contents()."""
+    m.volume.create('bench', '/bench')
+    volume = m.volume.get('bench')
+    contents = os.urandom(size)
+    start = time.time()
+    for i in range(n):
+        volume.put_contents(contents, 'f%d' % i)
+    put_elapsed = time.time() - start
+    start = time.time()
+    for i in range(n):
+        volume.get_contents('f%d' % i)
+    get_elapsed = time.time() - start
+    return {'files': n,
+            'file_bytes': size,
+            'put_bytes_per_second': _rate(n * size, put_elapsed),
+            'get_bytes_per_second': _rate(n * size, get_elapsed)}
+
+@benchmark
+def pickle_payloads(m, server, n=200):
+    """Payloads per second and bytes per payload of CloudPickler."""
+    from cStringIO import StringIO
+    from multyvac.util.cloudpickle import CloudPickler
+    offset = 10
+    def closure(x):
+        return x + offset
+    payloads = {
+        'function': (_add, (1, 2), {}),
+        'closure': (closure, (1,), {}),
+        'floats': (_add, ([float(i) for i in range(10000)], []), {}),
+        'records': (_add, ([{'id': i, 'name': 'item%d' % i}
+                            for i in range(1000)], []), {}),
+    }
+    results = {}
+    for name, payload in payloads.items():
+        start = time.time()
+        for _ in range(n):
+            s = StringIO()
+            CloudPickler(s, 2).dump(payload)
+        elapsed = time.time() - start
+        results[name] = {'per_second': _rate(n, elapsed),
+                         'bytes': s.tell()}
+    return results
+
+@benchmark
+def decode_jobs(m, server, n=10000):
+    """Seconds to decode a listing of n finished jobs into Jobs."""
+    result = base64.b64encode(pickle.dumps({'value': 42}, 2))
+    jobs = []
+    for jid in range(n):
+        jobs.append({'jid': jid,
+                     'cmd': 'python -m multyvacinit.pybootstrap',
+                     'core': 'c1',
+                     'multicore': 1,
+                     'tags': {'fname': '__main__._add'},
+                     'status': 'done',
+                     'created_at': '2014-07-27 12:00:00.000000',
+                     'started_at': '2014-07-27 12:00:01.000000',
+                     'finished_at': '2014-07-27 12:00:02.000000',
+                     'result_type': 'pickle',
+                     'result': result,
+                     'runtime': 1.0,
+                     'queue_delay': 0.5,
+                     'overhead_delay': 0.5,
+                     'collected': {'cputime_user': 1.0,
+                                   'cputime_system': 0.0,
+                                   'memory_failcnt': 0,
+                                   'memory_max_usage': 0,
+                                   'ports': {}},
+                     'stdout': '',
+                     'stderr': ''})
+    body = json.dumps({'jobs': jobs})
+    start = time.time()
+    r = json.loads(body)
+    json_elapsed = time.time() - start
+    m.job._parse_jobs(r)
+    elapsed = time.time() - start
+    return {'jobs': n,
+            'json_seconds': json_elapsed,
+            'total_seconds': elapsed}
+
+_IMPORT_SCRIPT = """
+import sys, time
+start = time.time()
+import multyvac
+imported = time.time() - start
+start = time.time()
+multyvac.config.api_url
+print imported, time.time() - start, 'requests' in sys.modules, \
+    'pkg_resources' in sys.modules
+"""
+
+@benchmark
+def import_time(m, server, n=10):
+    """Seconds to import multyvac in a new process, and to then create the
+    default Multyvac object."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    imports = []
+    first_uses = []
+    for _ in range(n):
+        out = subprocess.Popen([sys.executable, '-c', _IMPORT_SCRIPT],
+                               cwd=root,
+                               stdout=subprocess.PIPE).communicate()[0]
+        (imported, first_use,
+         requests_imported, pkg_resources_imported) = out.split()
+        imports.append(float(imported))
+        first_uses.append(float(first_use))
+    return {'runs': n,
+            'import_seconds_min': min(imports),
+            'import_seconds_median': sorted(imports)[n // 2],
+            'first_use_seconds_median': sorted(first_uses)[n // 2],
+            'imports_requests': requests_imported == 'True',
+            'imports_pkg_resources': pkg_resources_imported == 'True'}
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-o', '--output', help='File to write results to')
+    parser.add_option('--only', help='Comma-separated benchmarks to run')
+    options, _ = parser.parse_args()
+
+    import multyvac
+    from multyvac.mock_server import MockServer
+
+    server = MockServer(workers=8).start()
+    m = multyvac.Multyvac(api_key='mock', api_secret_key='mock',
+                          api_url=server.url)
+
+    selected = options.only.split(',') if options.only else None
+    results = {}
+    for f in _benchmarks:
+        if selected and f.__name__ not in selected:
+            continue
+        results[f.__name__] = f(m, server)
+    server.stop()
+
+    output = json.dumps({'version': multyvac.__version__,
+                         'python': platform.python_version(),
+                         'platform': platform.platform(),
+                         'time': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                               time.gmtime()),
+                         'results': results},
+                        indent=2, sort_keys=True)
+    print output
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,87 @@
-import os as _os
-from pkg_resources import (
-    get_distribution as _get_distribution,
-    DistributionNotFound as _DistributionNotFound,
-)
+import threading as _threading
 
 from .multyvac import (
+    CircuitOpenError,
+    DeadlineExceeded,
     Multyvac,
     MultyvacError,
     RequestError,
 )
 
-# Automatically determine the version of the package
-try:
-    _dist = _get_distribution('multyvac')
-    if not __file__.startswith(_os.path.join(_dist.location, 'multyvac')):
-        # not installed, but there is another version that *is*
-        raise _DistributionNotFound
-except _DistributionNotFound:
-    __version__ = 'Only available when installed with setup.py'
-else:
-    # FIXME: If there are two egg-info folders (an older version failed to
-    # uninstall), then the older one is chosen, which is incorrect.
-    __version__ = _dist.version
-
-# Default Multyvac singleton
-_multyvac = Multyvac()
-
-on_multyvac = _multyvac.on_multyvac
-send_log_to_support = _multyvac.send_log_to_support
+from .version import __version__
+
+# The default Multyvac object is created on first use rather than at import,
+# since it reads (and may create) the configuration and log files.
+_multyvac = None
+_multyvac_lock = _threading.Lock()
+
+def _default():
+    """Returns the default Multyvac object, creating it if needed."""
+    global _multyvac
+    if _multyvac is None:
+        with _multyvac_lock:
+            if _multyvac is None:
+                _multyvac = Multyvac()
+    return _multyvac
+
+class _LazyAttribute(object):
+    """Stands in for an attribute of the default Multyvac object, such as
+    ``multyvac.volume``, without creating the object until it is used."""
+
+    def __init__(self, *path):
+        object.__setattr__(self, '_path', path)
+
+    def _target(self):
+        obj = _default()
+        for name in self._path:
+            obj = getattr(obj, name)
+        return obj
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target(), name, value)
+
+    def __repr__(self):
+        return repr(self._target())
+
+def _delegate(path, name, doc_from):
+    """Returns a function that calls method name of the default Multyvac
+    object's attribute at path."""
+    def f(*args, **kwargs):
+        obj = _default()
+        for attr in path:
+            obj = getattr(obj, attr)
+        return getattr(obj, name)(*args, **kwargs)
+    f.__name__ = name
+    f.__doc__ = getattr(doc_from, name).__doc__
+    return f
+
+on_multyvac = Multyvac.on_multyvac
+send_log_to_support = _delegate((), 'send_log_to_support', Multyvac)
 
 # Job methods that have been elevated to top level
-from .job import JobError
-modulemgr = _multyvac.job._modulemgr
-get = _multyvac.job.get
-get_by_name = _multyvac.job.get_by_name
-list = _multyvac.job.list
-kill = _multyvac.job.kill
-kill_all = _multyvac.job.kill_all
-wait = _multyvac.job.wait
-shell_submit = _multyvac.job.shell_submit
-submit = _multyvac.job.submit
-queue_stats = _multyvac.job.queue_stats
+from .job import (
+    JobError,
+    JobModule as _JobModule,
+)
+modulemgr = _LazyAttribute('job', '_modulemgr')
+get = _delegate(('job',), 'get', _JobModule)
+get_by_name = _delegate(('job',), 'get_by_name', _JobModule)
+list = _delegate(('job',), 'list', _JobModule)
+kill = _delegate(('job',), 'kill', _JobModule)
+kill_all = _delegate(('job',), 'kill_all', _JobModule)
+wait = _delegate(('job',), 'wait', _JobModule)
+shell_submit = _delegate(('job',), 'shell_submit', _JobModule)
+submit = _delegate(('job',), 'submit', _JobModule)
+queue_stats = _delegate(('job',), 'queue_stats', _JobModule)
 
 # All other modules
 from .config import ConfigError
-config = _multyvac.config
+config = _LazyAttribute('config')
 from .volume import SyncError
-volume = _multyvac.volume
-layer = _multyvac.layer
-cluster = _multyvac.cluster
-api_key = _multyvac.api_key
+volume = _LazyAttribute('volume')
+layer = _LazyAttribute('layer')
+cluster = _LazyAttribute('cluster')
+api_key = _LazyAttribute('api_key')
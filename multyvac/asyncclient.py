@@ -0,0 +1,364 @@
+"""
+A client whose methods return futures instead of blocking, for programs that
+track many jobs at once, such as event-driven services::
+
+    from multyvac.asyncclient import AsyncMultyvac
+    with AsyncMultyvac() as client:
+        jids = [client.job.submit(f, x).result() for x in xs]
+        done = client.job.wait(jids)
+        done.add_done_callback(lambda future: report(future.result()))
+
+Native coroutines need Python 3.5, while this package runs on Python 2.6 and
+2.7, so methods return a :class:`concurrent.futures.Future` when the
+``futures`` backport is installed, and an object with the same methods
+otherwise.
+
+Requests, and the rsync and ssh commands of volumes, run on a pool of at most
+``max_workers`` threads through the blocking client, so that they share its
+payload building and response parsing, and everything else it does for each
+request.
+Waiting on jobs takes no thread per wait: one thread polls the status of
+every job being waited on with batched requests every ``poll_interval``
+seconds, and gets each finished job once in full, however many waits there
+are.
+
+Callbacks added to the futures run on the client's threads, and should not
+block.
+"""
+
+import logging
+import Queue
+import threading
+
+from .cluster import Cluster
+from .job import (
+    Job,
+    JobModule,
+)
+from .multyvac import Deadline
+from .util.futures import Future
+from .volume import Volume
+
+class AsyncMultyvac(object):
+    """Runs the calls of a Multyvac object in the background. See the module
+    documentation."""
+
+    def __init__(self, multyvac=None, max_workers=8, poll_interval=1.0):
+        """
+        :param multyvac: The Multyvac object to use. Defaults to the one used
+            by the top-level functions of the multyvac module.
+        :param max_workers: The most calls that run at once.
+        :param poll_interval: Seconds between checks of the jobs being waited
+            on.
+        """
+        if multyvac is None:
+            import multyvac as _multyvac_module
+            multyvac = _multyvac_module._default()
+        self.multyvac = multyvac
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._calls = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shut_down = False
+        self._poller = _JobPoller(self)
+        self.job = AsyncJobModule(self)
+        self.volume = AsyncVolumeModule(self)
+        self.cluster = AsyncClusterModule(self)
+
+    def _call(self, fn, *args, **kwargs):
+        """Runs fn on the pool, and returns a future of its result."""
+        future = Future()
+        with self._lock:
+            if self._shut_down:
+                raise RuntimeError('Cannot call after shutdown')
+            self._calls.put((future, fn, args, kwargs))
+            if len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work,
+                                          name='multyvac-async')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        return future
+
+    def _work(self):
+        while True:
+            call = self._calls.get()
+            if call is None:
+                return
+            future, fn, args, kwargs = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """
+        Stops taking calls. Calls already made still run, but waits on jobs
+        that have not finished are cancelled.
+
+        :param wait: Return only once the calls have finished.
+        """
+        with self._lock:
+            self._shut_down = True
+            for _ in self._threads:
+                self._calls.put(None)
+            threads = list(self._threads)
+        self._poller.stop(wait)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown()
+
+def _run_in_pool(module_name, method_name):
+    """Returns a method that runs method_name of the blocking client's module
+    on the pool."""
+    def f(self, *args, **kwargs):
+        module = getattr(self.client.multyvac, module_name)
+        return self.client._call(getattr(module, method_name),
+                                 *args, **kwargs)
+    f.__name__ = method_name
+    f.__doc__ = ('Like :meth:`multyvac.%s.%s`, but returns a future of '
+                 'its result.' % (module_name, method_name))
+    return f
+
+class AsyncJobModule(object):
+    """The methods of :class:`multyvac.job.JobModule`, returning futures."""
+
+    def __init__(self, client):
+        self.client = client
+
+    # The arguments of submit() are pickled on the pool, so they must not
+    # change until the returned future is done.
+    submit = _run_in_pool('job', 'submit')
+    shell_submit = _run_in_pool('job', 'shell_submit')
+    get = _run_in_pool('job', 'get')
+    get_by_name = _run_in_pool('job', 'get_by_name')
+    list = _run_in_pool('job', 'list')
+    kill = _run_in_pool('job', 'kill')
+    kill_all = _run_in_pool('job', 'kill_all')
+    queue_stats = _run_in_pool('job', 'queue_stats')
+
+    def wait(self, jobs_or_jids, timeout=None):
+        """
+        Like :meth:`multyvac.job.JobModule.wait`, but returns a future of the
+        list of finished jobs, or of None if they have not finished and been
+        retrieved within timeout seconds.
+        """
+        return self.client._poller.add(JobModule._jids(jobs_or_jids),
+                                       timeout or None)
+
+class AsyncVolumeModule(object):
+    """The methods of :class:`multyvac.volume.VolumeModule`, and the I/O of
+    :class:`multyvac.volume.Volume`, returning futures."""
+
+    def __init__(self, client):
+        self.client = client
+
+    get = _run_in_pool('volume', 'get')
+    create = _run_in_pool('volume', 'create')
+    list = _run_in_pool('volume', 'list')
+
+    def _run(self, volume, method_name, *args, **kwargs):
+        def call():
+            v = volume
+            if not isinstance(v, Volume):
+                # Syncs need the volume's mount path
+                v = self.client.multyvac.volume.get(v)
+            return getattr(v, method_name)(*args, **kwargs)
+        return self.client._call(call)
+
+    def mkdir(self, volume, path):
+        """Like :meth:`multyvac.volume.Volume.mkdir` of volume, a Volume or
+        its name, but returns a future."""
+        return self._run(volume, 'mkdir', path)
+
+    def put_contents(self, volume, contents, target_path, target_mode=None):
+        """Like :meth:`multyvac.volume.Volume.put_contents` of volume, a
+        Volume or its name, but returns a future."""
+        return self._run(volume, 'put_contents', contents, target_path,
+                         target_mode)
+
+    def get_contents(self, volume, path):
+        """Like :meth:`multyvac.volume.Volume.get_contents` of volume, a
+        Volume or its name, but returns a future."""
+        return self._run(volume, 'get_contents', path)
+
+    def get_file(self, volume, remote_path, local_path):
+        """Like :meth:`multyvac.volume.Volume.get_file` of volume, a Volume
+        or its name, but returns a future."""
+        return self._run(volume, 'get_file', remote_path, local_path)
+
+    def put_file(self, volume, local_path, remote_path, target_mode=None):
+        """Like :meth:`multyvac.volume.Volume.put_file` of volume, a Volume
+        or its name, but returns a future."""
+        return self._run(volume, 'put_file', local_path, remote_path,
+                         target_mode)
+
+    def ls(self, volume, path):
+        """Like :meth:`multyvac.volume.Volume.ls` of volume, a Volume or its
+        name, but returns a future."""
+        return self._run(volume, 'ls', path)
+
+    def rm(self, volume, path):
+        """Like :meth:`multyvac.volume.Volume.rm` of volume, a Volume or its
+        name, but returns a future."""
+        return self._run(volume, 'rm', path)
+
+    def sync_up(self, volume, local_path, remote_path, timeout=None):
+        """Like :meth:`multyvac.volume.Volume.sync_up` of volume, a Volume or
+        its name, but returns a future."""
+        return self._run(volume, 'sync_up', local_path, remote_path, timeout)
+
+    def sync_down(self, volume, remote_path, local_path, timeout=None):
+        """Like :meth:`multyvac.volume.Volume.sync_down` of volume, a Volume
+        or its name, but returns a future."""
+        return self._run(volume, 'sync_down', remote_path, local_path,
+                         timeout)
+
+class AsyncClusterModule(object):
+    """The methods of :class:`multyvac.cluster.ClusterModule`, and those of
+    :class:`multyvac.cluster.Cluster`, returning futures."""
+
+    def __init__(self, client):
+        self.client = client
+
+    get = _run_in_pool('cluster', 'get')
+    list = _run_in_pool('cluster', 'list')
+    provision = _run_in_pool('cluster', 'provision')
+
+    def release(self, id):
+        """Like :meth:`multyvac.cluster.Cluster.release` of the cluster with
+        id, but returns a future."""
+        cluster = Cluster(id, multyvac=self.client.multyvac)
+        return self.client._call(cluster.release)
+
+    def update_max_duration(self, id, max_duration):
+        """Like :meth:`multyvac.cluster.Cluster.update_max_duration` of the
+        cluster with id, but returns a future."""
+        cluster = Cluster(id, multyvac=self.client.multyvac)
+        return self.client._call(cluster.update_max_duration, max_duration)
+
+class _Wait(object):
+    """A call to AsyncJobModule.wait() that has not finished."""
+
+    def __init__(self, jids, timeout):
+        self.jids = jids
+        self.unfinished = set(jids)
+        self.finished = {}
+        self.deadline = Deadline(timeout)
+        self.future = Future()
+
+class _JobPoller(object):
+    """Polls the jobs of every wait of an AsyncMultyvac from one thread."""
+
+    def __init__(self, client):
+        self.client = client
+        self._waits = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._logger = logging.getLogger('multyvac.asyncclient')
+
+    def add(self, jids, timeout):
+        wait = _Wait(jids, timeout)
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError('Cannot wait after shutdown')
+            self._waits.append(wait)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='multyvac-async-poller')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return wait.future
+
+    def stop(self, wait=True):
+        with self._condition:
+            self._stopped = True
+            waits, self._waits = self._waits, []
+            self._condition.notify()
+            thread = self._thread
+        for w in waits:
+            w.future.cancel()
+        if wait and thread is not None:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._waits and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                waits = list(self._waits)
+            try:
+                self._poll(waits)
+            except Exception:
+                # The client already retried what could be retried. Poll the
+                # waits one by one, so that only those that cannot finish,
+                # for example because a job does not exist, fail.
+                for wait in waits:
+                    try:
+                        self._poll([wait])
+                    except Exception as e:
+                        self._logger.exception('Polling jobs failed')
+                        self._finish([wait], [(wait, None, e)])
+            with self._condition:
+                if self._waits and not self._stopped:
+                    self._condition.wait(self._sleep_time())
+
+    def _poll(self, waits):
+        job_module = self.client.multyvac.job
+        unfinished = set()
+        for wait in waits:
+            unfinished.update(wait.unfinished)
+        jobs = job_module.get(list(unfinished), fields=['jid', 'status'])
+        finished = [job.jid for job in jobs
+                    if job.status in Job.finished_statuses]
+        full = dict((job.jid, job) for job in job_module.get(finished))
+        done = []
+        for wait in waits:
+            for jid in wait.unfinished & set(full):
+                wait.finished[jid] = full[jid]
+            wait.unfinished.difference_update(full)
+            if not wait.unfinished:
+                done.append((wait, [wait.finished[jid] for jid in wait.jids],
+                             None))
+            elif wait.deadline.remaining() == 0:
+                done.append((wait, None, None))
+        self._finish(waits, done)
+
+    def _finish(self, waits, done):
+        """Removes the waits that are done, or cancelled, and sets the
+        result or exception of each of done's (wait, result, exception)."""
+        with self._condition:
+            finished = set(wait for wait, _, _ in done)
+            self._waits = [wait for wait in self._waits
+                           if wait not in finished and
+                           not wait.future.cancelled()]
+        for wait, result, exception in done:
+            if not wait.future.set_running_or_notify_cancel():
+                continue
+            if exception is not None:
+                wait.future.set_exception(exception)
+            else:
+                wait.future.set_result(result)
+
+    def _sleep_time(self):
+        """Returns the seconds until the next poll, shortened to the earliest
+        deadline of the waits."""
+        seconds = self.client.poll_interval
+        for wait in self._waits:
+            seconds = wait.deadline.cap(seconds)
+        return seconds
@@ -0,0 +1,243 @@
+"""
+Provisions and releases clusters to follow the account's queue::
+
+    from multyvac.autoscaler import ClusterAutoscaler
+    with ClusterAutoscaler(core='c2', cores_per_cluster=16, max_cores=64):
+        jobs = multyvac.wait([multyvac.submit(f, x, _core='c2') for x in xs])
+
+Every ``poll_interval`` seconds, the autoscaler reads
+:meth:`multyvac.job.JobModule.queue_stats` and the active clusters. When
+more than ``queued_threshold`` jobs are queued for its core, or jobs have
+been queued for longer than ``wait_threshold`` seconds, it provisions enough
+clusters for the queued jobs. Clusters it provisioned are extended by
+``duration_step`` hours as they near their ``max_duration`` while jobs are
+queued or processing, and are released once there has been none for
+``idle_timeout`` seconds.
+
+Clusters that were not provisioned by the autoscaler count towards the
+capacity, but are never extended or released. ``max_cores`` and
+``max_core_hours`` limit what it spends.
+
+How long jobs have been queued is measured from when the client first sees
+a nonempty queue, since queue_stats() does not report it.
+"""
+
+import logging
+import math
+import threading
+import time
+
+from .cluster import Cluster
+
+class ClusterAutoscaler(object):
+    """Provisions and releases clusters of one core type in a background
+    thread. See the module documentation."""
+
+    def __init__(self, multyvac=None, core='c1', cores_per_cluster=8,
+                 min_cores=0, max_cores=64, queued_threshold=0,
+                 wait_threshold=60.0, duration_step=1.0, idle_timeout=300.0,
+                 scale_up_cooldown=60.0, scale_down_cooldown=60.0,
+                 max_core_hours=None, poll_interval=10.0):
+        """
+        :param multyvac: The Multyvac object to use. Defaults to the one used
+            by the top-level functions of the multyvac module.
+        :param core: The core type to provision, and whose queue to follow.
+        :param cores_per_cluster: The number of cores of each cluster.
+        :param min_cores: Clusters are not released below this many cores.
+        :param max_cores: The most cores of active clusters, counting those
+            that were not provisioned by the autoscaler.
+        :param queued_threshold: Clusters are provisioned when more jobs than
+            this are queued.
+        :param wait_threshold: Clusters are provisioned when jobs have been
+            queued for this many seconds, however few.
+        :param duration_step: The hours a cluster is provisioned for, and
+            extended by.
+        :param idle_timeout: Seconds without queued or processing jobs before
+            clusters are released.
+        :param scale_up_cooldown: Seconds after provisioning before
+            provisioning again.
+        :param scale_down_cooldown: Seconds after releasing a cluster before
+            releasing another.
+        :param max_core_hours: If set, the most core hours, counting each
+            cluster's whole max_duration, the autoscaler may provision and
+            extend clusters for.
+        :param poll_interval: Seconds between checks.
+        """
+        if multyvac is None:
+            import multyvac as _multyvac_module
+            multyvac = _multyvac_module._default()
+        self.multyvac = multyvac
+        self.core = core
+        self.cores_per_cluster = cores_per_cluster
+        self.min_cores = min_cores
+        self.max_cores = max_cores
+        self.queued_threshold = queued_threshold
+        self.wait_threshold = wait_threshold
+        self.duration_step = duration_step
+        self.idle_timeout = idle_timeout
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.max_core_hours = max_core_hours
+        self.poll_interval = poll_interval
+        # Cluster id -> when the autoscaler provisioned it
+        self.owned = {}
+        self.core_hours = 0.0
+        self._queued_since = None
+        self._idle_since = None
+        self._scaled_up_at = None
+        self._scaled_down_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._logger = logging.getLogger('multyvac.autoscaler')
+
+    def start(self):
+        """Starts checking in a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='multyvac-autoscaler')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, release=True):
+        """Stops the background thread, and with release, releases the
+        clusters the autoscaler provisioned."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if release:
+            for cluster_id in self.owned.keys():
+                self._release(cluster_id)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.step()
+            except Exception:
+                # Keep going; the API may recover
+                self._logger.exception('Autoscaler failed')
+            self._stop.wait(self.poll_interval)
+
+    def step(self):
+        """Checks the queue and clusters once, and provisions, extends or
+        releases clusters as needed. Called by the background thread, or
+        directly to drive the autoscaler from a loop of your own."""
+        now = time.time()
+        stats = _core_stats(self.multyvac.job.queue_stats(), self.core)
+        queued = _count(stats, 'queued')
+        processing = _count(stats, 'processing')
+        clusters = [c for c in self.multyvac.cluster.list()
+                    if c.core == self.core and c.state != 'released']
+        for cluster_id in self.owned.keys():
+            if cluster_id not in [c.id for c in clusters]:
+                # Released by someone else, or expired
+                del self.owned[cluster_id]
+        cores = sum(c.core_count or 0 for c in clusters)
+
+        if queued:
+            if self._queued_since is None:
+                self._queued_since = now
+        else:
+            self._queued_since = None
+        if queued or processing:
+            self._idle_since = None
+        elif self._idle_since is None:
+            self._idle_since = now
+
+        if (queued > self.queued_threshold or
+                (queued and now - self._queued_since >= self.wait_threshold)):
+            self._scale_up(now, queued, processing, cores)
+        elif (self._idle_since is not None and
+              now - self._idle_since >= self.idle_timeout):
+            self._scale_down(now, clusters, cores)
+        if queued or processing:
+            self._extend(now, clusters)
+        self.multyvac.stats.gauge('autoscaler_cores', (self.core,), cores)
+
+    def _scale_up(self, now, queued, processing, cores):
+        if (self._scaled_up_at is not None and
+                now - self._scaled_up_at < self.scale_up_cooldown):
+            return
+        # Cores that are not busy yet, for example because their cluster is
+        # still starting, will take some of the queued jobs.
+        needed = queued - max(cores - processing, 0)
+        if needed <= 0:
+            return
+        count = int(math.ceil(float(needed) / self.cores_per_cluster))
+        count = min(count, (self.max_cores - cores) // self.cores_per_cluster)
+        for _ in range(count):
+            if not self._can_spend(self.cores_per_cluster * self.duration_step):
+                self._logger.info('Not provisioning: max_core_hours reached')
+                break
+            cluster_id = self.multyvac.cluster.provision(
+                self.core, self.cores_per_cluster, self.duration_step)
+            self.owned[cluster_id] = now
+            self.core_hours += self.cores_per_cluster * self.duration_step
+            self._scaled_up_at = now
+            self._logger.info('Provisioned cluster %s for %s queued jobs',
+                              cluster_id, queued)
+
+    def _scale_down(self, now, clusters, cores):
+        if (self._scaled_down_at is not None and
+                now - self._scaled_down_at < self.scale_down_cooldown):
+            return
+        for cluster in clusters:
+            if (cluster.id in self.owned and
+                    cores - cluster.core_count >= self.min_cores):
+                self._release(cluster.id)
+                self._scaled_down_at = now
+                return
+
+    def _extend(self, now, clusters):
+        """Extends owned clusters within a tenth of duration_step of their
+        max_duration."""
+        for cluster in clusters:
+            if cluster.id not in self.owned or cluster.max_duration is None:
+                continue
+            hours = (now - self.owned[cluster.id]) / 3600.0
+            if hours < cluster.max_duration - self.duration_step / 10.0:
+                continue
+            if not self._can_spend(cluster.core_count * self.duration_step):
+                self._logger.info('Not extending cluster %s: max_core_hours '
+                                  'reached', cluster.id)
+                continue
+            cluster.update_max_duration(cluster.max_duration +
+                                        self.duration_step)
+            self.core_hours += cluster.core_count * self.duration_step
+            self._logger.info('Extended cluster %s', cluster.id)
+
+    def _can_spend(self, core_hours):
+        return (self.max_core_hours is None or
+                self.core_hours + core_hours <= self.max_core_hours)
+
+    def _release(self, cluster_id):
+        Cluster(cluster_id, multyvac=self.multyvac).release()
+        self.owned.pop(cluster_id, None)
+        self._logger.info('Released cluster %s', cluster_id)
+
+def _core_stats(stats, core):
+    """Returns the part of the result of queue_stats() for core, if it is
+    broken down by core."""
+    if any(isinstance(value, dict) for value in stats.values()):
+        return stats.get(core, {})
+    return stats
+
+def _count(stats, status):
+    """Returns the number of jobs with status in the result of
+    queue_stats(), summing over cores if they are broken down by core."""
+    if isinstance(stats, dict):
+        total = 0
+        for key, value in stats.items():
+            if key == status and isinstance(value, (int, long)):
+                total += value
+            else:
+                total += _count(value, status)
+        return total
+    return 0
@@ -0,0 +1,204 @@
+"""
+Support for running many items per job. See
+:meth:`multyvac.job.JobModule.map`.
+"""
+
+import errno
+import json
+import os
+
+from .job import (
+    Job,
+    JobError,
+)
+
+# Without a chunksize, map() splits its items into about this many jobs.
+default_job_count = 256
+
+# Sizes of the chunks map(chunksize='adaptive') runs first to measure a
+# function it has no estimates for.
+sample_chunk_sizes = (1, 10, 100)
+
+class ItemError(JobError):
+    """An exception raised by the function for one item of a map()."""
+
+    def __init__(self, index, exc_type, message, traceback):
+        JobError.__init__(self, '%s: %s' % (exc_type, message))
+        self.index = index
+        self.exc_type = exc_type
+        self.message = message
+        self.traceback = traceback
+
+    def __repr__(self):
+        return 'ItemError(%r, %r, %r)' % (self.index, self.exc_type,
+                                          self.message)
+
+def chunk_runner(f):
+    """
+    Returns a function that calls f on each item of a list. It runs on
+    Multyvac, so it must not depend on anything but the standard library.
+
+    The returned function returns a list with, for each item, either
+    (True, result) or (False, (exception type, message, traceback)), so that
+    one item failing does not fail the others.
+    """
+    def run_chunk(items):
+        import sys
+        import traceback
+        results = []
+        for item in items:
+            try:
+                results.append((True, f(item)))
+            except Exception:
+                exc_type, exc_value = sys.exc_info()[:2]
+                results.append((False, (exc_type.__name__, str(exc_value),
+                                        traceback.format_exc())))
+        return results
+    return run_chunk
+
+def default_chunksize(n):
+    """Returns the chunksize that splits n items into about
+    default_job_count jobs."""
+    chunksize, extra = divmod(n, default_job_count)
+    return max(1, chunksize + (1 if extra else 0))
+
+def chunks(items, chunksize):
+    """Splits a list into lists of chunksize items."""
+    return [items[i:i+chunksize] for i in range(0, len(items), chunksize)]
+
+def unpack(jobs, sizes, raise_on_error=True, first_index=0):
+    """
+    Returns the results of the items of finished chunk jobs, in order.
+
+    :param sizes: The number of items in each job.
+    :param raise_on_error: If True, raises the ItemError of the first item
+        that failed. Otherwise, failed items are returned as ItemErrors.
+    :param first_index: The index among all items of the first item, for
+        ItemErrors.
+    """
+    results = []
+    for job, size in zip(jobs, sizes):
+        if job.status != Job.status_done:
+            # The whole job failed, for example because it ran out of memory
+            errors = [ItemError(first_index + len(results) + i, 'JobError',
+                                'Job %s is %s' % (job.jid, job.status),
+                                job.stderr)
+                      for i in range(size)]
+            if raise_on_error:
+                raise errors[0]
+            results.extend(errors)
+            continue
+        for ok, value in job.result:
+            if not ok:
+                value = ItemError(first_index + len(results), *value)
+                if raise_on_error:
+                    raise value
+            results.append(value)
+    return results
+
+def sample_chunks(items):
+    """Splits the first items of a list into chunks of sample_chunk_sizes.
+    Returns the chunks and the number of items they hold."""
+    chunks = []
+    start = 0
+    for size in sample_chunk_sizes:
+        if start >= len(items):
+            break
+        chunks.append(items[start:start+size])
+        start += size
+    return chunks, start
+
+def fit(samples):
+    """
+    Fits runtime = overhead + per_item * items to (items, runtime) pairs with
+    least squares. Returns (per_item, overhead) in seconds, or None if there
+    are no samples.
+    """
+    if not samples:
+        return None
+    n = float(len(samples))
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if var_x == 0:
+        # Every chunk had the same size, so the overhead cannot be told
+        # apart from the cost of the items.
+        return mean_y / mean_x, 0.0
+    per_item = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+    # Noise can make either negative when items are very cheap
+    per_item = max(per_item, 1e-6)
+    overhead = max(mean_y - per_item * mean_x, 0.0)
+    return per_item, overhead
+
+class ChunkEstimates(object):
+    """
+    The per-item cost and per-job overhead of mapped functions, learned from
+    the runtimes of their chunk jobs. Kept in a JSON file by the function's
+    module and name, which stay the same as the code around the function
+    changes, so that they carry over to future runs.
+    """
+
+    # Jobs past this many are forgotten, so that estimates follow changes to
+    # a function.
+    max_weight = 100
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.estimates = json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.estimates = {}
+        except ValueError:
+            # A corrupted file is not worth failing over
+            self.estimates = {}
+
+    def get(self, fname):
+        """Returns a dict with per_item and overhead in seconds, and the
+        number of jobs they were learned from, or None."""
+        return self.estimates.get(fname)
+
+    def update(self, fname, jobs):
+        """Refines the estimates for fname with finished chunk jobs, and
+        saves them."""
+        samples = [(job.tags['map_items'], job.runtime) for job in jobs
+                   if job.status == Job.status_done and job.runtime and
+                   (job.tags or {}).get('map_items')]
+        estimate = fit(samples)
+        if estimate is None:
+            return
+        per_item, overhead = estimate
+        # The overhead outside of the runtime, like starting the job
+        overhead += (sum(job.overhead_delay or 0.0 for job in jobs) /
+                     len(jobs))
+        old = self.estimates.get(fname)
+        weight = len(samples)
+        if old:
+            old_weight = min(old['jobs'], self.max_weight)
+            total = float(old_weight + weight)
+            per_item = (old['per_item'] * old_weight + per_item * weight) / total
+            overhead = (old['overhead'] * old_weight + overhead * weight) / total
+            weight += old_weight
+        self.estimates[fname] = {'per_item': per_item,
+                                 'overhead': overhead,
+                                 'jobs': weight}
+        self.save()
+
+    def chunksize(self, fname, target_duration):
+        """Returns the number of items that keeps a job of fname running for
+        about target_duration seconds, or None if fname has no estimates."""
+        estimate = self.estimates.get(fname)
+        if not estimate:
+            return None
+        work = max(target_duration - estimate['overhead'], 0.0)
+        return max(1, int(work / estimate['per_item']))
+
+    def save(self):
+        # Write to a temporary file and rename, so that concurrent runs never
+        # read a partial file.
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.estimates, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
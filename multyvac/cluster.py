@@ -60,14 +60,7 @@ class ClusterModule(MultyvacModule):
         
         r = self.multyvac._ask(Multyvac._ASK_GET,
                                '/cluster/%s' % id)
-        c = r['cluster']
-        if c['requested_at']:
-            c['requested_at'] = MultyvacModule.convert_str_to_datetime(c['requested_at'])
-        if c['provisioned_at']:
-            c['provisioned_at'] = MultyvacModule.convert_str_to_datetime(c['provisioned_at'])
-        if c['released_at']:
-            c['released_at'] = MultyvacModule.convert_str_to_datetime(c['released_at'])
-        return Cluster(multyvac=self.multyvac, **r['cluster'])
+        return self._parse_cluster(r['cluster'])
     
     def list(self):
         """
@@ -76,15 +69,17 @@ class ClusterModule(MultyvacModule):
         
         r = self.multyvac._ask(Multyvac._ASK_GET,
                                '/cluster')
-        for c in r['clusters']:
-            if c['requested_at']:
-                c['requested_at'] = MultyvacModule.convert_str_to_datetime(c['requested_at'])
-            if c['provisioned_at']:
-                c['provisioned_at'] = MultyvacModule.convert_str_to_datetime(c['provisioned_at'])
-            if c['released_at']:
-                c['released_at'] = MultyvacModule.convert_str_to_datetime(c['released_at'])
-        
-        return [Cluster(multyvac=self.multyvac, **cluster) for cluster in r['clusters']]
+        return [self._parse_cluster(c) for c in r['clusters']]
+
+    def _parse_cluster(self, c):
+        """Converts a cluster dict returned by the API into a Cluster."""
+        if c['requested_at']:
+            c['requested_at'] = MultyvacModule.convert_str_to_datetime(c['requested_at'])
+        if c['provisioned_at']:
+            c['provisioned_at'] = MultyvacModule.convert_str_to_datetime(c['provisioned_at'])
+        if c['released_at']:
+            c['released_at'] = MultyvacModule.convert_str_to_datetime(c['released_at'])
+        return Cluster(multyvac=self.multyvac, **c)
     
     def provision(self, core, core_count, max_duration=None):
         """
@@ -0,0 +1,252 @@
+"""
+Runs a graph of dependent jobs, submitting each one as soon as the jobs it
+depends on have finished::
+
+    from multyvac.dag import Dag
+    dag = Dag()
+    a = dag.submit(load, 'data.csv')
+    b = dag.submit(train, a, rate=0.1)       # gets a's result as argument
+    c = dag.shell_submit('notify', _depends_on=[b])
+    dag.run()
+    print b.result()
+
+A :class:`Node` passed as an argument to :meth:`Dag.submit`, directly or in a
+list, tuple, or dict, is replaced by the result of its job. Nodes in
+``_depends_on`` only order the jobs.
+
+Results are passed by value: the client already has a parent's result once
+it sees the parent finish, and pickles it into the child's arguments.
+Passing a reference instead would need the child job to fetch the result
+from the API with credentials of its own. For large results, have the
+parent write them to a volume and pass the path instead.
+
+Job statuses are polled for all running jobs at once. When a job fails, the
+jobs depending on it are cancelled, and with ``fail_fast`` so is everything
+else.
+"""
+
+import threading
+import time
+
+from .multyvac import (
+    Deadline,
+    DeadlineExceeded,
+    MultyvacError,
+)
+
+class DagError(MultyvacError):
+    """Raised for the result of a node that failed or was cancelled."""
+    pass
+
+class Node(object):
+    """A job in a :class:`Dag`, submitted once its parents are done."""
+
+    state_pending = 'pending'
+    state_running = 'running'
+    state_done = 'done'
+    state_failed = 'failed'
+    state_cancelled = 'cancelled'
+
+    def __init__(self, dag, submit, args, kwargs, parents):
+        self.dag = dag
+        self.state = self.state_pending
+        self.jid = None
+        self.job = None
+        self.reason = None
+        self.parents = parents
+        self.children = []
+        self._submit = submit
+        self._args = args
+        self._kwargs = kwargs
+
+    def result(self):
+        """Returns the job's result. Raises DagError if it did not run
+        successfully."""
+        if self.state != self.state_done:
+            raise DagError('%r has no result: %s' % (self, self.reason or
+                                                    self.state))
+        return self.job.get_result()
+
+    def __repr__(self):
+        return 'Node(%s, %s)' % (self.jid, self.state)
+
+class Dag(object):
+    """A graph of jobs. Add jobs with :meth:`submit` and
+    :meth:`shell_submit`, then call :meth:`run`."""
+
+    # Seconds allowed for killing the running jobs when stopping, so that a
+    # timeout passed to run() is not exceeded by much.
+    kill_timeout = 10.0
+
+    def __init__(self, multyvac=None, fail_fast=False, poll_interval=1.0,
+                 max_poll_interval=10.0):
+        """
+        :param multyvac: The Multyvac object to use. Defaults to the one used
+            by the top-level functions of the multyvac module.
+        :param fail_fast: If True, a failed job cancels every other job
+            instead of only the ones depending on it.
+        :param poll_interval: Seconds between polls at first. The interval
+            grows while nothing finishes, up to max_poll_interval.
+        """
+        if multyvac is None:
+            import multyvac as _multyvac_module
+            multyvac = _multyvac_module._default()
+        self.multyvac = multyvac
+        self.fail_fast = fail_fast
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.nodes = []
+        self._cancelled = threading.Event()
+
+    def submit(self, f, *args, **kwargs):
+        """Adds a Python function job. Takes the same arguments as
+        :meth:`multyvac.job.JobModule.submit`. Nodes among the arguments are
+        replaced by their results."""
+        return self._add(self.multyvac.job.submit, (f,) + args, kwargs)
+
+    def shell_submit(self, cmd, **kwargs):
+        """Adds a shell job. Takes the same arguments as
+        :meth:`multyvac.job.JobModule.shell_submit`."""
+        return self._add(self.multyvac.job.shell_submit, (cmd,), kwargs)
+
+    def _add(self, submit, args, kwargs):
+        depends_on = kwargs.pop('_depends_on', None) or []
+        parents = []
+        for parent in list(depends_on) + _find_nodes((args, kwargs)):
+            if parent.dag is not self:
+                raise ValueError('%r belongs to a different Dag' % parent)
+            if parent not in parents:
+                parents.append(parent)
+        node = Node(self, submit, args, kwargs, parents)
+        for parent in parents:
+            parent.children.append(node)
+        self.nodes.append(node)
+        return node
+
+    def cancel(self):
+        """Stops :meth:`run`, killing running jobs and cancelling pending
+        ones. Can be called from another thread."""
+        self._cancelled.set()
+
+    def run(self, timeout=None):
+        """
+        Submits jobs as their parents finish, until every job is done,
+        failed, or cancelled.
+
+        :param timeout: Seconds to run for. When exceeded, running jobs are
+            killed and pending ones cancelled.
+
+        :returns: True if every job finished successfully.
+        """
+        deadline = Deadline(timeout)
+        running = {}
+        interval = self.poll_interval
+        try:
+            while True:
+                if self._cancelled.is_set():
+                    self._cancel_all(running, 'cancelled')
+                    break
+                if deadline.remaining() == 0:
+                    self._cancel_all(running, 'timed out')
+                    break
+                self._submit_ready(running)
+                if not running:
+                    break
+                if self._poll(running, deadline):
+                    interval = self.poll_interval
+                else:
+                    interval = min(interval * 1.5, self.max_poll_interval)
+                    time.sleep(deadline.cap(interval))
+        except DeadlineExceeded:
+            self._cancel_all(running, 'timed out')
+        except BaseException:
+            self._cancel_all(running, 'cancelled')
+            raise
+        return all(n.state == Node.state_done for n in self.nodes)
+
+    def _submit_ready(self, running):
+        """Submits every pending node whose parents are done, and cancels
+        the ones whose parents failed."""
+        for node in self.nodes:
+            if node.state != Node.state_pending:
+                continue
+            if any(p.state in (Node.state_failed, Node.state_cancelled)
+                   for p in node.parents):
+                self._cancel(node, 'a job it depends on did not succeed')
+            elif all(p.state == Node.state_done for p in node.parents):
+                args = _resolve(node._args)
+                kwargs = _resolve(node._kwargs)
+                node.jid = node._submit(*args, **kwargs)
+                node.state = Node.state_running
+                running[node.jid] = node
+
+    def _poll(self, running, deadline):
+        """Checks the status of every running job in a single request, and
+        retrieves the ones that finished. Returns True if any did."""
+        from .job import Job
+        jobs = self.multyvac.job.get(running.keys(), fields=['jid', 'status'],
+                                     timeout=deadline.remaining())
+        finished = [j.jid for j in jobs if j.status in Job.finished_statuses]
+        if not finished:
+            return False
+        failed = False
+        for job in self.multyvac.job.get(finished,
+                                         timeout=deadline.remaining()):
+            node = running.pop(job.jid)
+            node.job = job
+            if job.status == Job.status_done:
+                node.state = Node.state_done
+            else:
+                node.state = Node.state_failed
+                node.reason = 'job %s is %s' % (job.jid, job.status)
+                failed = True
+        # Only once every finished job is recorded, so that none of them is
+        # mistaken for a running one and cancelled.
+        if failed and self.fail_fast:
+            self._cancel_all(running, 'another job failed')
+        return True
+
+    def _cancel(self, node, reason):
+        """Cancels node and everything depending on it."""
+        if node.state != Node.state_pending:
+            return
+        node.state = Node.state_cancelled
+        node.reason = reason
+        for child in node.children:
+            self._cancel(child, 'a job it depends on did not succeed')
+
+    def _cancel_all(self, running, reason):
+        """Kills the running jobs and cancels the pending ones."""
+        try:
+            if running:
+                self.multyvac.job.kill(running.keys(),
+                                       timeout=self.kill_timeout)
+        finally:
+            for node in running.values():
+                node.state = Node.state_cancelled
+                node.reason = reason
+            running.clear()
+            for node in self.nodes:
+                self._cancel(node, reason)
+
+def _find_nodes(obj):
+    """Returns the Nodes in obj, searching lists, tuples, and dicts."""
+    if isinstance(obj, Node):
+        return [obj]
+    elif isinstance(obj, (list, tuple)):
+        return [n for item in obj for n in _find_nodes(item)]
+    elif isinstance(obj, dict):
+        return [n for item in obj.values() for n in _find_nodes(item)]
+    return []
+
+def _resolve(obj):
+    """Returns obj with Nodes replaced by their results."""
+    if isinstance(obj, Node):
+        return obj.result()
+    elif isinstance(obj, list):
+        return [_resolve(item) for item in obj]
+    elif isinstance(obj, tuple):
+        return tuple(_resolve(item) for item in obj)
+    elif isinstance(obj, dict):
+        return dict((k, _resolve(v)) for k, v in obj.items())
+    return obj
@@ -1,4 +1,5 @@
 import base64
+import collections
 import copy
 try:
     import cPickle as pickle
@@ -10,18 +11,26 @@ except:
     import StringIO
 from functools import partial
 import inspect
+import itertools
 import numbers
+import os
+import Queue
 import socket
 import subprocess
+import sys
+import threading
 import time
 
 from .multyvac import (
+    Deadline,
+    DeadlineExceeded,
     Multyvac,
     MultyvacError,
     MultyvacModel,
     MultyvacModule,
     RequestError,
 )
+from . import profiling
 from .util import preinstalls
 from .util.cygwin import regularize_path
 from .util.module_dependency import ModuleDependencyAnalyzer
@@ -61,10 +70,20 @@ class Job(MultyvacModel):
     
         result = kwargs.get('result')
         self.result_type = kwargs.get('result_type')
+        self._profile_stats = None
         if result and self.result_type  == 'pickle':
-            self.result = pickle.loads(base64.b64decode(result))
+            with self.multyvac.stats.timer('base64_decode'):
+                result = base64.b64decode(result)
+            self.result = pickle.loads(result)
+            if (self.tags or {}).get('profile') == 'result':
+                # Unwrap the result of multyvac.profiling.profiled()
+                self._profile_stats = self.result['profile']
+                self.result = self.result['result']
+            elif (self.tags or {}).get('profile', '').startswith('file:'):
+                self.result = self.result['result']
         elif result and self.result_type == 'binary':
-            self.result = base64.b64decode(result)
+            with self.multyvac.stats.timer('base64_decode'):
+                self.result = base64.b64decode(result)
         else:
             self.result = result
         self.return_code = kwargs.get('return_code')
@@ -84,6 +103,23 @@ class Job(MultyvacModel):
         self.stderr = kwargs.get('stderr')
         self.stdout = kwargs.get('stdout')
     
+    @property
+    def profile(self):
+        """
+        The cProfile stats of a job submitted with _profile, as a
+        :class:`pstats.Stats`. None if the job was not profiled or has not
+        finished successfully.
+        """
+        profile = (self.tags or {}).get('profile')
+        if self.status != self.status_done or not profile:
+            return None
+        if self._profile_stats is None and profile.startswith('file:'):
+            self._profile_stats = profiling.load_from_volume(
+                self.multyvac, profile[len('file:'):])
+        if self._profile_stats is None:
+            return None
+        return profiling.to_pstats(self._profile_stats)
+
     def get_result(self, raise_on_error=True):
         """
         Better than using the result attribute directly.
@@ -120,27 +156,29 @@ class Job(MultyvacModel):
         Wait for the job to reach the specified status.
         
         :param status: Can be a status string or a list of strings.
+        :param timeout: The number of seconds to wait, including the time
+            spent polling Multyvac.
         
         Returns the status if the job reaches it, otherwise on a timeout
-        returns False.
+        returns False. A timeout of 0 means no timeout, as None does.
         """
-        start_time = time.time()
+        deadline = Deadline(timeout or None)
         poll_period = 1
         max_poll_period = 10
         while True:
-            current_time = time.time()
-            time_elapsed = current_time - start_time
-            if timeout and time_elapsed > timeout:
+            remaining = deadline.remaining()
+            if remaining == 0:
                 return False
             elif self.status == status or self.status in status:
                 return self.status
             else:
-                sleep_time = (min(poll_period, timeout - time_elapsed)
-                              if timeout else poll_period)
-                time.sleep(sleep_time)
+                time.sleep(deadline.cap(poll_period))
                 if poll_period < max_poll_period:
                     poll_period += 0.5
-                self.update()
+                try:
+                    self.update(timeout=deadline.remaining())
+                except DeadlineExceeded:
+                    return False
     
     def wait_for_open_port(self, port, timeout=None):
         """
@@ -150,12 +188,16 @@ class Job(MultyvacModel):
         
         If port is 22, also returns path to identity file, and username.
         
-        :param timeout: The amount of time to wait for the job to start.
+        :param timeout: The amount of time to wait for the job to start and
+            open the port.
         
         Once started, the job must open the port within 10 seconds. Otherwise,
         False is returned.
         """
         port = str(port)
+        # A timeout of 0 means no timeout, as in wait()
+        timeout = timeout or None
+        deadline = Deadline(timeout)
         self.wait(self.finished_statuses + [self.status_processing], timeout)
         if self.status == self.status_processing:
             attempt = 1
@@ -163,9 +205,14 @@ class Job(MultyvacModel):
             while attempt < max_attempts and self.status == Job.status_processing:
                 if not self.ports or not self.ports.get('tcp', {}).get(port):
                     # Wait for SSH to start
+                    if deadline.cap(2.0) < 2.0:
+                        return False
                     time.sleep(2.0)
                     attempt += 1
-                    self.update()
+                    try:
+                        self.update(timeout=deadline.remaining())
+                    except DeadlineExceeded:
+                        return False
                 else:
                     d = copy.copy(self.ports.get('tcp', {}).get(port))
                     if port == '22':
@@ -182,18 +229,7 @@ class Job(MultyvacModel):
         indefinitely until it is processing."""
         
         if self.wait_for_open_port(22):
-            info = self.ports.get('tcp', {}).get('22')
-            address = info['address']
-            port = info['port']
-            cmd = ('{ssh_bin} -o UserKnownHostsFile=/dev/null '
-                   '-o StrictHostKeyChecking=no -X -p {port} -i {key_path} '
-                   ' multyvac@{address}'.format(
-                        ssh_bin=self.multyvac._ssh_bin,
-                        port=port,
-                        key_path=regularize_path(self.multyvac.config.path_to_private_key()),
-                        address=address,)
-                   )
-            p = subprocess.Popen(cmd, shell=True)
+            p = subprocess.Popen(self._ssh_cmd(options='-X'), shell=True)
             p.wait()
         
     def run_command(self, cmd):
@@ -207,19 +243,7 @@ class Job(MultyvacModel):
         """
         
         if self.wait_for_open_port(22):
-            info = self.ports.get('tcp', {}).get('22')
-            address = info['address']
-            port = info['port']
-            cmd = ('{ssh_bin} -o UserKnownHostsFile=/dev/null '
-                   '-o StrictHostKeyChecking=no -p {port} -i {key_path} '
-                   ' multyvac@{address} {cmd}'.format(
-                        ssh_bin=self.multyvac._ssh_bin,
-                        port=port,
-                        key_path=regularize_path(self.multyvac.config.path_to_private_key()),
-                        address=address,
-                        cmd=cmd)
-                   )
-            p = subprocess.Popen(cmd,
+            p = subprocess.Popen(self._ssh_cmd(cmd=cmd),
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.PIPE,
                                  shell=True)
@@ -228,10 +252,35 @@ class Job(MultyvacModel):
             self.multyvac.job._logger.info('Cannot SSH into finished job')
             return False
     
-    def update(self):
+    def _ssh_cmd(self, options='', cmd=''):
+        """
+        Returns the shell command that SSHes into this job. Assumes that the
+        job has already opened port 22.
+
+        :param options: Extra options for the ssh client.
+        :param cmd: The command to run remotely. If empty, a console is
+            opened instead.
+        """
+        info = self.ports.get('tcp', {}).get('22')
+        return ('{ssh_bin} -o UserKnownHostsFile=/dev/null '
+                '-o StrictHostKeyChecking=no {options} -p {port} -i {key_path} '
+                ' multyvac@{address} {cmd}'.format(
+                     ssh_bin=self.multyvac._ssh_bin,
+                     options=options,
+                     port=info['port'],
+                     key_path=regularize_path(self.multyvac.config.path_to_private_key()),
+                     address=info['address'],
+                     cmd=cmd)
+                )
+
+    def update(self, timeout=None):
         """Updates this Job object with the latest version available of itself
-        from Multyvac."""
-        j = self.multyvac.job.get(self.jid)
+        from Multyvac.
+
+        :param timeout: If Multyvac does not respond within this many
+            seconds, DeadlineExceeded is raised.
+        """
+        j = self.multyvac.job.get(self.jid, timeout=timeout)
         self.__dict__ = j.__dict__
         return self.status
 
@@ -252,6 +301,13 @@ class JobModule(MultyvacModule):
         self._modulemgr = ModuleDependencyAnalyzer()
         preinstalled_modules = [name for name, _ in preinstalls.modules]
         self._modulemgr.ignore(preinstalled_modules)
+        # Specifications of recently submitted jobs, to resubmit them. Only
+        # kept once enable_resubmission() is called, since they include the
+        # pickled function and arguments.
+        self._max_specs = 0
+        self._specs = {}
+        self._spec_order = collections.deque()
+        self._specs_lock = threading.Lock()
     
     def _normalize_vol(self, vol):
         if isinstance(vol, basestring):
@@ -280,7 +336,8 @@ class JobModule(MultyvacModule):
                      _layer=None,  _vol=None, _env=None,
                      _result_source='stdout', _result_type='binary',
                      _max_runtime=None, _profile=False, _restartable=True,
-                     _tags=None, _depends_on=None, _stdin=None):
+                     _tags=None, _depends_on=None, _stdin=None,
+                     _timeout=None):
         """
         Submit a job to Multyvac.
         
@@ -300,17 +357,91 @@ class JobModule(MultyvacModule):
             set to binary, which means Multyvac cannot interpret its contents.
         :param _max_runtime: The maximum number of minutes this job should be
             allowed to run before it is forcibly killed.
-        :param _profile: Not implemented yet.
+        :param _memoize: Only supported by :meth:`submit`. If True and an
+            identical call already finished successfully, return its jid
+            instead of submitting a new job. See :meth:`enable_memoization`.
+        :param _profile: Only supported by :meth:`submit`. Set to True to
+            run the function under cProfile and return the stats with the
+            result, or to a path in a mounted volume to write the stats
+            there. Access them through :attr:`Job.profile`.
         :param _restartable: If a server running the job fails unexpectedly,
             can this job be safely restarted?
         :param _tags: A dict mapping keys to values of arbitrary data. Good for
             storing job metadata.
-        :param _depends_on: Not implemented.
+        :param _depends_on: Passed along to Multyvac, which does not act on
+            it. To submit jobs once the jobs they depend on have finished, use
+            :class:`multyvac.dag.Dag`.
         :param _stdin: The standard input that should be piped into the job.
+        :param _timeout: If the job cannot be submitted within this many
+            seconds, DeadlineExceeded is raised.
         
         :returns: Job id.
         """
         
+        payload = self._build_payload(cmd, _name, _core, _multicore, _layer,
+                                      _vol, _env, _result_source, _result_type,
+                                      _max_runtime, _profile, _restartable,
+                                      _tags, _depends_on, _stdin)
+        r = self.multyvac._ask(Multyvac._ASK_POST,
+                               '/job',
+                               data=payload,
+                               content_type_json=True,
+                               timeout=_timeout)
+        jid = r['jids'][0]
+        self._remember_spec(jid, payload['jobs'][0])
+        return jid
+
+    def _remember_spec(self, jid, spec):
+        if not self._max_specs:
+            return
+        with self._specs_lock:
+            self._specs[jid] = spec
+            self._spec_order.append(jid)
+            while len(self._specs) > self._max_specs:
+                self._specs.pop(self._spec_order.popleft(), None)
+            if len(self._spec_order) > 2 * self._max_specs:
+                # Drop the jids of forgotten specifications
+                self._spec_order = collections.deque(
+                    j for j in self._spec_order if j in self._specs)
+
+    def _forget_specs(self, jids):
+        """Frees the specifications of jobs that will not be resubmitted."""
+        with self._specs_lock:
+            for jid in jids:
+                self._specs.pop(jid, None)
+
+    def _resubmit(self, jid, tags=None, timeout=None, **changes):
+        """
+        Submits a copy of a job submitted by this client, with tags added to
+        its tags and the fields of its specification in changes replaced.
+        Returns the new jid, or None if the job is not restartable or its
+        specification is no longer known.
+        """
+        with self._specs_lock:
+            spec = self._specs.get(jid)
+        if spec is None or not spec.get('restartable', True):
+            return None
+        spec = copy.deepcopy(spec)
+        spec.update(changes)
+        if tags:
+            spec.setdefault('tags', {}).update(tags)
+        r = self.multyvac._ask(Multyvac._ASK_POST,
+                               '/job',
+                               data={'jobs': [spec]},
+                               content_type_json=True,
+                               timeout=timeout)
+        new_jid = r['jids'][0]
+        self._remember_spec(new_jid, spec)
+        return new_jid
+
+    def _build_payload(self, cmd, _name=None, _core='c1', _multicore=1,
+                       _layer=None,  _vol=None, _env=None,
+                       _result_source='stdout', _result_type='binary',
+                       _max_runtime=None, _profile=False, _restartable=True,
+                       _tags=None, _depends_on=None, _stdin=None):
+        """Returns the body of a POST to /job. See :meth:`shell_submit` for
+        the arguments."""
+        
         job = {
                'cmd': cmd,
                'name': _name,
@@ -329,17 +460,12 @@ class JobModule(MultyvacModule):
                }
         
         if _stdin:
-            job['stdin'] = base64.b64encode(_stdin)
+            with self.multyvac.stats.timer('base64_encode'):
+                job['stdin'] = base64.b64encode(_stdin)
         
         MultyvacModule.clear_null_entries(job)
         
-        payload = {'jobs': [job]}
-        
-        r = self.multyvac._ask(Multyvac._ASK_POST,
-                               '/job',
-                               data=payload,
-                               content_type_json=True)
-        return r['jids'][0]
+        return {'jobs': [job]}
 
     def _get_auto_module_volume_name(self):
         return 'auto-deps-%s' % socket.gethostname()
@@ -356,48 +482,104 @@ class JobModule(MultyvacModule):
         Set _ignore_module_dependencies=True as a keyword to prevent module
         dependencies from being automatically sync-ed. Do this only if you have
         setup a layer with all of your dependencies pre-installed.
+        
+        Set _profile=True to profile the function with cProfile. See
+        :meth:`shell_submit`.
+        
+        Set _memoize=True to reuse the job of an identical call that already
+        finished successfully. See :meth:`shell_submit`.
             
         :returns: Job id.
         """
         
+        tracer = self.multyvac.tracer
+        with tracer.span('submit') as span:
+            jid = self._submit(f, args, kwargs)
+            span.set_attribute('jid', jid)
+            span.set_attribute('fname', kwargs['_tags']['fname'])
+        tracer.track_job(jid, span)
+        return jid
+
+    def _submit(self, f, args, kwargs):
+        """See :meth:`submit`."""
+        
+        tracer = self.multyvac.tracer
         f_kwargs = {}
         for k, v in kwargs.items():
             if not k.startswith('_'):
                 f_kwargs[k] = v
                 del kwargs[k]
         
+        tags = kwargs.setdefault('_tags', {})
+        tags.setdefault('fname', JobModule._fname_tag(f))
+        
+        profile = kwargs.pop('_profile', False)
+        if profile:
+            # Profiling happens in the job itself, since Multyvac does not
+            # support it.
+            path = profile if isinstance(profile, basestring) else None
+            f = profiling.profiled(f, path)
+            tags['profile'] = 'file:%s' % path if path else 'result'
+        
         from .util.cloudpickle import CloudPickler
         
         s = StringIO()
-        cp = CloudPickler(s, 2)
-        cp.dump((f, args, f_kwargs))
+        with tracer.span('pickle') as span:
+            cp = CloudPickler(s, 2)
+            cp.dump((f, args, f_kwargs))
+            span.set_attribute('bytes', s.tell())
+        
+        memoize = kwargs.pop('_memoize', False)
+        if memoize:
+            from .memo import memo_key
+            key = memo_key(s.getvalue(),
+                           kwargs.get('_layer'),
+                           kwargs.get('_core', 'c1'),
+                           kwargs.get('_multicore', 1),
+                           kwargs.get('_vol'),
+                           kwargs.get('_env'))
+            jid = self._memoized_jid(key)
+            if jid is not None:
+                return jid
+            tags['memo'] = key
         
         if '_ignore_module_dependencies' in kwargs:
             ignore_modulemgr = kwargs['_ignore_module_dependencies']
             del kwargs['_ignore_module_dependencies']
         else:
             ignore_modulemgr = False
+        
+        # The timeout covers syncing module dependencies as well
+        deadline = Deadline(kwargs.get('_timeout'))
             
         if not ignore_modulemgr:
-            # Add modules
-            for module in cp.modules:
-                self._modulemgr.add(module.__name__)
-            
-            mod_paths = self._modulemgr.get_and_clear_paths()
+            with tracer.span('dependency_scan') as span:
+                # Add modules
+                for module in cp.modules:
+                    self._modulemgr.add(module.__name__)
+                
+                mod_paths = self._modulemgr.get_and_clear_paths()
+                span.set_attribute('paths', len(mod_paths))
             
             vol_name = self._get_auto_module_volume_name()
             if self._modulemgr.has_module_dependencies:
-                v = self.multyvac.volume.get(vol_name)
-                if not v:
-                    try:
-                        self.multyvac.volume.create(vol_name, '/pymodules')
-                    except RequestError as e:
-                        if 'name already exists' not in e.message:
-                            raise
-                    v = self.multyvac.volume.get(vol_name)
+                with tracer.span('volume_lookup'):
+                    v = self.multyvac.volume.get(vol_name,
+                                                 timeout=deadline.remaining())
+                    if not v:
+                        try:
+                            self.multyvac.volume.create(vol_name, '/pymodules',
+                                                        timeout=deadline.remaining())
+                        except RequestError as e:
+                            if 'name already exists' not in e.message:
+                                raise
+                        v = self.multyvac.volume.get(vol_name,
+                                                     timeout=deadline.remaining())
                 if mod_paths:
-                    v.sync_up(mod_paths, '')
+                    with tracer.span('sync_up'):
+                        v.sync_up(mod_paths, '', timeout=deadline.remaining())
             
+        kwargs['_timeout'] = deadline.remaining()
         kwargs['_stdin'] = s.getvalue()
         kwargs['_result_source'] = 'file:/tmp/.result'
         kwargs['_result_type'] = 'pickle'
@@ -409,13 +591,6 @@ class JobModule(MultyvacModule):
             env['PYTHONPATH'] = env['PYTHONPATH'] + ':/pymodules'
         else:
             env['PYTHONPATH'] = '/pymodules'
-            
-        tags = kwargs.setdefault('_tags', {})
-        # Make sure function name fits within length limit for tags
-        fname = JobModule._func_name(f)
-        if len(fname) > 100:
-            fname = fname[:97] + '...'
-        tags['fname'] = fname
         
         return self.shell_submit(
             'python -m multyvacinit.pybootstrap',
@@ -454,24 +629,145 @@ class JobModule(MultyvacModule):
                   }
         MultyvacModule.clear_null_entries(params)
         
+        if (self.multyvac.job_store and jid is not None and
+                set(params) <= set(['jid', 'limit'])):
+            # Only download the jobs that are not in the store
+            jids = jid if MultyvacModule.is_iterable_list(jid) else [jid]
+            found = self._get_stored(jids)
+            missing = [i for i in jids if i not in found]
+            if missing:
+                params['jid'] = missing
+                for job in self._get(params):
+                    found[job.jid] = job
+            jobs = sorted(found.values(), key=lambda j: j.jid, reverse=True)
+            return jobs[:limit]
         return self._get(params)
 
-    def get(self, jid, fields=None):
+    def list_stored(self, name=None, status=None, tags=None, limit=50):
+        """
+        Query the finished jobs in the local job store, without a request.
+        Unlike :meth:`list`, only jobs that were downloaded since the store
+        was enabled are found.
+
+        :param name: Only jobs with this name are returned.
+        :param status: Only jobs with this status are returned.
+        :param tags: A dict of tags the jobs must have.
+        :param limit: Maximum number of jobs to return.
+
+        :returns: A list of matching jobs, newest first.
+        """
+        store = self.multyvac.job_store
+        if not store:
+            raise MultyvacError('The job store is not enabled. Call '
+                                'enable_store() first.')
+        found = store.find(self._store_account(), name=name, status=status,
+                           tags=tags, limit=limit)
+        return self._parse_jobs({'jobs': found})
+
+    def iter_jobs(self, filters=None, fields=None, page_size=100,
+                  prefetch=True):
+        """
+        Iterates over every matching job, newest first, fetching them a page
+        at a time.
+        
+        :param filters: A dict of the keyword arguments of :meth:`list` to
+            filter by: jid, name, before, after, and status.
+        :param fields: The job fields to fetch, or None for all of them.
+            Fetching only the fields needed makes scanning many jobs faster.
+        :param page_size: The number of jobs fetched per request.
+        :param prefetch: Whether to fetch the next page in a background
+            thread while the current one is being consumed.
+        
+        :returns: A generator of Jobs.
+        """
+        params = dict(filters or {})
+        unknown = set(params) - set(['jid', 'name', 'before', 'after',
+                                     'status'])
+        if unknown:
+            raise ValueError('Unknown filters: %s' % ', '.join(sorted(unknown)))
+        MultyvacModule.clear_null_entries(params)
+        params['limit'] = page_size
+        if fields and 'jid' not in fields:
+            # Needed as the cursor
+            fields = list(fields) + ['jid']
+        return self._iter_jobs(params, fields, page_size, prefetch)
+    
+    def _iter_jobs(self, params, fields, page_size, prefetch):
+        """The generator behind :meth:`iter_jobs`, kept separate so that
+        the filters are checked when iter_jobs() is called."""
+        def pages():
+            while True:
+                jobs = self._get(params, fields)
+                if jobs:
+                    yield jobs
+                if len(jobs) < page_size:
+                    return
+                params['before'] = min(job.jid for job in jobs)
+        
+        page_iter = self._prefetch(pages()) if prefetch else pages()
+        for jobs in page_iter:
+            for job in jobs:
+                yield job
+    
+    @staticmethod
+    def _prefetch(iterator):
+        """Yields the items of iterator, computing the next one in a
+        background thread while the current one is being used."""
+        queue = Queue.Queue(maxsize=1)
+        stopped = threading.Event()
+        
+        def produce():
+            try:
+                for item in iterator:
+                    while not stopped.is_set():
+                        try:
+                            queue.put((True, item), timeout=0.1)
+                            break
+                        except Queue.Full:
+                            pass
+                    if stopped.is_set():
+                        return
+                queue.put((False, None))
+            except Exception:
+                queue.put((False, sys.exc_info()))
+        
+        t = threading.Thread(target=produce)
+        t.daemon = True
+        t.start()
+        try:
+            while True:
+                ok, item = queue.get()
+                if ok:
+                    yield item
+                elif item:
+                    raise item[0], item[1], item[2]
+                else:
+                    return
+        finally:
+            # The consumer stopped early or is done
+            stopped.set()
+
+    def get(self, jid, fields=None, timeout=None):
         """
         Returns a Job with corresponding id.
         
         :param jid: Can be a job id or list of job ids.
+        :param timeout: If all jobs cannot be retrieved within this many
+            seconds, DeadlineExceeded is raised.
         
         :returns: A list if input was a list, otherwise returns an object.
             Also, can return None if a single jid is requested, and it cannot
             be found.
         """
         iter_in = MultyvacModule.is_iterable_list(jid)
+        deadline = Deadline(timeout)
         
         if iter_in:
-            jid_to_jobs = {}
-            for jids_chunk in MultyvacModule.list_chunker(jid, 50):
-                jobs = self._get({'jid': jids_chunk}, fields)
+            jid_to_jobs = self._get_stored(jid)
+            missing = [i for i in jid if i not in jid_to_jobs]
+            for jids_chunk in MultyvacModule.list_chunker(missing, 50):
+                jobs = self._get({'jid': jids_chunk}, fields,
+                                 deadline.remaining())
                 for job in jobs:
                     jid_to_jobs[job.jid] = job
             jobs = []
@@ -481,9 +777,12 @@ class JobModule(MultyvacModule):
                 jobs.append(jid_to_jobs[i])
             return jobs
         else:
+            stored = self._get_stored([jid])
+            if stored:
+                return stored[jid]
             params = {'jid': jid,
                       'limit': 1}
-            jobs = self._get(params, fields)
+            jobs = self._get(params, fields, deadline.remaining())
             return jobs[0] if jobs else None
     
     def get_by_name(self, name, fields=None):
@@ -506,7 +805,7 @@ class JobModule(MultyvacModule):
         
         return jobs[0] if jobs else None
     
-    def _get(self, more_params, fields=None):
+    def _get(self, more_params, fields=None, timeout=None):
         
         params = {}
         if fields:
@@ -515,15 +814,147 @@ class JobModule(MultyvacModule):
         
         r = self.multyvac._ask(Multyvac._ASK_GET,
                                '/job',
-                               params=params)
+                               params=params,
+                               timeout=timeout)
+        store = self.multyvac.job_store
+        if store and not fields:
+            store.put(self._store_account(),
+                      [job for job in r['jobs']
+                       if job.get('status') in Job.finished_statuses])
+        if not fields:
+            self._add_to_memo_cache(r['jobs'])
+        return self._parse_jobs(r)
+
+    def enable_resubmission(self, max_specs=10000):
+        """
+        Keeps the specifications of jobs submitted from now on, including
+        their pickled function and arguments, so that
+        ``wait(speculative=True)`` and ``wait(resubmit=True)`` can submit
+        them again. A job's specification is freed once such a wait is done
+        with it.
+        
+        :param max_specs: The most specifications kept. Those of the oldest
+            jobs are dropped first.
+        """
+        with self._specs_lock:
+            self._max_specs = max_specs
+    
+    def enable_store(self, path=None, max_bytes=256*1024*1024):
+        """
+        Keeps finished jobs in a local SQLite database, so that :meth:`get`,
+        :meth:`list`, and :meth:`wait` do not download them again.
+        
+        :param path: Path to the database. Defaults to jobs.sqlite in the
+            Multyvac configuration directory.
+        :param max_bytes: The most space job records may take up before the
+            least recently used ones are evicted.
+        
+        :returns: The :class:`multyvac.jobstore.JobStore`.
+        """
+        from .jobstore import JobStore
+        if path is None:
+            path = os.path.join(self.multyvac.config.get_multyvac_path(),
+                                'jobs.sqlite')
+        self.multyvac.job_store = JobStore(path, max_bytes)
+        return self.multyvac.job_store
+
+    def enable_memoization(self, cache=None, **kwargs):
+        """
+        Turns on the cache used by submit(_memoize=True). Calling submit()
+        with _memoize=True turns it on with the defaults.
+        
+        :param cache: A :class:`multyvac.memo.MemoCache`. Defaults to a
+            :class:`multyvac.memo.LocalMemoCache` in the memo directory of the
+            Multyvac configuration directory, created with kwargs.
+        
+        :returns: The cache.
+        """
+        if cache is None:
+            from .memo import LocalMemoCache
+            cache = LocalMemoCache(
+                os.path.join(self.multyvac.config.get_multyvac_path(), 'memo'),
+                **kwargs)
+        self.multyvac.memo_cache = cache
+        return cache
+    
+    def invalidate_memo(self, jobs_or_jids):
+        """Removes the cache entries of memoized jobs, so that identical calls
+        are submitted again."""
+        cache = self.multyvac.memo_cache
+        if not cache:
+            return
+        jids = [j.jid if isinstance(j, Job) else j for j in jobs_or_jids]
+        for job in self.get(jids, fields=['jid', 'tags']):
+            if (job.tags or {}).get('memo'):
+                cache.invalidate(job.tags['memo'])
+    
+    def _memoized_jid(self, key):
+        """Returns the jid of the cached job for a memo key, or None."""
+        cache = self.multyvac.memo_cache
+        if cache is None:
+            cache = self.enable_memoization()
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        store = self.multyvac.job_store
+        if store:
+            # Lets get() serve the result without a request, even if the
+            # entry came from another machine.
+            store.put(self._store_account(), [entry['job']])
+        return entry['jid']
+    
+    def _add_to_memo_cache(self, jobs):
+        """Caches the successful jobs among full job records from the API
+        that were submitted with _memoize, unless they already have an
+        entry."""
+        cache = self.multyvac.memo_cache
+        if not cache:
+            return
+        for job in jobs:
+            key = (job.get('tags') or {}).get('memo')
+            if key and job.get('status') == Job.status_done:
+                cache.add(key, job)
+    
+    def _store_account(self):
+        """Jids are only unique within an account, so jobs are stored under
+        one."""
+        config = self.multyvac.config
+        return '%s %s' % (config.api_url, config.api_key)
+
+    def _get_stored(self, jids):
+        """Returns a dict of jid to Job for the jids in the job store."""
+        store = self.multyvac.job_store
+        if not store:
+            return {}
+        found = store.get(self._store_account(), jids)
+        jobs = self._parse_jobs({'jobs': found.values()})
+        return dict((job.jid, job) for job in jobs)
+
+    def _parse_jobs(self, r):
+        """Converts the body of a GET to /job into a list of Jobs."""
         for job in r['jobs']:
             if 'created_at' in job:
                 job['created_at'] = MultyvacModule.convert_str_to_datetime(job['created_at'])
-        return [Job(multyvac=self.multyvac, **job) for job in r['jobs']]
+        jobs = [Job(multyvac=self.multyvac, **job) for job in r['jobs']]
+        if self.multyvac.tracer.enabled:
+            for job in jobs:
+                if job.status in Job.finished_statuses:
+                    self.multyvac.tracer.record_job(job)
+        return jobs
 
     @staticmethod
-    def _func_name(func):
-        """Return name of a callable (function, class, partial, etc.)"""
+    def _fname_tag(func):
+        """Returns the name of a callable for its jobs' fname tag, shortened
+        to fit within the length limit of tags."""
+        fname = JobModule._func_name(func)
+        if len(fname) > 100:
+            fname = fname[:97] + '...'
+        return fname
+
+    @staticmethod
+    def _func_name(func, location=True):
+        """Return name of a callable (function, class, partial, etc.). With
+        location, the file and line it is defined at are included."""
         module = ''
         if hasattr(func,'__module__'):
             module = (func.__module__ if func.__module__ else '__main__')
@@ -535,7 +966,7 @@ class JobModule(MultyvacModule):
         elif inspect.isbuiltin(func):
             return  '.'.join([module,func.__name__])
         elif isinstance(func,partial):
-            return 'partial_of_' + JobModule._func_name(func.func)
+            return 'partial_of_' + JobModule._func_name(func.func, location)
         elif inspect.isclass(func):
             nme = '.'.join([module,func.__name__])
             if hasattr(func, '__init__') and inspect.ismethod(func.__init__):            
@@ -547,23 +978,27 @@ class JobModule(MultyvacModule):
             if hasattr(func, '__name__'):
                 nme = '%s of %s' % (func.__name__, type(func))
             return nme
-        nme +=  ' at ' + ':'.join([func.func_code.co_filename,
-                                   str(func.func_code.co_firstlineno)])
+        if location:
+            nme +=  ' at ' + ':'.join([func.func_code.co_filename,
+                                       str(func.func_code.co_firstlineno)])
         return nme
 
-    def kill(self, jid):
+    def kill(self, jid, timeout=None):
         """
         Kills a job. If the job is queued, it will never run. If it's
         processing, it will be abruptly stopped. If it's already finished,
         nothing changes.
         
         :param jid: A job id or list of job ids to kill.
+        :param timeout: If the request does not finish in this many seconds,
+            DeadlineExceeded is raised.
         """
         
         data = {'jid': jid}
         r = self.multyvac._ask(Multyvac._ASK_POST,
                                '/job/kill',
-                               data=data)
+                               data=data,
+                               timeout=timeout)
         return MultyvacModule.check_success(r)
 
     def kill_all(self):
@@ -574,7 +1009,25 @@ class JobModule(MultyvacModule):
                                '/job/kill_all')
         return MultyvacModule.check_success(r)
     
-    def wait(self, jobs_or_jids, timeout=None):
+    @staticmethod
+    def _jids(jobs_or_jids):
+        """Returns the jids of a list of Job objects or jids."""
+        if not hasattr(jobs_or_jids, '__iter__'):
+            raise ValueError('jobs_or_jids must be iterable')
+        
+        jids = []
+        for j in jobs_or_jids:
+            if isinstance(j, Job):
+                jids.append(j.jid)
+            elif isinstance(j, numbers.Integral):
+                jids.append(j)
+            else:
+                raise ValueError('Elements in jobs_or_jids cannot be of '
+                                 'type %s' % type(j))
+        return jids
+    
+    def wait(self, jobs_or_jids, timeout=None, speculative=False,
+             resubmit=None):
         """
         An efficient way to get the results for a batch of jobs.
         
@@ -583,42 +1036,242 @@ class JobModule(MultyvacModule):
         retrieved. Call each returned job's respective `get_result()` function.
         
         :param jobs_or_jids: A list of Job objects or jids.
-        :param float timeout: If the jobs have not finished by this many
-            seconds, the functions return None.
+        :param float timeout: If the jobs have not finished and been
+            retrieved by this many seconds, the functions return None. 0
+            means no timeout, as None does.
+        :param speculative: If True, or a
+            :class:`multyvac.speculation.SpeculationPolicy`, jobs that run
+            much longer than the rest of the batch are duplicated, and the
+            first copy to succeed is returned in place of the job. See
+            :mod:`multyvac.speculation`.
+        :param resubmit: If True, or a
+            :class:`multyvac.resubmit.ResubmitPolicy`, jobs that stalled or
+            ran out of memory are resubmitted, and the last attempt is
+            returned in place of the job. See :mod:`multyvac.resubmit`.
+            Both only apply to jobs submitted after
+            :meth:`enable_resubmission`.
         
         :returns: A list of jobs.
         """
         
-        if not hasattr(jobs_or_jids, '__iter__'):
-            raise ValueError('jobs_or_jids must be iterable')
+        jids = self._jids(jobs_or_jids)
+        timeout = timeout or None
         
-        jids = []
-        for j in jobs_or_jids:
-            if isinstance(j, Job):
-                jids.append(j.jid)
-            elif isinstance(j, numbers.Integral):
-                jids.append(j)
-            else:
-                raise ValueError('Elements in jobs_or_jids cannot be of '
-                                 'type %s' % type(j))
+        if resubmit:
+            from .resubmit import resubmitting_wait
+            policy = None if resubmit is True else resubmit
+            return resubmitting_wait(self, jids, timeout, speculative, policy)
+        
+        if speculative:
+            from .speculation import speculative_wait
+            policy = None if speculative is True else speculative
+            return speculative_wait(self, jids, timeout, policy)
         
         tries = 1
-        start_time = time.time()
+        deadline = Deadline(timeout)
         unfinished_jids = jids[:]
-        while unfinished_jids:
-            current_time = time.time()
-            time_elapsed = current_time - start_time
-            if timeout and time_elapsed > timeout:
-                return None
-            jobs = self.get(unfinished_jids, fields=['jid', 'status'])
-            for job in jobs:
-                if job.status in Job.finished_statuses:
-                    unfinished_jids.remove(job.jid)
-            if unfinished_jids:
-                tries += 1
-                time.sleep(1.0 + min(tries/10.0, 9.0))
+        try:
+            while unfinished_jids:
+                if deadline.remaining() == 0:
+                    return None
+                jobs = self.get(unfinished_jids, fields=['jid', 'status'],
+                                timeout=deadline.remaining())
+                for job in jobs:
+                    if job.status in Job.finished_statuses:
+                        unfinished_jids.remove(job.jid)
+                if unfinished_jids:
+                    tries += 1
+                    time.sleep(deadline.cap(1.0 + min(tries/10.0, 9.0)))
+            
+            return self.get(jids, timeout=deadline.remaining())
+        except DeadlineExceeded:
+            return None
+    
+    def map(self, f, iterable, chunksize=None, raise_on_error=True,
+            target_duration=60.0, **kwargs):
+        """
+        Calls f on every item of iterable, running many items in each job
+        so that the overhead of a job is shared by many items. Blocks until
+        every job finishes.
+        
+        :param chunksize: The number of items per job. By default, items are
+            split into about multyvac.batch.default_job_count jobs. If
+            'adaptive', the number of items is chosen so that each job runs
+            for about target_duration seconds, based on how long f took per
+            item in the past, which is remembered by f's module and name.
+            Functions without estimates are measured by running the first
+            items in chunks of increasing size.
+        :param raise_on_error: If True, the ItemError of the first item for
+            which f raised an exception is raised. If False, such items are
+            returned as ItemErrors, rather than raised.
+        :param target_duration: Seconds each job should run for with
+            chunksize='adaptive'.
+        :param kwargs: The special keys of :meth:`submit`, like _core or
+            _layer, which apply to every job.
+        
+        :returns: A list of results, in the order of the items.
+        """
+        from . import batch
+        if chunksize not in (None, 'adaptive'):
+            JobModule._check_chunksize(chunksize)
+        items = list(iterable)
+        run_chunk = batch.chunk_runner(f)
+        fname = JobModule._fname_tag(f)
+        
+        jobs = []
+        chunk_sizes = []
+        estimates = None
+        if chunksize == 'adaptive':
+            estimates = batch.ChunkEstimates(os.path.join(
+                self.multyvac.config.get_multyvac_path(),
+                'chunk_estimates.json'))
+            # Unlike the fname tag, this does not change when lines are
+            # added above f.
+            key = JobModule._func_name(f, location=False)
+            chunksize = estimates.chunksize(key, target_duration)
+            if chunksize is None:
+                samples, sampled = batch.sample_chunks(items)
+                jobs = self.wait(self._submit_chunks(run_chunk, samples,
+                                                     fname, kwargs))
+                chunk_sizes = [len(chunk) for chunk in samples]
+                estimates.update(key, jobs)
+                items = items[sampled:]
+                chunksize = (estimates.chunksize(key, target_duration) or
+                             batch.default_chunksize(len(items)))
+        elif chunksize is None:
+            chunksize = batch.default_chunksize(len(items))
+        
+        chunks = batch.chunks(items, chunksize)
+        chunk_jobs = self.wait(self._submit_chunks(run_chunk, chunks, fname,
+                                                   kwargs))
+        if estimates:
+            estimates.update(key, chunk_jobs)
+        return batch.unpack(jobs + chunk_jobs,
+                            chunk_sizes + [len(chunk) for chunk in chunks],
+                            raise_on_error)
+    
+    def imap(self, f, iterable, chunksize=1, max_in_flight=100,
+             raise_on_error=True, **kwargs):
+        """
+        Like :meth:`map`, but returns a generator of results, in the order of
+        the items, that consumes iterable as it goes. At most max_in_flight
+        jobs are submitted but not yet consumed at any time, so memory stays
+        bounded however many items there are.
+        
+        Jobs still running when the generator is closed early are killed.
+        
+        :param chunksize: The number of items per job.
+        :param max_in_flight: The most jobs running or holding results that
+            are waiting for earlier items to finish.
+        
+        See :meth:`map` for the other arguments.
+        """
+        JobModule._check_chunksize(chunksize)
+        return self._imap(f, iterable, chunksize, max_in_flight, True,
+                          raise_on_error, kwargs)
+    
+    def imap_unordered(self, f, iterable, chunksize=1, max_in_flight=100,
+                       raise_on_error=True, **kwargs):
+        """
+        Like :meth:`imap`, but results are yielded as soon as their job
+        finishes, regardless of the order of the items.
+        """
+        JobModule._check_chunksize(chunksize)
+        return self._imap(f, iterable, chunksize, max_in_flight, False,
+                          raise_on_error, kwargs)
+    
+    def _imap(self, f, iterable, chunksize, max_in_flight, ordered,
+              raise_on_error, kwargs):
+        """See :meth:`imap`."""
+        from . import batch
+        run_chunk = batch.chunk_runner(f)
+        fname = JobModule._fname_tag(f)
+        items = iter(iterable)
+        # jid -> (chunk number, index of its first item, number of items)
+        in_flight = {}
+        # chunk number -> results, of chunks waiting for earlier ones
+        finished = {}
+        submitted_chunks = 0
+        submitted_items = 0
+        next_chunk = 0
+        exhausted = False
+        interval = 0.5
+        try:
+            while True:
+                while (not exhausted and
+                       len(in_flight) + len(finished) < max_in_flight):
+                    chunk = list(itertools.islice(items, chunksize))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    jid = self._submit_chunks(run_chunk, [chunk], fname,
+                                              kwargs)[0]
+                    in_flight[jid] = (submitted_chunks, submitted_items,
+                                      len(chunk))
+                    submitted_chunks += 1
+                    submitted_items += len(chunk)
+                if not in_flight:
+                    return
+                jobs = self.get(in_flight.keys(), fields=['jid', 'status'])
+                done = [j.jid for j in jobs
+                        if j.status in Job.finished_statuses]
+                if not done:
+                    time.sleep(interval)
+                    interval = min(interval * 1.5, 5.0)
+                    continue
+                interval = 0.5
+                for job in self.get(done):
+                    chunk_number, first_index, size = in_flight.pop(job.jid)
+                    results = batch.unpack([job], [size], raise_on_error,
+                                           first_index)
+                    if ordered:
+                        finished[chunk_number] = results
+                    else:
+                        for result in results:
+                            yield result
+                while next_chunk in finished:
+                    for result in finished.pop(next_chunk):
+                        yield result
+                    next_chunk += 1
+        finally:
+            if in_flight:
+                self.kill(in_flight.keys())
+    
+    @staticmethod
+    def _check_chunksize(chunksize):
+        """Raises ValueError unless chunksize is a positive number of items,
+        before any job is submitted."""
+        if (not isinstance(chunksize, numbers.Integral) or
+                isinstance(chunksize, bool) or chunksize < 1):
+            raise ValueError('chunksize must be a positive integer, not %r' %
+                             (chunksize,))
+    
+    def _submit_chunks(self, run_chunk, chunks, fname, kwargs):
+        """Submits a job per chunk of items for :meth:`map`. Returns their
+        jids."""
+        jids = []
+        for chunk in chunks:
+            # submit() modifies its options, so give each job its own
+            job_kwargs = copy.deepcopy(kwargs)
+            tags = job_kwargs.setdefault('_tags', {})
+            tags.setdefault('fname', fname)
+            tags['map_items'] = len(chunk)
+            jids.append(self.submit(run_chunk, chunk, **job_kwargs))
+        return jids
+    
+    def aggregate_profile(self, jobs_or_jids):
+        """
+        Combines the profiles of a batch of jobs submitted with _profile.
+        
+        :param jobs_or_jids: A list of Job objects or jids.
         
-        return self.get(jids)
+        :returns: A :class:`pstats.Stats`, or None if none of the jobs have a
+            profile.
+        """
+        jids = [j for j in jobs_or_jids if not isinstance(j, Job)]
+        jobs = dict((j.jid, j) for j in self.get(jids)) if jids else {}
+        return profiling.aggregate(j if isinstance(j, Job) else jobs[j]
+                                   for j in jobs_or_jids)
     
     def queue_stats(self):
         """
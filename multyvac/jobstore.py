@@ -0,0 +1,212 @@
+"""
+A local SQLite store of finished jobs. Finished jobs never change, so once
+stored they are served by :meth:`multyvac.job.JobModule.get` and
+:meth:`multyvac.job.JobModule.list` without downloading them again, and can
+be searched by name, status, and tags offline with
+:meth:`multyvac.job.JobModule.list_stored`.
+
+The store is off by default. Turn it on with
+:meth:`multyvac.job.JobModule.enable_store`.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    account TEXT NOT NULL,
+    jid INTEGER NOT NULL,
+    name TEXT,
+    status TEXT,
+    data TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (account, jid)
+);
+CREATE INDEX IF NOT EXISTS jobs_name ON jobs (account, name);
+CREATE INDEX IF NOT EXISTS jobs_accessed ON jobs (accessed);
+CREATE TABLE IF NOT EXISTS job_tags (
+    account TEXT NOT NULL,
+    jid INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (account, jid, key)
+);
+CREATE INDEX IF NOT EXISTS job_tags_key_value ON job_tags (account, key, value);
+"""
+
+class JobStore(object):
+    """
+    Keeps the API's records of finished jobs in a SQLite database. Records
+    are kept per account, since jids are only unique within one.
+
+    When the records take up more than ``max_bytes``, the least recently
+    used ones are evicted. Their total size is kept up to date as records
+    are stored, and only summed up again every ``recount_interval`` puts,
+    to count the records stored by other processes.
+    """
+
+    def __init__(self, path, max_bytes=256*1024*1024, recount_interval=100):
+        """
+        :param path: Path to the SQLite database, created if needed.
+        :param max_bytes: The most space job records may take up.
+        :param recount_interval: Puts between sums of the records' sizes.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.recount_interval = recount_interval
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        # The size of the records, or None if it must be summed up again
+        self._size = None
+        self._puts = 0
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        """Returns this thread's connection. sqlite3 connections cannot be
+        shared across threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return conn
+
+    def put(self, account, jobs):
+        """Stores job dicts as returned by the API. They must be finished and
+        have every field. Jobs already stored are left as they are, since
+        finished jobs never change."""
+        now = time.time()
+        rows = []
+        tag_rows = []
+        for job in jobs:
+            data = json.dumps(job)
+            tags = job.get('tags') or {}
+            rows.append((account, job['jid'], tags.get('name'),
+                         job.get('status'), data, len(data), now))
+            for key, value in tags.items():
+                tag_rows.append((account, job['jid'], key,
+                                 value if isinstance(value, basestring)
+                                 else json.dumps(value)))
+        if not rows:
+            return
+        with self._write_lock:
+            added = 0
+            with self._connection() as conn:
+                for row in rows:
+                    if conn.execute('INSERT OR IGNORE INTO jobs VALUES '
+                                    '(?, ?, ?, ?, ?, ?, ?)', row).rowcount:
+                        added += row[5]
+                conn.executemany('INSERT OR IGNORE INTO job_tags VALUES '
+                                 '(?, ?, ?, ?)', tag_rows)
+            self._puts += 1
+            if self._puts % self.recount_interval == 0:
+                self._size = None
+            if self._size is not None:
+                self._size += added
+            self._evict()
+
+    def get(self, account, jids):
+        """Returns a dict of jid to job dict for the jids in the store."""
+        jids = list(jids)
+        found = {}
+        conn = self._connection()
+        # SQLite limits the number of parameters in a query
+        for i in range(0, len(jids), 500):
+            chunk = jids[i:i+500]
+            cursor = conn.execute(
+                'SELECT jid, data FROM jobs WHERE account = ? AND jid IN (%s)'
+                % ','.join('?' * len(chunk)), [account] + chunk)
+            for jid, data in cursor:
+                found[jid] = json.loads(data)
+        if found:
+            self._touch(account, found.keys())
+        return found
+
+    def find(self, account, name=None, status=None, tags=None, limit=50):
+        """
+        Returns stored job dicts matching all of the given criteria, newest
+        first. Only finished jobs that were stored are searched.
+
+        :param tags: A dict of tags the jobs must have.
+        """
+        query = 'SELECT jobs.jid, jobs.data FROM jobs'
+        where = ['jobs.account = ?']
+        args = [account]
+        for i, (key, value) in enumerate(sorted((tags or {}).items())):
+            query += (' JOIN job_tags t%d ON t%d.account = jobs.account AND '
+                      't%d.jid = jobs.jid' % (i, i, i))
+            where.append('t%d.key = ? AND t%d.value = ?' % (i, i))
+            args.extend([key, value if isinstance(value, basestring)
+                         else json.dumps(value)])
+        if name is not None:
+            where.append('jobs.name = ?')
+            args.append(name)
+        if status is not None:
+            where.append('jobs.status = ?')
+            args.append(status)
+        query += ' WHERE %s ORDER BY jobs.jid DESC LIMIT ?' % ' AND '.join(where)
+        args.append(limit)
+        rows = self._connection().execute(query, args).fetchall()
+        if rows:
+            self._touch(account, [jid for jid, _ in rows])
+        return [json.loads(data) for _, data in rows]
+
+    def delete(self, account, jids):
+        """Removes jobs from the store."""
+        with self._write_lock:
+            with self._connection() as conn:
+                for jid in jids:
+                    conn.execute('DELETE FROM jobs WHERE account = ? AND '
+                                 'jid = ?', (account, jid))
+                    conn.execute('DELETE FROM job_tags WHERE account = ? AND '
+                                 'jid = ?', (account, jid))
+            self._size = None
+
+    def clear(self):
+        """Removes every job from the store."""
+        with self._write_lock:
+            with self._connection() as conn:
+                conn.execute('DELETE FROM jobs')
+                conn.execute('DELETE FROM job_tags')
+            self._size = None
+
+    def size(self):
+        """Returns the number of bytes taken up by job records."""
+        return self._connection().execute(
+            'SELECT COALESCE(SUM(size), 0) FROM jobs').fetchone()[0]
+
+    def _touch(self, account, jids):
+        with self._write_lock:
+            with self._connection() as conn:
+                conn.executemany('UPDATE jobs SET accessed = ? WHERE '
+                                 'account = ? AND jid = ?',
+                                 [(time.time(), account, jid) for jid in jids])
+
+    def _evict(self):
+        """Removes the least recently used records until they take up no
+        more than 90% of max_bytes, to make room for more."""
+        if self._size is None:
+            self._size = self.size()
+        elif self._size > self.max_bytes:
+            # Other processes may have removed records
+            self._size = self.size()
+        if self._size <= self.max_bytes:
+            return
+        size = self._size
+        target = self.max_bytes * 0.9
+        conn = self._connection()
+        evicted = []
+        for account, jid, job_size in conn.execute(
+                'SELECT account, jid, size FROM jobs ORDER BY accessed'):
+            evicted.append((account, jid))
+            size -= job_size
+            if size <= target:
+                break
+        with conn:
+            conn.executemany('DELETE FROM jobs WHERE account = ? AND jid = ?',
+                             evicted)
+            conn.executemany('DELETE FROM job_tags WHERE account = ? AND '
+                             'jid = ?', evicted)
+        self._size = size
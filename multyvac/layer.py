@@ -79,7 +79,8 @@ class Layer(MultyvacModel):
                                params={'path': [path]},
                                )
         f = r['files'][0]
-        f['contents'] = base64.b64decode(f['contents'])
+        with self.multyvac.stats.timer('base64_decode'):
+            f['contents'] = base64.b64decode(f['contents'])
         return f
     
     def get_file(self, remote_path, local_path):
@@ -0,0 +1,92 @@
+"""
+Logging through a queue, so that threads making requests never wait on the
+log file. A :class:`QueueHandler` on the logger puts records in a queue, and
+a :class:`QueueListener` thread writes them out with the real handlers.
+
+These follow logging.handlers.QueueHandler and QueueListener, which are not
+in Python 2.
+"""
+
+import atexit
+import logging
+import Queue
+import threading
+
+class QueueHandler(logging.Handler):
+    """
+    Puts log records in a queue without blocking. Records are dropped if the
+    queue is full, and counted in ``dropped``.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Formats the message and traceback now, so that the record no
+        longer refers to arguments that may change or not pickle."""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def createLock(self):
+        # Queue is thread-safe, so skip the handler lock that logging would
+        # otherwise take around every emit().
+        self.lock = None
+
+_formatter = logging.Formatter()
+
+class QueueListener(object):
+    """Passes records from a queue to handlers in a background thread."""
+
+    _sentinel = None
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='multyvac-log')
+        self._thread.daemon = True
+        self._thread.start()
+        # Daemon threads are killed at exit, so write out what is left.
+        atexit.register(self.stop)
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+            self.handle(record)
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self, timeout=5.0):
+        """Writes out the queued records and stops the thread."""
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(self._sentinel, timeout=timeout)
+        except Queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        for handler in self.handlers:
+            handler.flush()
@@ -0,0 +1,269 @@
+"""
+Memoization of :meth:`multyvac.job.JobModule.submit`. A call made with
+``_memoize=True`` is identified by a hash of its pickled function and
+arguments, along with the layer, core, volumes and environment it runs with.
+If an identical call already finished successfully, submit() returns that
+job's jid instead of submitting a new job.
+
+The hash is put in the job's ``memo`` tag. Finished jobs are added to the
+cache the first time they are retrieved with a full fetch, for example by
+:meth:`multyvac.job.JobModule.get` or :meth:`multyvac.job.JobModule.wait`.
+An entry is never rewritten by fetching its job again, so that its TTL runs
+from when it was first added.
+Each entry also holds the job's record, result included, so that with the
+job store enabled (see :mod:`multyvac.jobstore`) a hit needs no requests.
+
+Entries are kept in a local directory by default. To share them across
+machines, use a :class:`VolumeMemoCache`. See
+:meth:`multyvac.job.JobModule.enable_memoization`.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import posixpath
+import time
+
+def memo_key(payload, layer=None, core=None, multicore=None, vol=None,
+             env=None):
+    """Returns the hex digest identifying a call to submit(). payload is the
+    CloudPickler output of the function and its arguments."""
+    h = hashlib.sha256(payload)
+    h.update(json.dumps({'layer': layer,
+                         'core': core,
+                         'multicore': multicore,
+                         'vol': vol,
+                         'env': env},
+                        sort_keys=True))
+    return h.hexdigest()
+
+class MemoCache(object):
+    """
+    The storage-independent part of a memoization cache. Subclasses
+    implement _read, _write, _delete and _clear for one key at a time.
+    """
+
+    # The most keys add() remembers having entries
+    max_present_keys = 10000
+
+    def __init__(self, ttl=7*24*3600, max_entry_bytes=10*1024*1024):
+        """
+        :param ttl: Seconds an entry is used for after being added. None to
+            keep entries until they are evicted or invalidated.
+        :param max_entry_bytes: Jobs whose record is larger than this, usually
+            because of their result, are not cached.
+        """
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        # Keys known to have an entry, so that add() need not check again
+        self._present = set()
+
+    def get(self, key):
+        """Returns the cached entry for key, a dict with jid, stored_at and
+        job, or None if there is none or it has expired."""
+        data = self._read(key)
+        if data is None:
+            return None
+        entry = json.loads(data)
+        if self.ttl is not None and time.time() - entry['stored_at'] > self.ttl:
+            self.invalidate(key)
+            return None
+        return entry
+
+    def add(self, key, job):
+        """Caches job, like :meth:`put`, unless key already has an entry,
+        even an expired one."""
+        if key in self._present:
+            return
+        if not self._exists(key):
+            self.put(key, job)
+        if len(self._present) >= self.max_present_keys:
+            self._present.clear()
+        self._present.add(key)
+
+    def put(self, key, job):
+        """Caches job, a finished job's record as returned by the API. Does
+        nothing if it is too large."""
+        data = json.dumps({'jid': job['jid'],
+                           'stored_at': time.time(),
+                           'job': job})
+        if len(data) <= self.max_entry_bytes:
+            self._write(key, data)
+
+    def invalidate(self, key):
+        """Removes the entry for key, if any."""
+        self._present.discard(key)
+        self._delete(key)
+
+    def clear(self):
+        """Removes every entry."""
+        self._present.clear()
+        self._clear()
+
+    def _exists(self, key):
+        return self._read(key) is not None
+
+class LocalMemoCache(MemoCache):
+    """
+    Keeps entries as files in a local directory. Once there are more than
+    ``max_entries`` or they take up more than ``max_bytes``, the oldest
+    entries are evicted.
+
+    The number and size of the entries are kept up to date as entries are
+    written and deleted, and the directory is only listed when they exceed
+    the limits, and every ``rescan_interval`` writes to count the entries
+    written by other processes.
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=256*1024*1024,
+                 rescan_interval=1000, **kwargs):
+        MemoCache.__init__(self, **kwargs)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        # The number and total size of the entries, or None until the
+        # directory is listed
+        self._count = None
+        self._bytes = None
+        self._writes = 0
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def _read(self, key):
+        try:
+            with open(self._entry_path(key)) as f:
+                return f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def _exists(self, key):
+        return os.path.exists(self._entry_path(key))
+
+    def _size(self, key):
+        """Returns the size of key's entry, or None if it has none."""
+        try:
+            return os.stat(self._entry_path(key)).st_size
+        except OSError:
+            return None
+
+    def _write(self, key, data):
+        old_size = self._size(key)
+        # Write to a temporary file and rename, so that readers never see a
+        # partial entry.
+        tmp_path = '%s.%d.tmp' % (self._entry_path(key), os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.rename(tmp_path, self._entry_path(key))
+        self._writes += 1
+        if self._count is None or self._writes % self.rescan_interval == 0:
+            self._evict()
+            return
+        if old_size is None:
+            self._count += 1
+        else:
+            self._bytes -= old_size
+        self._bytes += len(data)
+        if self._count > self.max_entries or self._bytes > self.max_bytes:
+            self._evict()
+
+    def _delete(self, key):
+        size = self._size(key)
+        try:
+            os.remove(self._entry_path(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        if self._count is not None and size is not None:
+            self._count -= 1
+            self._bytes -= size
+
+    def _clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                self._delete(name[:-len('.json')])
+        self._count = None
+        self._bytes = None
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name[:-len('.json')]))
+            total += st.st_size
+        entries.sort()
+        if len(entries) > self.max_entries or total > self.max_bytes:
+            # Make room for a tenth more, so that the next writes do not
+            # list the directory again
+            max_entries = self.max_entries * 0.9
+            max_bytes = self.max_bytes * 0.9
+        else:
+            max_entries = self.max_entries
+            max_bytes = self.max_bytes
+        while entries and (len(entries) > max_entries or total > max_bytes):
+            _, size, key = entries.pop(0)
+            self._delete(key)
+            total -= size
+        self._count = len(entries)
+        self._bytes = total
+
+class VolumeMemoCache(MemoCache):
+    """
+    Keeps entries as files in a Multyvac volume, so that they are shared by
+    everyone using it. Only the TTL and max_entry_bytes limit its size;
+    use :meth:`clear` to empty it.
+    """
+
+    def __init__(self, volume, prefix='.multyvac-memo', **kwargs):
+        """
+        :param volume: A :class:`multyvac.volume.Volume`.
+        :param prefix: The directory in the volume to keep entries in.
+        """
+        MemoCache.__init__(self, **kwargs)
+        self.volume = volume
+        self.prefix = prefix
+        self.volume.mkdir(prefix)
+
+    def _entry_path(self, key):
+        return posixpath.join(self.prefix, key + '.json')
+
+    def _read(self, key):
+        from .multyvac import RequestError
+        try:
+            return self.volume.get_contents(self._entry_path(key))['contents']
+        except RequestError as e:
+            if e.http_status_code == 404:
+                return None
+            raise
+
+    def _write(self, key, data):
+        self.volume.put_contents(data, self._entry_path(key))
+
+    def _delete(self, key):
+        from .multyvac import RequestError
+        try:
+            self.volume.rm(self._entry_path(key))
+        except RequestError as e:
+            if e.http_status_code != 404:
+                raise
+
+    def _clear(self):
+        self.volume.rm(self.prefix)
+        self.volume.mkdir(self.prefix)
@@ -0,0 +1,647 @@
+"""
+A local stand-in for the Multyvac API, for testing and benchmarking the
+client without a network.
+
+It implements /job, /job/kill, /job/kill_all, /job/queue_stats, /volume,
+/layer, /cluster and /key with the same JSON shapes the real API returns.
+Python jobs submitted with :meth:`multyvac.job.JobModule.submit` are run in
+worker threads of the server's process, and shell jobs in subprocesses.
+Jobs that need SSH, like volume syncs, cannot be emulated and end in
+error.
+
+Latency, error rate, and rate limiting are configurable::
+
+    from multyvac.mock_server import MockServer
+    server = MockServer(latency=0.02, error_rate=0.01, rate_limit=50)
+    server.start()
+    m = multyvac.Multyvac(api_key='mock', api_secret_key='mock',
+                          api_url=server.url)
+
+Or from the command line: ``python -m multyvac.mock_server --port 8080``.
+"""
+
+import base64
+import BaseHTTPServer
+import cgi
+import datetime
+import json
+import optparse
+import os
+import pickle
+import posixpath
+import Queue
+import random
+import re
+import signal
+import SocketServer
+import subprocess
+import threading
+import time
+import traceback
+import urlparse
+
+from .ratelimit import TokenBucket
+
+_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+def _now_str():
+    return datetime.datetime.utcnow().strftime(_DATE_FORMAT)
+
+class MockError(Exception):
+    """An error response in the API's format."""
+
+    def __init__(self, http_status_code, code, message, retry=False):
+        Exception.__init__(self, message)
+        self.http_status_code = http_status_code
+        self.code = code
+        self.message = message
+        self.retry = retry
+
+class _Storage(object):
+    """An in-memory filesystem for a volume or layer."""
+
+    def __init__(self, **attrs):
+        self.attrs = attrs
+        self.files = {}
+        self.dirs = set([''])
+
+    @staticmethod
+    def _norm(path):
+        return posixpath.normpath('/' + path).lstrip('/')
+
+    def put(self, path, contents, mode):
+        path = self._norm(path)
+        self.files[path] = (contents, mode or 0644)
+        self.dirs.add(posixpath.dirname(path))
+
+    def get(self, path):
+        path = self._norm(path)
+        if path not in self.files:
+            raise MockError(404, 'file_not_found', 'No file at %s' % path)
+        contents, mode = self.files[path]
+        return {'path': path,
+                'mode': mode,
+                'size': len(contents),
+                'contents': base64.b64encode(contents)}
+
+    def mkdir(self, path):
+        self.dirs.add(self._norm(path))
+
+    def ls(self, path):
+        path = self._norm(path)
+        ls = []
+        for f, (contents, mode) in sorted(self.files.items()):
+            if posixpath.dirname(f) == path:
+                ls.append({'path': f, 'mode': mode, 'size': len(contents),
+                           'type': 'f'})
+        for d in sorted(self.dirs):
+            if d and posixpath.dirname(d) == path:
+                ls.append({'path': d, 'mode': 0755, 'size': 0, 'type': 'd'})
+        return ls
+
+    def rm(self, path):
+        path = self._norm(path)
+        for f in list(self.files):
+            if f == path or f.startswith(path + '/'):
+                del self.files[f]
+        for d in list(self.dirs):
+            if d and (d == path or d.startswith(path + '/')):
+                self.dirs.discard(d)
+
+class MockMultyvac(object):
+    """The state and behavior of the mock API, independent of HTTP."""
+
+    def __init__(self, workers=4, run_jobs=True):
+        self.jobs = {}
+        self.volumes = {}
+        self.layers = {}
+        self.clusters = {}
+        self.keys = {}
+        self.run_jobs = run_jobs
+        self._next_jid = 1
+        self._next_cluster_id = 1
+        self._lock = threading.RLock()
+        self._queue = Queue.Queue()
+        # jid -> Popen of the running shell jobs
+        self._processes = {}
+        self._workers = []
+        for _ in range(workers):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    # Jobs
+
+    def submit(self, jobs):
+        jids = []
+        with self._lock:
+            for spec in jobs:
+                jid = self._next_jid
+                self._next_jid += 1
+                tags = dict(spec.get('tags') or {})
+                if spec.get('name'):
+                    tags['name'] = spec['name']
+                self.jobs[jid] = {
+                    'jid': jid,
+                    'cmd': spec['cmd'],
+                    'core': spec.get('core', 'c1'),
+                    'multicore': spec.get('multicore', 1),
+                    'tags': tags,
+                    'status': 'queued',
+                    'created_at': _now_str(),
+                    'result_type': spec.get('result_type', 'binary'),
+                    'max_runtime': spec.get('max_runtime'),
+                    'collected': {},
+                    '_spec': spec,
+                    '_submitted': time.time(),
+                }
+                jids.append(jid)
+                self._queue.put(jid)
+        return jids
+
+    def list_jobs(self, params):
+        jids = set(int(j) for j in params.get('jid', []))
+        names = set(params.get('name', []))
+        statuses = set(params.get('status', []))
+        limit = int(params.get('limit', ['50'])[0])
+        before = params.get('before')
+        after = params.get('after')
+        fields = params.get('field')
+        with self._lock:
+            jobs = []
+            for jid in sorted(self.jobs, reverse=True):
+                job = self.jobs[jid]
+                if ((jids and jid not in jids) or
+                        (names and job['tags'].get('name') not in names) or
+                        (statuses and job['status'] not in statuses) or
+                        (before and jid >= int(before[0])) or
+                        (after and jid <= int(after[0]))):
+                    continue
+                jobs.append(dict((k, v) for k, v in job.items()
+                                 if not k.startswith('_') and
+                                 (not fields or k in fields)))
+                if len(jobs) >= limit:
+                    break
+        return jobs
+
+    def kill(self, jids):
+        with self._lock:
+            for jid in jids:
+                job = self.jobs.get(int(jid))
+                if job and job['status'] not in ('done', 'error', 'killed',
+                                                 'stalled'):
+                    job['status'] = 'killed'
+                    job['finished_at'] = _now_str()
+                    p = self._processes.get(int(jid))
+                    if p:
+                        try:
+                            os.killpg(p.pid, signal.SIGKILL)
+                        except OSError:
+                            # Already exited
+                            pass
+
+    def kill_all(self):
+        with self._lock:
+            self.kill(list(self.jobs))
+
+    def queue_stats(self):
+        stats = {}
+        with self._lock:
+            for job in self.jobs.values():
+                if job['status'] in ('queued', 'processing'):
+                    core_stats = stats.setdefault(job['core'],
+                                                  {'queued': 0,
+                                                   'processing': 0})
+                    core_stats[job['status']] += 1
+        return stats
+
+    def stop(self, timeout=5.0):
+        """Kills the unfinished jobs, and stops the worker threads. Workers
+        still running a Python function after timeout seconds are left to
+        finish it, as daemon threads."""
+        self.kill_all()
+        for _ in self._workers:
+            self._queue.put(None)
+        deadline = time.time() + timeout
+        for t in self._workers:
+            t.join(max(deadline - time.time(), 0))
+
+    def _work(self):
+        while True:
+            jid = self._queue.get()
+            if jid is None:
+                return
+            with self._lock:
+                job = self.jobs[jid]
+                if job['status'] != 'queued':
+                    continue
+                job['status'] = 'processing'
+                job['started_at'] = _now_str()
+                job['queue_delay'] = time.time() - job['_submitted']
+                job['overhead_delay'] = 0.0
+            start = time.time()
+            if self.run_jobs:
+                outcome = self._run(jid, job['_spec'])
+            else:
+                outcome = {'status': 'done', 'result': None}
+            with self._lock:
+                if job['status'] == 'killed':
+                    continue
+                job.update(outcome)
+                job['runtime'] = time.time() - start
+                job['finished_at'] = _now_str()
+                job['collected'] = {'cputime_user': job['runtime'],
+                                    'cputime_system': 0.0,
+                                    'memory_failcnt': 0,
+                                    'memory_max_usage': 0,
+                                    'ports': {}}
+
+    def _run(self, jid, spec):
+        stdin = base64.b64decode(spec['stdin']) if spec.get('stdin') else ''
+        if spec['cmd'] == 'python -m multyvacinit.pybootstrap':
+            try:
+                f, args, kwargs = pickle.loads(stdin)
+                result = f(*args, **kwargs)
+            except Exception:
+                return {'status': 'error', 'stderr': traceback.format_exc(),
+                        'return_code': 1}
+            return {'status': 'done',
+                    'result': base64.b64encode(pickle.dumps(result, 2)),
+                    'stdout': '', 'stderr': '', 'return_code': 0}
+        elif 'multyvacinit/sync.py' in spec['cmd']:
+            return {'status': 'error',
+                    'stderr': 'Syncing is not supported by the mock server',
+                    'return_code': 1}
+        with self._lock:
+            if self.jobs[jid]['status'] == 'killed':
+                return {}
+            # Own process group, so that a kill reaches what the shell
+            # started
+            p = subprocess.Popen(spec['cmd'], shell=True,
+                                 stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 preexec_fn=os.setsid)
+            self._processes[jid] = p
+        try:
+            stdout, stderr = p.communicate(stdin)
+        finally:
+            with self._lock:
+                del self._processes[jid]
+        result_source = spec.get('result_source', 'stdout')
+        if result_source.startswith('file:'):
+            try:
+                with open(result_source[len('file:'):], 'rb') as f:
+                    result = f.read()
+            except IOError:
+                result = None
+        else:
+            result = stdout
+        return {'status': 'done' if p.returncode == 0 else 'error',
+                'result': base64.b64encode(result) if result else None,
+                'stdout': stdout,
+                'stderr': stderr,
+                'return_code': p.returncode}
+
+    # Volumes and layers
+
+    def _storage(self, kind, name):
+        storages = self.volumes if kind == 'volume' else self.layers
+        if name not in storages:
+            raise MockError(404, '%s_not_found' % kind,
+                            'No %s named %s' % (kind, name))
+        return storages[name]
+
+    def create_storage(self, kind, attrs):
+        storages = self.volumes if kind == 'volume' else self.layers
+        with self._lock:
+            if attrs['name'] in storages:
+                raise MockError(400, 'name_exists',
+                                '%s name already exists' % kind)
+            attrs.setdefault('created_at', _now_str())
+            attrs.setdefault('size', 0)
+            if kind == 'volume':
+                attrs.setdefault('mount_type', 'bind')
+            storages[attrs['name']] = _Storage(**attrs)
+
+    def list_storages(self, kind, names):
+        storages = self.volumes if kind == 'volume' else self.layers
+        with self._lock:
+            return [s.attrs for n, s in sorted(storages.items())
+                    if not names or n in names]
+
+    # Clusters
+
+    def provision(self, attrs):
+        with self._lock:
+            cid = self._next_cluster_id
+            self._next_cluster_id += 1
+            attrs.update({'id': cid,
+                          'state': 'provisioned',
+                          'requested_at': _now_str(),
+                          'provisioned_at': _now_str(),
+                          'released_at': None,
+                          'duration': 0})
+            self.clusters[cid] = attrs
+        return cid
+
+    def cluster(self, cid):
+        if int(cid) not in self.clusters:
+            raise MockError(404, 'cluster_not_found', 'No cluster %s' % cid)
+        return self.clusters[int(cid)]
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    routes = [
+        ('POST', r'/job$', 'job_submit'),
+        ('GET', r'/job$', 'job_list'),
+        ('POST', r'/job/kill$', 'job_kill'),
+        ('POST', r'/job/kill_all$', 'job_kill_all'),
+        ('GET', r'/job/queue_stats$', 'job_queue_stats'),
+        ('GET', r'/(volume|layer)$', 'storage_list'),
+        ('POST', r'/(volume|layer)$', 'storage_create'),
+        ('PUT', r'/(volume|layer)/([^/]+)$', 'storage_put'),
+        ('GET', r'/(volume|layer)/([^/]+)$', 'storage_get'),
+        ('PUT', r'/(volume|layer)/([^/]+)/mkdir$', 'storage_mkdir'),
+        ('GET', r'/(volume|layer)/([^/]+)/ls$', 'storage_ls'),
+        ('POST', r'/(volume|layer)/([^/]+)/rm$', 'storage_rm'),
+        ('GET', r'/cluster$', 'cluster_list'),
+        ('POST', r'/cluster$', 'cluster_provision'),
+        ('GET', r'/cluster/(\d+)$', 'cluster_get'),
+        ('POST', r'/cluster/(\d+)/release$', 'cluster_release'),
+        ('PATCH', r'/cluster/(\d+)/update_max_duration$', 'cluster_update'),
+        ('GET', r'/key$', 'key_list'),
+        ('POST', r'/key/([^/]+)/(activate|deactivate)$', 'key_activate'),
+        ('POST', r'/report/.*', 'ok'),
+    ]
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+    def _dispatch(self, method):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        self.query = urlparse.parse_qs(url.query)
+        path = url.path
+        if path.startswith(server.prefix):
+            path = path[len(server.prefix):]
+        try:
+            self.body = self._read_body()
+            server.inject_faults()
+            for route_method, pattern, handler in self.routes:
+                match = re.match(pattern, path)
+                if route_method == method and match:
+                    obj = getattr(self, handler)(*match.groups())
+                    break
+            else:
+                raise MockError(404, 'not_found', 'No route for %s' % path)
+            self._respond(200, obj)
+        except MockError as e:
+            headers = {}
+            if e.http_status_code == 429:
+                headers['Retry-After'] = '%.2f' % server.retry_after
+            self._respond(e.http_status_code,
+                          {'error': {'code': e.code,
+                                     'message': e.message,
+                                     'retry': e.retry}},
+                          headers)
+        except Exception:
+            # A bug in the mock, or a request it cannot handle. Answer like
+            # the API would rather than dropping the connection.
+            self._respond(500,
+                          {'error': {'code': 'internal_error',
+                                     'message': traceback.format_exc(),
+                                     'retry': False}})
+
+    def _read_body(self):
+        content_type = self.headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            form = cgi.FieldStorage(fp=self.rfile, headers=self.headers,
+                                    environ={'REQUEST_METHOD': 'POST'})
+            return form
+        length = int(self.headers.get('content-length') or 0)
+        raw = self.rfile.read(length) if length else ''
+        if content_type.startswith('application/json'):
+            return json.loads(raw)
+        return urlparse.parse_qs(raw)
+
+    def _respond(self, status, obj, headers=None):
+        body = json.dumps(obj)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _param(self, name, default=None):
+        values = self.query.get(name) or (
+            self.body.get(name) if isinstance(self.body, dict) else None)
+        return values[0] if values else default
+
+    @property
+    def api(self):
+        return self.server.api
+
+    def ok(self, *args):
+        return {'status': 'ok'}
+
+    def job_submit(self):
+        return {'jids': self.api.submit(self.body['jobs'])}
+
+    def job_list(self):
+        return {'jobs': self.api.list_jobs(self.query)}
+
+    def job_kill(self):
+        self.api.kill(self.body.get('jid', []))
+        return self.ok()
+
+    def job_kill_all(self):
+        self.api.kill_all()
+        return self.ok()
+
+    def job_queue_stats(self):
+        return {'stats': self.api.queue_stats()}
+
+    def storage_list(self, kind):
+        return {kind + 's': self.api.list_storages(kind,
+                                                   self.query.get('name'))}
+
+    def storage_create(self, kind):
+        self.api.create_storage(kind, dict(self.body[kind]))
+        return self.ok()
+
+    def storage_put(self, kind, name):
+        item = self.body['file']
+        mode = self.body.getfirst('file_mode')
+        self.api._storage(kind, name).put(item.filename, item.value,
+                                          int(mode) if mode else None)
+        return self.ok()
+
+    def storage_get(self, kind, name):
+        storage = self.api._storage(kind, name)
+        return {'files': [storage.get(p) for p in self.query.get('path', [])]}
+
+    def storage_mkdir(self, kind, name):
+        self.api._storage(kind, name).mkdir(self._param('path', ''))
+        return self.ok()
+
+    def storage_ls(self, kind, name):
+        return {'ls': self.api._storage(kind, name).ls(self._param('path', ''))}
+
+    def storage_rm(self, kind, name):
+        self.api._storage(kind, name).rm(self._param('path', ''))
+        return self.ok()
+
+    def cluster_list(self):
+        return {'clusters': self.api.clusters.values()}
+
+    def cluster_provision(self):
+        return {'id': self.api.provision(dict(self.body['cluster']))}
+
+    def cluster_get(self, cid):
+        return {'cluster': self.api.cluster(cid)}
+
+    def cluster_release(self, cid):
+        cluster = self.api.cluster(cid)
+        cluster['state'] = 'released'
+        cluster['released_at'] = _now_str()
+        return self.ok()
+
+    def cluster_update(self, cid):
+        self.api.cluster(cid)['max_duration'] = float(
+            self._param('max_duration'))
+        return self.ok()
+
+    def key_list(self):
+        ids = self.query.get('id')
+        return {'keys': [k for k in self.api.keys.values()
+                         if not ids or k['id'] in ids]}
+
+    def key_activate(self, key_id, action):
+        key = self.api.keys.get(key_id)
+        if not key:
+            raise MockError(404, 'key_not_found', 'No key %s' % key_id)
+        key['active'] = action == 'activate'
+        return self.ok()
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    An HTTP server that behaves like the Multyvac API. See the module
+    documentation.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0,
+                 rate_limit=None, burst=10, retry_after=1.0, workers=4,
+                 run_jobs=True, prefix='/v1', verbose=False):
+        """
+        :param port: The port to listen on. 0 picks a free one.
+        :param latency: Seconds added to every request. Can be a
+            (min, max) tuple to pick a random latency for each request.
+        :param error_rate: Fraction of requests that fail with a retryable
+            503 error.
+        :param rate_limit: Requests per second allowed before responding
+            with 429. None for no limit.
+        :param burst: Requests that can be made back to back before the
+            rate limit applies.
+        :param retry_after: Value of the Retry-After header of 429s.
+        :param workers: Number of jobs run at once.
+        :param run_jobs: If False, jobs finish immediately with no result.
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.prefix = prefix
+        self.verbose = verbose
+        self._bucket = (TokenBucket(rate_limit, burst)
+                        if rate_limit is not None else None)
+        self._bucket_lock = threading.Lock()
+        self.api = MockMultyvac(workers, run_jobs)
+        self.api.keys['mock'] = {'id': 'mock', 'secret_key': 'mock',
+                                 'active': True, 'public_key': '',
+                                 'private_key': '', 'created': _now_str()}
+        self.counts = {'requests': 0, 'errors': 0, 'rate_limited': 0}
+        self._thread = None
+
+    @property
+    def url(self):
+        """The api_url to configure a Multyvac object with."""
+        return 'http://%s:%d%s' % (self.server_address[0],
+                                   self.server_address[1],
+                                   self.prefix)
+
+    def inject_faults(self):
+        """Sleeps and raises errors as configured. Called for each
+        request."""
+        with self._bucket_lock:
+            self.counts['requests'] += 1
+            if self._bucket:
+                limited = not self._bucket.try_acquire()
+                if limited:
+                    self.counts['rate_limited'] += 1
+                    raise MockError(429, 'rate_limited', 'Too many requests',
+                                    retry=True)
+            if self.error_rate and random.random() < self.error_rate:
+                self.counts['errors'] += 1
+                raise MockError(503, 'unavailable',
+                                'Service temporarily unavailable', retry=True)
+        latency = self.latency
+        if isinstance(latency, tuple):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def start(self):
+        """Serves requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving, and stops the worker threads of the mock API."""
+        self.shutdown()
+        self.server_close()
+        self.api.stop()
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--latency', type='float', default=0.0)
+    parser.add_option('--error-rate', type='float', default=0.0)
+    parser.add_option('--rate-limit', type='float', default=None)
+    parser.add_option('--workers', type='int', default=4)
+    parser.add_option('--verbose', action='store_true', default=False)
+    options, _ = parser.parse_args()
+    server = MockServer(options.host, options.port, options.latency,
+                        options.error_rate, options.rate_limit,
+                        workers=options.workers, verbose=options.verbose)
+    print 'Mock Multyvac API listening at %s' % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,11 @@ import datetime
 import json
 import logging
 import os
-import random
+import Queue
+import signal
 import subprocess
 import sys
+import threading
 import time
 
 try:
@@ -14,8 +16,24 @@ try:
 except ImportError:
     from logging.handlers import RotatingFileHandler
 
-import requests
-from requests.exceptions import ConnectionError
+from logqueue import (
+    QueueHandler,
+    QueueListener,
+)
+from ratelimit import (
+    RateLimiter,
+    default_rate_limiter,
+)
+from retry import (
+    CircuitBreaker,
+    RetryBudget,
+    RetryPolicy,
+)
+from stats import (
+    StatsCollector,
+    endpoint_template,
+)
+from tracing import Tracer
 from util.cygwin import regularize_path
 
 class MultyvacError(Exception):
@@ -58,6 +76,64 @@ class SyncError(MultyvacError):
                     message=self.message,
                 )
 
+class DeadlineExceeded(MultyvacError):
+    """Raised when an operation could not finish within the time it was
+    given."""
+    pass
+
+class Deadline(object):
+    """
+    The point in time by which an operation must finish. Create one from the
+    timeout a caller passed in, and consult it before every blocking step.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        :param timeout: Seconds from now until the deadline. If None, there
+            is no deadline.
+        """
+        self.expires_at = time.time() + timeout if timeout is not None else None
+
+    def remaining(self):
+        """Returns the number of seconds left, or None if there is no
+        deadline."""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.time(), 0.0)
+
+    def remaining_or_raise(self, what='Operation'):
+        """Like remaining(), but raises DeadlineExceeded instead of returning
+        0.0 once the deadline has passed. For passing the time left to
+        methods that take a timeout of 0 to mean no timeout."""
+        remaining = self.remaining()
+        if remaining == 0:
+            raise DeadlineExceeded('%s did not finish in time' % what)
+        return remaining
+
+    def cap(self, seconds):
+        """Returns seconds, or the time remaining if that is shorter."""
+        remaining = self.remaining()
+        if remaining is None:
+            return seconds
+        elif seconds is None:
+            return remaining
+        return min(seconds, remaining)
+
+    def check(self, what='Operation'):
+        """Raises DeadlineExceeded if the deadline has passed."""
+        if self.expires_at is not None and time.time() >= self.expires_at:
+            raise DeadlineExceeded('%s did not finish in time' % what)
+
+class CircuitOpenError(MultyvacError):
+    """Raised when a request is not sent because too many recent requests to
+    the Multyvac API have failed. See :class:`multyvac.retry.CircuitBreaker`."""
+    pass
+
+# Log file path to the QueueListener writing to it. Shared by all Multyvac
+# objects, so that each file has a single writer thread.
+_log_listeners = {}
+_log_listeners_lock = threading.Lock()
+
 class Multyvac(object):
     """
     Multyvac
@@ -71,8 +147,34 @@ class Multyvac(object):
     _ASK_PUT = 'PUT'
     _ASK_PATCH = 'PATCH'
 
+    # Log records waiting to be written beyond this are dropped, so that
+    # logging never blocks a request.
+    _LOG_QUEUE_SIZE = 10000
+
     def __init__(self, api_key=None, api_secret_key=None, api_url=None):
-        self._session = requests.session()
+        # Created on first use, since importing requests is slow.
+        self._http_session = None
+
+        # Shared by all threads using this object. Replace them to customize
+        # how requests and syncs are retried.
+        self.retry_policy = RetryPolicy(budget=RetryBudget(),
+                                        breaker=CircuitBreaker())
+        self.sync_retry_policy = RetryPolicy(min_delay=0.0,
+                                             budget=RetryBudget())
+        # Shared by all Multyvac objects in this process by default.
+        self.rate_limiter = default_rate_limiter
+        # Seconds to wait for a connection to be established, and for data
+        # to arrive once connected. Applies to every request and sync.
+        self.connect_timeout = 10.0
+        self.read_timeout = 120.0
+        # Metrics about requests and syncs. See StatsCollector.snapshot().
+        self.stats = StatsCollector()
+        # Off until an exporter is added. See multyvac.tracing.
+        self.tracer = Tracer()
+        # Off until JobModule.enable_store() is called. See multyvac.jobstore.
+        self.job_store = None
+        # Off until JobModule.enable_memoization() is called. See multyvac.memo.
+        self.memo_cache = None
 
         from .config import ConfigModule
         # Note: At this time, the rest of the Multyvac modules have not been
@@ -105,7 +207,8 @@ class Multyvac(object):
 
     def _setup_logger(self):
         """
-        Sets up a rotating file logger.
+        Sets up a rotating file logger. Records are written by a background
+        thread, so that threads making requests do not wait on the file.
         TODO: Have config option for printing to screen.
         """
 
@@ -117,6 +220,14 @@ class Multyvac(object):
         self._logger = logging.getLogger('multyvac')
         self._logger.setLevel(logging.ERROR)
 
+        with _log_listeners_lock:
+            if log_path not in _log_listeners:
+                _log_listeners[log_path] = self._setup_log_handler(logs_path,
+                                                                   log_path)
+
+    def _setup_log_handler(self, logs_path, log_path):
+        """Opens the log file, and returns a started QueueListener writing to
+        it the records queued by the multyvac logger."""
         if os.name == 'nt':
             from logging import FileHandler
             try:
@@ -147,7 +258,18 @@ class Multyvac(object):
             '[%(asctime)s] - [%(levelname)s] - %(name)s: %(message)s'
         )
         handler.setFormatter(formatter)
-        self._logger.addHandler(handler)
+        listener = QueueListener(Queue.Queue(self._LOG_QUEUE_SIZE), handler)
+        listener.start()
+        self._logger.addHandler(QueueHandler(listener.queue))
+        return listener
+
+    @property
+    def _session(self):
+        """The requests session used for every API request."""
+        if self._http_session is None:
+            import requests
+            self._http_session = requests.session()
+        return self._http_session
 
     def _get_session_method(self, method):
         """
@@ -168,6 +290,8 @@ class Multyvac(object):
     def _log_ask(self, method, uri, params, data, headers, files):
         """Use this to log a request.  It only logs params and data elements
         that are not overly large to prevent filling up the log."""
+        if not self._logger.isEnabledFor(logging.INFO):
+            return
         self._logger.info('%s request to %s with params %r data %r files %r',
                           method,
                           uri,
@@ -194,7 +318,7 @@ class Multyvac(object):
             return ele
 
     def _ask(self, method, uri, auth=None, params=None, data=None,
-             headers=None, files=None, content_type_json=False):
+             headers=None, files=None, content_type_json=False, timeout=None):
         """
         Makes an HTTP request to Multyvac.
 
@@ -211,18 +335,34 @@ class Multyvac(object):
         :param content_type_json: Whether the request body should be encoded as
             JSON, along with the appropriate content-type header. If False,
             regular form encoding is used.
+        :param timeout: The number of seconds the request, including all of
+            its retries, may take. If exceeded, DeadlineExceeded is raised.
         """
+        from requests.exceptions import ConnectionError, Timeout
+
         if content_type_json:
             headers = headers or {}
             headers['content-type'] = 'application/json'
-            final_data = json.dumps(data)
+            with self.stats.timer('json_encode'):
+                final_data = json.dumps(data)
         else:
             final_data = data
 
-        attempt = 0
-        max_attempts = 5
+        deadline = Deadline(timeout)
+        what = '%s request to %s' % (method, uri)
+        endpoint_class = RateLimiter.classify(method, uri, files)
+        retry = self.retry_policy.begin()
         while True:
+            # Whatever may raise before the request is sent comes before
+            # allow(), which can make this attempt the circuit breaker's probe.
+            if not self.rate_limiter.acquire(endpoint_class,
+                                             deadline.remaining()):
+                raise DeadlineExceeded('%s did not finish in time' % what)
+            deadline.check(what)
             self._log_ask(method, uri, params, data, headers, files)
+            if not retry.allow():
+                raise CircuitOpenError('Not sending %s since the Multyvac API '
+                                       'is failing' % what)
             try:
                 r = self._ask_helper(method,
                                      uri,
@@ -230,59 +370,112 @@ class Multyvac(object):
                                      params=params,
                                      data=final_data,
                                      headers=headers,
-                                     files=files)
-                return r
-            except (RequestError, ConnectionError) as e:
-                attempt += 1
-                min_delay = 1.0
-                if isinstance(e, RequestError) and e.http_status_code == 429:
-                    # Add another attempt if error was due to rate limiting.
-                    # This also increases the range of exponential backoff.
-                    max_attempts += 1
-                    min_delay = 5.0
-                if ((isinstance(e, ConnectionError) or e.retry)
-                        and attempt < max_attempts):
-                    delay = max(2**attempt * random.random(), min_delay)
-                    self._logger.info('Request failed. Retrying in %.1fs',
-                                      delay)
-                    time.sleep(delay)
-                    continue
+                                     files=files,
+                                     timeout=(deadline.cap(self.connect_timeout),
+                                              deadline.cap(self.read_timeout)))
+            except (RequestError, ConnectionError, Timeout) as e:
+                rate_limited = (isinstance(e, RequestError) and
+                                e.http_status_code == 429)
+                if isinstance(e, RequestError):
+                    retryable = e.retry
+                elif isinstance(e, ConnectionError):
+                    retryable = True
                 else:
+                    # The request may have been processed even though the
+                    # response never came, so only idempotent ones are safe
+                    # to repeat.
+                    retryable = method == self._ASK_GET
+                # The rate limiter paces the retry of a rate limited request,
+                # so there is no need to back off on top of it.
+                delay = retry.failed(
+                    retryable,
+                    rate_limited,
+                    (self.rate_limiter.retry_after(endpoint_class)
+                     if rate_limited else None),
+                )
+                if delay is None:
+                    deadline.check(what)
                     raise
+                remaining = deadline.remaining()
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded('%s did not finish in time' % what)
+                self._logger.info('Request failed. Retrying in %.1fs', delay)
+                self.stats.count('retries', (method, endpoint_template(uri)))
+                time.sleep(delay)
+            else:
+                retry.succeeded()
+                return r
+            finally:
+                retry.release()
 
-    def _ask_helper(self, method, uri, auth, params, data, headers, files):
-        """See _ask()."""
+    def _ask_helper(self, method, uri, auth, params, data, headers, files,
+                    timeout=None):
+        """See _ask(). The timeout is passed to requests as is."""
+        from requests.exceptions import ConnectionError, Timeout
 
         if not auth:
             auth = self.config.get_auth()
 
-        r = self._get_session_method(method)(
-                self.config.api_url + uri,
-                auth=auth,
-                params=params,
-                data=data,
-                headers=headers,
-                files=files,
-            )
+        start = time.time()
+        try:
+            with self.tracer.span('http', method=method,
+                                  endpoint=endpoint_template(uri)):
+                r = self._get_session_method(method)(
+                        self.config.api_url + uri,
+                        auth=auth,
+                        params=params,
+                        data=data,
+                        headers=headers,
+                        files=files,
+                        timeout=timeout,
+                    )
+        except (ConnectionError, Timeout):
+            self.stats.record_request(method, uri, None, time.time() - start,
+                                      0, 0)
+            raise
+        body = r.request.body
+        self.stats.record_request(method, uri, r.status_code,
+                                  time.time() - start,
+                                  len(body) if hasattr(body, '__len__') else 0,
+                                  len(r.content))
+        self.rate_limiter.observe(RateLimiter.classify(method, uri, files),
+                                  r.status_code,
+                                  r.headers)
+
+        def load_json():
+            with self.stats.timer('json_decode'):
+                return r.json()
+        return self._parse_response(r.status_code, r.text, load_json)
+
+    @staticmethod
+    def _parse_response(status_code, text, load_json):
+        """
+        Converts an API response into a dict, raising a RequestError if the
+        API reported an error.
 
+        :param status_code: HTTP status code of the response.
+        :param text: Body of the response.
+        :param load_json: Callable that returns the body decoded as JSON, or
+            raises a ValueError.
+        """
         try:
-            obj = r.json()
+            obj = load_json()
         except ValueError:
-            if r.status_code >= 500:
+            if status_code >= 500:
                 # Retry on 5** error codes returning non-JSON (probably HTML)
                 # Bad gateway is a common example where we want to do this.
-                raise RequestError(r.status_code,
+                raise RequestError(status_code,
                                    None,
-                                   r.text,
+                                   text,
                                    retry=True)
             else:
                 # Unexpected error
-                raise RequestError(r.status_code,
+                raise RequestError(status_code,
                                    None,
                                    'Could not parse body',
-                                   hint=r.text)
+                                   hint=text)
         if 'error' in obj:
-            raise RequestError(r.status_code,
+            raise RequestError(status_code,
                                obj['error']['code'],
                                obj['error']['message'],
                                obj['error'].get('hint'),
@@ -290,70 +483,123 @@ class Multyvac(object):
 
         return obj
 
-    def _sync_up(self, local_path, remote_address, remote_path, port):
+    def _sync_up(self, local_path, remote_address, remote_path, port,
+                 timeout=None):
         """Sync from local path to Multyvac."""
         dest = 'multyvac@{address}:{path}'.format(address=remote_address,
                                                   path=remote_path)
-        return self._sync(local_path, dest, port)
+        return self._sync(local_path, dest, port, timeout)
 
-    def _sync_down(self, remote_address, remote_path, port, local_path):
+    def _sync_down(self, remote_address, remote_path, port, local_path,
+                   timeout=None):
         """Sync from Multyvac to local path."""
         src = 'multyvac@{address}:{path}'.format(address=remote_address,
                                                  path=remote_path)
-        return self._sync(src, local_path, port)
+        return self._sync(src, local_path, port, timeout)
 
-    def _sync(self, src, dest, port):
-        """Sync from source to destination using rsync."""
+    def _sync(self, src, dest, port, timeout=None):
+        """Sync from source to destination using rsync. If the sync and its
+        retries take more than timeout seconds, DeadlineExceeded is
+        raised."""
 
-        attempt = 0
-        max_attempts = 5
+        deadline = Deadline(timeout)
+        retry = self.sync_retry_policy.begin()
         while True:
+            deadline.check('Sync')
+            if not retry.allow():
+                raise SyncError(None, 'Not syncing since too many recent '
+                                      'syncs have failed')
+            start = time.time()
             try:
-                return self._sync_helper(src, dest, port)
+                with self.tracer.span('rsync'):
+                    r = self._sync_helper(src, dest, port, deadline.remaining())
             except SyncError as e:
-                attempt += 1
+                self.stats.observe('sync_seconds', (), time.time() - start)
                 # connection refused errors return 255
-                if e.exit_status == 255 and attempt < max_attempts:
-                    delay = 2**attempt * random.random()
-                    self._logger.info('Sync failed. Retrying in %.1fs',
-                                      delay)
-                    time.sleep(delay)
-                    continue
-                else:
+                delay = retry.failed(e.exit_status == 255)
+                if delay is None:
                     raise
+                remaining = deadline.remaining()
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded('Sync did not finish in time')
+                self._logger.info('Sync failed. Retrying in %.1fs',
+                                  delay)
+                self.stats.count('sync_retries', ())
+                time.sleep(delay)
+            else:
+                self.stats.observe('sync_seconds', (), time.time() - start)
+                retry.succeeded()
+                return r
+            finally:
+                retry.release()
 
-    def _sync_helper(self, src, dest, port):
+    def _sync_helper(self, src, dest, port, timeout=None):
         """The port might apply to either the src or the dest, depending on
-        which one is remote."""
+        which one is remote. If rsync runs for more than timeout seconds, it
+        is killed and DeadlineExceeded is raised."""
 
         on_windows = os.name == 'nt'
-
-        cmd = ('{rsync_bin} -avz -L -e "{ssh_bin} -o UserKnownHostsFile=/dev/null '
-               '-o StrictHostKeyChecking=no -p {port} -i {key_path}" {chmod} '
-               '{src} {dest}'.format(
-                    rsync_bin=self._rsync_bin,
-                    ssh_bin=self._ssh_bin,
-                    port=port,
-                    key_path=regularize_path(self.config.path_to_private_key()),
-                    chmod='--chmod=u+rwx' if on_windows else '',
-                    src=src,
-                    dest=dest)
-               )
         p = subprocess.Popen(
-            cmd,
+            self._sync_cmd(src, dest, port),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             # close_fds not supported on Windows with stdout/stderr redirection
             close_fds=not on_windows,
             shell=True,
+            # Own process group, so that rsync and ssh can be killed along
+            # with the shell that started them.
+            preexec_fn=None if on_windows else os.setsid,
         )
-        _, stderr = p.communicate()
+        killer = None
+        timed_out = []
+        if timeout is not None:
+            # Popen.communicate() has no timeout, so kill rsync from another
+            # thread if it runs too long.
+            def kill():
+                timed_out.append(True)
+                try:
+                    if on_windows:
+                        p.kill()
+                    else:
+                        os.killpg(p.pid, signal.SIGKILL)
+                except OSError:
+                    # Already exited
+                    pass
+            killer = threading.Timer(timeout, kill)
+            killer.start()
+        try:
+            _, stderr = p.communicate()
+        finally:
+            if killer:
+                killer.cancel()
+        if timed_out:
+            raise DeadlineExceeded('Sync did not finish in time')
         if p.poll() != 0:
             self._logger.info('Sync had error:\n%s',
                               stderr)
             raise SyncError(p.poll(), stderr)
 
-    def on_multyvac(self):
+    def _sync_cmd(self, src, dest, port):
+        """Returns the shell command that rsyncs src to dest."""
+
+        on_windows = os.name == 'nt'
+        return ('{rsync_bin} -avz -L --timeout={io_timeout} -e "{ssh_bin} '
+                '-o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no '
+                '-o ConnectTimeout={connect_timeout} -p {port} -i {key_path}" '
+                '{chmod} {src} {dest}'.format(
+                     rsync_bin=self._rsync_bin,
+                     io_timeout=int(self.read_timeout),
+                     ssh_bin=self._ssh_bin,
+                     connect_timeout=int(self.connect_timeout),
+                     port=port,
+                     key_path=regularize_path(self.config.path_to_private_key()),
+                     chmod='--chmod=u+rwx' if on_windows else '',
+                     src=src,
+                     dest=dest)
+                )
+
+    @staticmethod
+    def on_multyvac():
         """Returns True if this process is currently running on Multyvac."""
         return os.getenv('ON_MULTYVAC') == 'true'
 
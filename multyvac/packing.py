@@ -0,0 +1,189 @@
+"""
+Packs jobs with mixed ``_multicore`` sizes into a cluster, so that its cores
+stay busy::
+
+    from multyvac.packing import ClusterPacker
+    packer = ClusterPacker(multyvac.cluster.get(cluster_id))
+    for x, cores, seconds in work:
+        packer.submit(f, x, _multicore=cores, _estimate=seconds)
+    report = packer.run()
+    print report.utilization
+
+Every job gives an estimate of its runtime in seconds with ``_estimate``.
+Jobs are taken longest first (LPT), and each time cores free up, the first
+of the remaining jobs that fits in them is submitted, so that small jobs
+fill the gaps left by large ones. Nothing is submitted while it would not
+fit, so jobs never wait in the queue for cores held by other jobs of the
+packer.
+
+:meth:`ClusterPacker.plan` simulates the same schedule with the estimates.
+:meth:`ClusterPacker.run` returns a :class:`PackingReport` with the
+utilization achieved, measured from when the client sees jobs finish.
+"""
+
+import heapq
+import time
+
+class PackedJob(object):
+    """A job waiting for cores in a :class:`ClusterPacker`."""
+
+    def __init__(self, submit, args, kwargs, multicore, estimate):
+        self.multicore = multicore
+        self.estimate = estimate
+        self.jid = None
+        self.job = None
+        self._submit = submit
+        self._args = args
+        self._kwargs = kwargs
+
+    def __repr__(self):
+        return 'PackedJob(%s, multicore=%s, estimate=%s)' % (
+            self.jid, self.multicore, self.estimate)
+
+class PackingReport(object):
+    """How well a :class:`ClusterPacker` used its cores."""
+
+    def __init__(self, core_count, makespan, busy_core_seconds,
+                 planned_makespan, planned_utilization):
+        self.core_count = core_count
+        self.makespan = makespan
+        self.busy_core_seconds = busy_core_seconds
+        self.planned_makespan = planned_makespan
+        self.planned_utilization = planned_utilization
+
+    @property
+    def utilization(self):
+        """The fraction of the cluster's core seconds that jobs held."""
+        if not self.makespan:
+            return 0.0
+        return self.busy_core_seconds / (self.core_count * self.makespan)
+
+    def __repr__(self):
+        return ('PackingReport(makespan=%.1f, utilization=%.3f, '
+                'planned_utilization=%.3f)' % (self.makespan,
+                                               self.utilization,
+                                               self.planned_utilization))
+
+class ClusterPacker(object):
+    """Submits jobs to a cluster as cores free up. See the module
+    documentation."""
+
+    def __init__(self, cluster, multyvac=None, poll_interval=1.0):
+        """
+        :param cluster: A :class:`multyvac.cluster.Cluster`, whose core type
+            jobs are submitted to unless they set ``_core``. Or the number of
+            cores to pack jobs into.
+        :param multyvac: The Multyvac object to use. Defaults to the one used
+            by the top-level functions of the multyvac module.
+        :param poll_interval: Seconds between checks for finished jobs.
+        """
+        if multyvac is None:
+            import multyvac as _multyvac_module
+            multyvac = _multyvac_module._default()
+        self.multyvac = multyvac
+        if isinstance(cluster, (int, long)):
+            self.core = None
+            self.core_count = cluster
+        else:
+            self.core = cluster.core
+            self.core_count = cluster.core_count
+        self.poll_interval = poll_interval
+        self.jobs = []
+
+    def submit(self, f, *args, **kwargs):
+        """Adds a Python function job. Takes the same arguments as
+        :meth:`multyvac.job.JobModule.submit`, and ``_estimate``, its
+        estimated runtime in seconds."""
+        return self._add(self.multyvac.job.submit, (f,) + args, kwargs)
+
+    def shell_submit(self, cmd, **kwargs):
+        """Adds a shell job. Takes the same arguments as
+        :meth:`multyvac.job.JobModule.shell_submit`, and ``_estimate``, its
+        estimated runtime in seconds."""
+        return self._add(self.multyvac.job.shell_submit, (cmd,), kwargs)
+
+    def _add(self, submit, args, kwargs):
+        if '_estimate' not in kwargs:
+            raise ValueError('_estimate, the estimated runtime, is required')
+        estimate = kwargs.pop('_estimate')
+        multicore = kwargs.get('_multicore', 1)
+        if multicore > self.core_count:
+            raise ValueError('A job needing %s cores does not fit in %s' %
+                             (multicore, self.core_count))
+        if self.core:
+            kwargs.setdefault('_core', self.core)
+        job = PackedJob(submit, args, kwargs, multicore, estimate)
+        self.jobs.append(job)
+        return job
+
+    def _ordered(self):
+        """Returns the jobs longest first, larger ones first among equals."""
+        return sorted(self.jobs, key=lambda j: (-j.estimate, -j.multicore))
+
+    def plan(self):
+        """
+        Simulates the schedule with the estimated runtimes. Returns a list of
+        (start time in seconds, PackedJob), the makespan, and the
+        utilization.
+        """
+        remaining = self._ordered()
+        free = self.core_count
+        now = 0.0
+        running = []    # heap of (end, index, job)
+        schedule = []
+        while remaining or running:
+            for job in _fitting(remaining, free):
+                remaining.remove(job)
+                free -= job.multicore
+                heapq.heappush(running, (now + job.estimate, len(schedule),
+                                         job))
+                schedule.append((now, job))
+            now, _, job = heapq.heappop(running)
+            free += job.multicore
+        work = sum(job.multicore * job.estimate for job in self.jobs)
+        utilization = work / (self.core_count * now) if now else 0.0
+        return schedule, now, utilization
+
+    def run(self):
+        """
+        Submits the jobs as cores free up, until every job has finished.
+        Finished jobs are available through each PackedJob's job attribute.
+
+        :returns: A :class:`PackingReport`.
+        """
+        from .job import Job
+        _, planned_makespan, planned_utilization = self.plan()
+        remaining = self._ordered()
+        running = {}
+        free = self.core_count
+        busy = 0.0
+        start = last = time.time()
+        while remaining or running:
+            for job in _fitting(remaining, free):
+                remaining.remove(job)
+                job.jid = job._submit(*job._args, **job._kwargs)
+                running[job.jid] = job
+                free -= job.multicore
+            time.sleep(self.poll_interval)
+            jobs = self.multyvac.job.get(running.keys(),
+                                         fields=['jid', 'status'])
+            now = time.time()
+            busy += (self.core_count - free) * (now - last)
+            last = now
+            finished = [j.jid for j in jobs
+                        if j.status in Job.finished_statuses]
+            if finished:
+                for job in self.multyvac.job.get(finished):
+                    packed = running.pop(job.jid)
+                    packed.job = job
+                    free += packed.multicore
+        return PackingReport(self.core_count, last - start, busy,
+                             planned_makespan, planned_utilization)
+
+def _fitting(remaining, free):
+    """Yields jobs from remaining, in order, that fit in free cores, taking
+    each one's cores as it goes."""
+    for job in list(remaining):
+        if job.multicore <= free:
+            free -= job.multicore
+            yield job
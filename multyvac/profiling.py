@@ -0,0 +1,71 @@
+"""
+Support for profiling Python jobs with cProfile. See the _profile keyword
+of :meth:`multyvac.job.JobModule.submit`.
+"""
+
+import marshal
+import posixpath
+import pstats
+
+def profiled(f, path=None):
+    """
+    Returns a function that calls f under cProfile. It runs on Multyvac, so
+    it must not depend on anything but the standard library.
+
+    The returned function returns a dict with f's return value under
+    'result'. The profile's stats are under 'profile', unless path is set,
+    in which case they are written to that path in the job's filesystem
+    (usually in a volume) in the format of cProfile.Profile.dump_stats().
+    """
+    def run_profiled(*args, **kwargs):
+        import cProfile
+        profiler = cProfile.Profile()
+        result = profiler.runcall(f, *args, **kwargs)
+        if path:
+            profiler.dump_stats(path)
+            return {'result': result, 'profile': None}
+        profiler.create_stats()
+        return {'result': result, 'profile': profiler.stats}
+    return run_profiled
+
+class ProfileData(object):
+    """Wraps raw cProfile stats so that :class:`pstats.Stats` accepts
+    them."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        # pstats.Stats takes ownership of self.stats, so hand it a copy
+        self.stats = dict(self.stats)
+
+def to_pstats(stats):
+    """Returns a pstats.Stats for raw cProfile stats."""
+    return pstats.Stats(ProfileData(stats))
+
+def load_from_volume(multyvac, path):
+    """
+    Returns the raw stats dumped to path, an absolute path in a job's
+    filesystem, by finding the volume mounted there. Returns None if no
+    volume is mounted at path.
+    """
+    for volume in multyvac.volume.list():
+        mount_path = volume.mount_path.rstrip('/') + '/'
+        if path.startswith(mount_path):
+            f = volume.get_contents(posixpath.relpath(path, mount_path))
+            return marshal.loads(f['contents'])
+    return None
+
+def aggregate(jobs):
+    """Returns a single pstats.Stats combining the profiles of jobs. Jobs
+    without a profile are skipped. Returns None if no job has one."""
+    combined = None
+    for job in jobs:
+        stats = job.profile
+        if stats is None:
+            continue
+        elif combined is None:
+            combined = stats
+        else:
+            combined.add(stats)
+    return combined
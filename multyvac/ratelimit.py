@@ -0,0 +1,264 @@
+import collections
+import threading
+import time
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket. Tokens accumulate at ``rate`` per second up
+    to ``burst``, and each request takes one. A rate of None means requests
+    are not limited.
+
+    A request that finds no token reserves the next one, by taking the
+    token count below zero, and sleeps until it has accumulated. Waiting
+    requests are therefore served in the order they arrived, rather than
+    racing for each token as it appears.
+    """
+
+    def __init__(self, rate=None, burst=10.0):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.time()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # Nothing is earned while requests are blocked, so that they do not
+        # all go out at once when the block ends.
+        start = max(self._last, self._blocked_until)
+        if self.rate is not None and now > start:
+            self._tokens = min(self.burst,
+                               self._tokens + (now - start) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate):
+        """Changes the rate. Lowering it also drops the tokens saved up, since
+        they were earned at the old rate."""
+        with self._lock:
+            self._refill(time.time())
+            if rate is not None and (self.rate is None or rate < self.rate):
+                self._tokens = min(self._tokens, 0.0)
+            self.rate = rate
+
+    def block_for(self, seconds):
+        """Rejects requests for the next given number of seconds."""
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            self._blocked_until = max(self._blocked_until, now + seconds)
+
+    def blocked_for(self):
+        """Returns the number of seconds until requests are allowed again."""
+        with self._lock:
+            return max(0.0, self._blocked_until - time.time())
+
+    def acquire(self, timeout=None):
+        """Blocks until a token is available, and takes it. Returns the
+        number of seconds spent waiting, or None without taking a token if
+        none would be available within timeout seconds."""
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            delay = max(self._blocked_until - now, 0.0)
+            if self.rate is not None:
+                # Reserve the next token, which is earned once the count is
+                # back at zero
+                self._tokens -= 1.0
+                if self._tokens < 0:
+                    delay += -self._tokens / self.rate
+            if timeout is not None and delay > timeout:
+                if self.rate is not None:
+                    self._tokens += 1.0
+                return None
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def try_acquire(self):
+        """Takes a token if one is available right away. Returns whether
+        one was."""
+        return self.acquire(timeout=0) is not None
+
+class RateLimiter(object):
+    """
+    Paces requests to the Multyvac API so that they stay just under the
+    API's rate limit, rather than discovering it through 429 responses.
+
+    Requests are grouped into endpoint classes (submit, poll, file, and
+    default), each with its own :class:`TokenBucket`. Buckets start out
+    unlimited. The first 429 response, or rate limit headers in any
+    response, set the bucket's rate. On a 429, the rate at which the API
+    has been accepting requests is remembered as the last known limit, and
+    the bucket's rate is cut to ``decrease_factor`` of it. While requests
+    succeed, the rate then climbs back along a cubic curve, as TCP CUBIC
+    does: quickly at first, levelling off at the last known limit, and then
+    probing beyond it ever faster in case the API allows more.
+
+    A single limiter is shared by all threads and all Multyvac objects in a
+    process. See :data:`default_rate_limiter`.
+    """
+
+    class_submit = 'submit'
+    class_poll = 'poll'
+    class_file = 'file'
+    class_default = 'default'
+
+    endpoint_classes = [class_submit, class_poll, class_file, class_default]
+
+    def __init__(self, burst=10.0, min_rate=0.2, decrease_factor=0.8,
+                 growth=0.05, window=2.0):
+        """
+        :param burst: The number of requests per endpoint class that can be
+            made back to back once limiting kicks in.
+        :param min_rate: The lowest rate, in requests per second, a bucket
+            is ever slowed down to.
+        :param decrease_factor: The fraction of the last known limit a
+            bucket's rate is cut to on a 429 response.
+        :param growth: How fast the rate climbs after a cut, relative to
+            the last known limit. The rate is back at the limit after
+            ((1 - decrease_factor) / growth) ** (1 / 3.0) seconds, and t
+            seconds later it is higher by a fraction growth * t ** 3.
+        :param window: The number of seconds over which the rate at which
+            the API accepts requests is measured.
+        """
+        self.min_rate = min_rate
+        self.decrease_factor = decrease_factor
+        self.growth = growth
+        self.window = window
+        self._buckets = dict((c, TokenBucket(burst=burst))
+                             for c in self.endpoint_classes)
+        self._history = dict((c, collections.deque())
+                             for c in self.endpoint_classes)
+        # Endpoint class -> (rate, until when it applies) from the rate
+        # limit headers
+        self._max_rates = dict((c, None) for c in self.endpoint_classes)
+        # Endpoint class -> the last known limit
+        self._last_limit = dict((c, None) for c in self.endpoint_classes)
+        self._last_decrease = dict((c, 0.0) for c in self.endpoint_classes)
+        self._waited = dict((c, 0.0) for c in self.endpoint_classes)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def classify(cls, method, uri, files=None):
+        """Returns the endpoint class of a request."""
+        resource = uri.strip('/').split('/')[0]
+        if files or (resource in ('volume', 'layer') and uri.count('/') == 2):
+            return cls.class_file
+        elif resource == 'job' and method == 'POST' and uri.rstrip('/') == '/job':
+            return cls.class_submit
+        elif resource == 'job' and method == 'GET':
+            return cls.class_poll
+        else:
+            return cls.class_default
+
+    def acquire(self, endpoint_class, timeout=None):
+        """Blocks until a request of the endpoint class may be sent. Returns
+        False if it may not within timeout seconds, and True otherwise."""
+        waited = self._buckets[endpoint_class].acquire(timeout)
+        if waited is None:
+            return False
+        with self._lock:
+            self._waited[endpoint_class] += waited
+        return True
+
+    def _measured_rate(self, endpoint_class):
+        """Returns the rate at which the API accepted requests of the
+        endpoint class over the last window."""
+        history = self._history[endpoint_class]
+        if len(history) < 2:
+            return self.min_rate
+        span = history[-1] - history[0]
+        if span <= 0:
+            return self.min_rate
+        # n requests span n - 1 intervals
+        return max((len(history) - 1) / span, self.min_rate)
+
+    def _cubic_rate(self, endpoint_class, now):
+        """Returns the rate of the endpoint class's growth curve at now."""
+        limit = self._last_limit[endpoint_class]
+        # The curve is back at the limit this many seconds after the cut
+        k = ((1.0 - self.decrease_factor) / self.growth) ** (1 / 3.0)
+        t = now - self._last_decrease[endpoint_class]
+        return limit * (1.0 + self.growth * (t - k) ** 3)
+
+    def observe(self, endpoint_class, status_code, headers):
+        """
+        Adapts the rate of an endpoint class to a response.
+
+        :param status_code: The HTTP status code of the response.
+        :param headers: The response headers. Standard
+            X-RateLimit-Remaining, X-RateLimit-Reset and Retry-After headers
+            are honored if present.
+        """
+        headers = headers or {}
+        bucket = self._buckets[endpoint_class]
+        now = time.time()
+        retry_after = _parse_float(headers.get('Retry-After'))
+        remaining = _parse_float(headers.get('X-RateLimit-Remaining'))
+        reset = _parse_float(headers.get('X-RateLimit-Reset'))
+        if reset is not None and reset > 1e9:
+            # Reset given as a Unix timestamp rather than a delay
+            reset -= now
+        with self._lock:
+            if remaining is not None and reset is not None and reset > 0:
+                # The API told us exactly how much room is left until the
+                # window resets
+                self._max_rates[endpoint_class] = (
+                    max(remaining / reset, self.min_rate), now + reset)
+            elif (self._max_rates[endpoint_class] is not None and
+                    now >= self._max_rates[endpoint_class][1]):
+                self._max_rates[endpoint_class] = None
+            # Requests that got a 429 count against the client, but not
+            # against the API's limit.
+            history = self._history[endpoint_class]
+            if status_code != 429:
+                history.append(now)
+            while history and history[0] < now - self.window:
+                history.popleft()
+            if status_code == 429:
+                if now - self._last_decrease[endpoint_class] < 1.0:
+                    # The other requests in flight when the rate was cut
+                    # got 429s too, which says nothing about the new rate.
+                    rate = bucket.rate
+                else:
+                    limit = self._measured_rate(endpoint_class)
+                    if bucket.rate is not None:
+                        limit = min(limit, bucket.rate)
+                    self._last_limit[endpoint_class] = limit
+                    self._last_decrease[endpoint_class] = now
+                    rate = max(limit * self.decrease_factor, self.min_rate)
+            elif self._last_limit[endpoint_class] is not None:
+                rate = max(self._cubic_rate(endpoint_class, now),
+                           self.min_rate)
+            else:
+                # Only rate limit headers, if any, limit the rate
+                rate = None
+            if self._max_rates[endpoint_class] is not None:
+                max_rate = self._max_rates[endpoint_class][0]
+                rate = min(rate, max_rate) if rate is not None else max_rate
+            bucket.set_rate(rate)
+        if status_code == 429 and retry_after:
+            bucket.block_for(retry_after)
+
+    def retry_after(self, endpoint_class):
+        """Returns the number of seconds to wait before retrying a rate
+        limited request of the endpoint class."""
+        return self._buckets[endpoint_class].blocked_for()
+
+    def stats(self):
+        """Returns a dict mapping each endpoint class to its current rate
+        (None if unlimited) and total seconds spent waiting for tokens."""
+        with self._lock:
+            return dict((c, {'rate': self._buckets[c].rate,
+                             'waited': self._waited[c]})
+                        for c in self.endpoint_classes)
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+#: The limiter shared by every Multyvac object in this process.
+default_rate_limiter = RateLimiter()
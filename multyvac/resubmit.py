@@ -0,0 +1,173 @@
+"""
+Automatic resubmission of jobs in a batch that failed for reasons other than
+their own code: jobs that stalled, and jobs that failed after hitting their
+memory limit::
+
+    policy = ResubmitPolicy(cores=['c1', 'c2', 'm2'], max_attempts=3)
+    jobs = multyvac.job.wait(jids, resubmit=policy)
+
+Jobs that ran out of memory can be moved to the next, larger core in
+``cores``, or given more cores with ``multicore_factor``, since memory grows
+with the number of cores. Only jobs submitted by this client with
+``_restartable=True`` (the default) after
+:meth:`multyvac.job.JobModule.enable_resubmission` are resubmitted.
+
+Jobs are resubmitted as soon as they are seen to fail, while the rest of
+the batch is still running.
+
+A resubmitted job is tagged with ``resubmit_of``, the jid of the batch's
+original job, ``attempt``, and ``resubmit_history``, a comma-separated list
+of ``jid:reason`` for the attempts before it.
+"""
+
+import time
+
+from .multyvac import (
+    Deadline,
+    DeadlineExceeded,
+)
+from .speculation import (
+    BatchPoller,
+    SpeculationPolicy,
+)
+
+class ResubmitPolicy(object):
+    """Decides which failed jobs are resubmitted, and how."""
+
+    reason_stalled = 'stalled'
+    reason_memory = 'memory'
+
+    def __init__(self, max_attempts=3, on_stalled=True, on_memory=True,
+                 cores=None, multicore_factor=None, max_multicore=None,
+                 max_core_hours=None):
+        """
+        :param max_attempts: The most times a job runs, counting the first.
+        :param on_stalled: Resubmit jobs that stalled.
+        :param on_memory: Resubmit jobs that failed after hitting their memory
+            limit.
+        :param cores: Core names from smallest to largest. A job that ran out
+            of memory is resubmitted on the core after its own.
+        :param multicore_factor: If set, a job that ran out of memory is
+            resubmitted with this many times as many cores.
+        :param max_multicore: The most cores multicore_factor may give a job.
+        :param max_core_hours: If set, a job is not resubmitted if the
+            resubmissions of the batch would then use more than this many
+            core hours, counting each core of a multicore job. Until it
+            finishes, a resubmission is expected to run as long as the
+            attempt it replaces, on its own number of cores.
+        """
+        self.max_attempts = max_attempts
+        self.on_stalled = on_stalled
+        self.on_memory = on_memory
+        self.cores = cores
+        self.multicore_factor = multicore_factor
+        self.max_multicore = max_multicore
+        self.max_core_hours = max_core_hours
+
+    def reason(self, job):
+        """Returns why job should be resubmitted, or None if it should not."""
+        from .job import Job
+        if job.status == Job.status_stalled and self.on_stalled:
+            return self.reason_stalled
+        if (job.status == Job.status_error and self.on_memory and
+                job.memory_failcnt):
+            return self.reason_memory
+        return None
+
+    def changes(self, job, reason):
+        """Returns the fields of the job's specification to change when it is
+        resubmitted for reason."""
+        changes = {}
+        if reason != self.reason_memory:
+            return changes
+        if self.cores and job.core in self.cores:
+            i = self.cores.index(job.core)
+            if i + 1 < len(self.cores):
+                changes['core'] = self.cores[i + 1]
+        if self.multicore_factor:
+            multicore = int((job.multicore or 1) * self.multicore_factor)
+            if self.max_multicore:
+                multicore = min(multicore, self.max_multicore)
+            if multicore > (job.multicore or 1):
+                changes['multicore'] = multicore
+        return changes
+
+def core_hours(job):
+    """Returns the core hours a finished job used."""
+    return (job.runtime or 0.0) * (job.multicore or 1) / 3600.0
+
+def projected_core_hours(job, changes):
+    """Returns the core hours a resubmission of job with changes is expected
+    to use."""
+    multicore = changes.get('multicore', job.multicore or 1)
+    return (job.runtime or 0.0) * multicore / 3600.0
+
+def resubmitting_wait(job_module, jids, timeout=None, speculative=False,
+                      policy=None):
+    """
+    Implements :meth:`multyvac.job.JobModule.wait` with resubmit. Returns a
+    list of finished jobs in the order of jids, with the last attempt of
+    each job in its place, or None on a timeout.
+    """
+    policy = policy or ResubmitPolicy()
+    if speculative is True:
+        speculative = SpeculationPolicy()
+    deadline = Deadline(timeout)
+    # Keep the specifications of the winners to resubmit them
+    poller = BatchPoller(job_module, jids, speculative or None, forget=False)
+    original = dict((jid, jid) for jid in jids)   # attempt -> batch's jid
+    attempts = dict((jid, 1) for jid in jids)
+    history = dict((jid, []) for jid in jids)
+    projected = {}   # attempt -> core hours it is expected to use
+    used = 0.0       # core hours of resubmissions, projected or finished
+    results = {}
+    tries = 1
+    try:
+        while len(results) < len(poller.batch):
+            if deadline.remaining() == 0:
+                return None
+            winners = poller.poll(deadline)
+            done = winners.keys()
+            finished = job_module.get([winners[a] for a in done],
+                                      timeout=deadline.remaining())
+            for attempt, job in zip(done, finished):
+                jid = original.pop(attempt)
+                if attempt in projected:
+                    used += core_hours(job) - projected.pop(attempt)
+                reason = policy.reason(job)
+                if reason is None or attempts[jid] >= policy.max_attempts:
+                    results[jid] = job
+                    job_module._forget_specs([job.jid])
+                    continue
+                changes = policy.changes(job, reason)
+                cost = projected_core_hours(job, changes)
+                if (policy.max_core_hours is not None and
+                        used + cost > policy.max_core_hours):
+                    results[jid] = job
+                    job_module._forget_specs([job.jid])
+                    continue
+                history[jid].append('%s:%s' % (job.jid, reason))
+                tags = {'resubmit_of': str(jid),
+                        'attempt': str(attempts[jid] + 1),
+                        'resubmit_history': ','.join(history[jid])}
+                new_jid = job_module._resubmit(job.jid, tags,
+                                               timeout=deadline.remaining(),
+                                               **changes)
+                job_module._forget_specs([job.jid])
+                if new_jid is None:
+                    results[jid] = job
+                    continue
+                job_module.multyvac.stats.count('resubmits', (reason,))
+                original[new_jid] = jid
+                attempts[jid] += 1
+                projected[new_jid] = cost
+                used += cost
+                poller.add(new_jid)
+            if len(results) < len(poller.batch):
+                tries += 1
+                time.sleep(deadline.cap(1.0 + min(tries/10.0, 9.0)))
+    except DeadlineExceeded:
+        return None
+    finally:
+        poller.close()
+    return [results[jid] for jid in jids]
@@ -0,0 +1,274 @@
+import random
+import threading
+import time
+
+class RetryBudget(object):
+    """
+    Caps the number of retries across all threads to a fraction of the
+    requests made. When the API degrades, this keeps clients from
+    multiplying their load on it with retries.
+
+    Every new request deposits ``ratio`` tokens, and the balance also grows
+    by ``min_per_second`` tokens every second so that a quiet client can
+    still retry. Every retry withdraws one token.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_balance=50.0):
+        """
+        :param ratio: The number of retries allowed per request.
+        :param min_per_second: The number of retries allowed per second
+            regardless of the number of requests.
+        :param max_balance: The largest number of retries that can be saved
+            up for a burst.
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self._balance = max_balance
+        self._last_refill = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self._balance = min(self.max_balance,
+                            self._balance +
+                            (now - self._last_refill) * self.min_per_second)
+        self._last_refill = now
+
+    def deposit(self):
+        """Records a new request."""
+        with self._lock:
+            self._refill()
+            self._balance = min(self.max_balance, self._balance + self.ratio)
+
+    def withdraw(self):
+        """Returns True if a retry is allowed, False if the budget is spent."""
+        with self._lock:
+            self._refill()
+            if self._balance >= 1.0:
+                self._balance -= 1.0
+                return True
+            else:
+                return False
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests after too many consecutive failures.
+
+    While closed, requests flow normally. After ``failure_threshold``
+    consecutive failures the circuit opens, and requests are rejected
+    without being sent. Once ``reset_timeout`` seconds pass, the circuit is
+    half open: a single probe request is let through, and its outcome
+    decides whether the circuit closes or opens again.
+    """
+
+    state_closed = 'closed'
+    state_open = 'open'
+    state_half_open = 'half_open'
+
+    def __init__(self, failure_threshold=10, reset_timeout=30.0):
+        """
+        :param failure_threshold: Consecutive failures that open the circuit.
+        :param reset_timeout: Seconds the circuit stays open before a probe
+            request is allowed.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.state_closed
+        self.times_opened = 0
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a request may be sent."""
+        with self._lock:
+            if self.state == self.state_closed:
+                return True
+            elif (self.state == self.state_open and
+                    time.time() - self._opened_at >= self.reset_timeout):
+                self.state = self.state_half_open
+                self._probe_in_flight = True
+                return True
+            elif self.state == self.state_half_open and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            else:
+                return False
+
+    def release(self):
+        """Lets another request through as the probe, after the one allowed
+        ended without its outcome being recorded."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            self.state = self.state_closed
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if (self.state == self.state_half_open or
+                    (self.state == self.state_closed and
+                     self._failures >= self.failure_threshold)):
+                self.state = self.state_open
+                self._opened_at = time.time()
+                self.times_opened += 1
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed request is retried. A single policy is
+    meant to be shared by every thread using a Multyvac object, so that the
+    retry budget and circuit breaker see all of the traffic.
+
+    Use :meth:`begin` to get a :class:`RetryState` for each request.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, min_delay=1.0,
+                 max_delay=None, rate_limited_min_delay=5.0, budget=None,
+                 breaker=None):
+        """
+        :param max_attempts: Attempts made before giving up, including the
+            first one. Every rate limited attempt adds one more.
+        :param base_delay: Retry n sleeps a random time up to
+            base_delay * 2**n seconds.
+        :param min_delay: The shortest time to sleep before a retry.
+        :param max_delay: The longest time to sleep before a retry. None for
+            no limit.
+        :param rate_limited_min_delay: The shortest time to sleep after the
+            API responded that the request was rate limited.
+        :param budget: A :class:`RetryBudget`, or None to allow every retry.
+        :param breaker: A :class:`CircuitBreaker`, or None to never reject
+            a request.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.rate_limited_min_delay = rate_limited_min_delay
+        self.budget = budget
+        self.breaker = breaker
+        self._counters = {'requests': 0,
+                          'attempts': 0,
+                          'retries': 0,
+                          'rate_limited': 0,
+                          'gave_up': 0,
+                          'rejected_by_budget': 0,
+                          'rejected_by_breaker': 0,
+                          }
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def begin(self):
+        """Returns a :class:`RetryState` to track a new request."""
+        self._count('requests')
+        if self.budget:
+            self.budget.deposit()
+        return RetryState(self)
+
+    def backoff(self, attempt, min_delay):
+        """Returns the number of seconds to sleep before retry number
+        attempt."""
+        delay = max(self.base_delay * 2**attempt * random.random(), min_delay)
+        if self.max_delay is not None:
+            delay = min(delay, max(self.max_delay, min_delay))
+        return delay
+
+    def stats(self):
+        """
+        Returns a dict of counters describing what this policy has done:
+        requests, attempts, retries, rate_limited, gave_up,
+        rejected_by_budget, rejected_by_breaker, as well as the circuit
+        breaker's state and the number of times it opened.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        if self.breaker:
+            stats['circuit_state'] = self.breaker.state
+            stats['circuit_opened'] = self.breaker.times_opened
+        return stats
+
+class RetryState(object):
+    """Tracks the attempts of a single request. See :class:`RetryPolicy`."""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.attempt = 0
+        self.max_attempts = policy.max_attempts
+        self._outcome_pending = False
+
+    def allow(self):
+        """Returns True if the next attempt may be sent, or False if the
+        circuit breaker rejects it."""
+        if self.policy.breaker and not self.policy.breaker.allow():
+            self.policy._count('rejected_by_breaker')
+            return False
+        self.policy._count('attempts')
+        self._outcome_pending = self.policy.breaker is not None
+        return True
+
+    def release(self):
+        """
+        Call once an attempt allowed by :meth:`allow` is over. If neither
+        :meth:`succeeded` nor :meth:`failed` was called, for example because
+        an unexpected exception was raised, the circuit breaker's probe is
+        released so that the circuit does not stay half open for good.
+        """
+        if self._outcome_pending:
+            self._outcome_pending = False
+            self.policy.breaker.release()
+
+    def succeeded(self):
+        """Records that the last attempt succeeded."""
+        self._outcome_pending = False
+        if self.policy.breaker:
+            self.policy.breaker.record_success()
+
+    def failed(self, retryable, rate_limited=False, delay=None):
+        """
+        Records that the last attempt failed. Returns the number of seconds
+        to sleep before retrying, or None if the request should not be
+        retried.
+
+        :param retryable: Whether the failure was transient.
+        :param rate_limited: Whether the API rejected the attempt because of
+            rate limiting.
+        :param delay: If set, the number of seconds to sleep before retrying
+            instead of backing off. Useful when something else, like a rate
+            limiter, already knows when to retry.
+        """
+        policy = self.policy
+        self._outcome_pending = False
+        self.attempt += 1
+        min_delay = policy.min_delay
+        if rate_limited:
+            # Add another attempt if error was due to rate limiting.
+            # This also increases the range of exponential backoff.
+            self.max_attempts += 1
+            min_delay = policy.rate_limited_min_delay
+            policy._count('rate_limited')
+        if policy.breaker:
+            # Only transient errors count against the API's health. A rate
+            # limited or rejected request shows that the API is responsive.
+            if retryable and not rate_limited:
+                policy.breaker.record_failure()
+            else:
+                policy.breaker.record_success()
+        if not retryable or self.attempt >= self.max_attempts:
+            policy._count('gave_up')
+            return None
+        if policy.budget and not policy.budget.withdraw():
+            policy._count('rejected_by_budget')
+            return None
+        policy._count('retries')
+        if delay is not None:
+            return delay
+        return policy.backoff(self.attempt, min_delay)
@@ -0,0 +1,191 @@
+"""
+Speculative execution of stragglers in a batch of jobs. In a large batch, a
+few jobs on slow or busy machines decide how long the whole batch takes.
+With ``multyvac.job.wait(jobs, speculative=True)``, once enough of the batch
+has finished, a job that has been running much longer than the ones that
+finished gets a duplicate. Whichever of the two finishes successfully first
+is returned, and the other is killed.
+
+Only jobs submitted with ``_restartable=True`` (the default) by this client
+after :meth:`multyvac.job.JobModule.enable_resubmission` are duplicated,
+since they are the ones that are safe to run twice and whose specifications
+are known. A duplicate is tagged with ``speculative_copy_of``,
+the jid of the job it duplicates.
+
+How long a job has been running is measured from when the client first sees
+it processing, so that it does not depend on the server's clock.
+"""
+
+import math
+import time
+
+from .multyvac import (
+    Deadline,
+    DeadlineExceeded,
+)
+
+class SpeculationPolicy(object):
+    """Decides when a job is slow enough to be duplicated. The defaults
+    follow those of Spark's speculative execution."""
+
+    def __init__(self, quantile=0.75, multiplier=1.5, min_runtime=10.0,
+                 max_copies=0.1):
+        """
+        :param quantile: The fraction of the batch that must have finished
+            successfully before any job is duplicated.
+        :param multiplier: A job is duplicated once it has run this many
+            times longer than the median runtime of the finished jobs.
+        :param min_runtime: Jobs that have run for fewer seconds than this are
+            never duplicated.
+        :param max_copies: The most duplicates for a batch, as a fraction of
+            its size. At least one is always allowed.
+        """
+        self.quantile = quantile
+        self.multiplier = multiplier
+        self.min_runtime = min_runtime
+        self.max_copies = max_copies
+
+    def threshold(self, runtimes, batch_size):
+        """Returns the seconds after which a running job is duplicated, given
+        the runtimes of the successful jobs of the batch, or None if too few
+        have finished."""
+        if not runtimes or len(runtimes) < self.quantile * batch_size:
+            return None
+        return max(self.min_runtime, _median(runtimes) * self.multiplier)
+
+    def copy_limit(self, batch_size):
+        """Returns the most duplicates allowed for a batch."""
+        return max(1, int(math.ceil(self.max_copies * batch_size)))
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def speculative_wait(job_module, jids, timeout=None, policy=None):
+    """
+    Implements :meth:`multyvac.job.JobModule.wait` with speculative=True.
+    Returns a list of finished jobs in the order of jids, or None on a
+    timeout.
+    """
+    deadline = Deadline(timeout)
+    poller = BatchPoller(job_module, jids, policy or SpeculationPolicy())
+    winners = {}     # jid -> jid of the job to return for it
+    tries = 1
+    try:
+        while len(winners) < len(poller.batch):
+            if deadline.remaining() == 0:
+                return None
+            winners.update(poller.poll(deadline))
+            if len(winners) < len(poller.batch):
+                tries += 1
+                time.sleep(deadline.cap(1.0 + min(tries/10.0, 9.0)))
+        return job_module.get([winners[jid] for jid in jids],
+                              timeout=deadline.remaining())
+    except DeadlineExceeded:
+        return None
+    finally:
+        poller.close()
+
+class BatchPoller(object):
+    """
+    Polls the jobs of a batch, duplicating stragglers if given a
+    SpeculationPolicy, and reports each job once it has a winner. Jobs can
+    be added as the batch runs, for example when one is resubmitted.
+
+    The specifications of the jobs that lost are freed as soon as a job's
+    winner is known, and with forget, so are the winners'.
+    """
+
+    def __init__(self, job_module, jids, policy=None, forget=True):
+        self.job_module = job_module
+        self.policy = policy
+        self.forget = forget
+        self.batch = set(jids)
+        self.copies = {}      # jid -> jid of its duplicate
+        self.started = {}     # jid -> when it was first seen processing
+        self.runtimes = []
+        self.unfinished = set(jids)
+
+    def add(self, jid):
+        """Adds a job that stands in for one of the batch."""
+        self.unfinished.add(jid)
+
+    def poll(self, deadline):
+        """Polls the unfinished jobs once. Returns a dict of jid to the jid
+        of its winner, for the jobs that finished since the last poll."""
+        from .job import Job
+        job_module = self.job_module
+        copies = self.copies
+        polled = list(self.unfinished) + [copies[jid]
+                                          for jid in self.unfinished
+                                          if jid in copies]
+        if not polled:
+            return {}
+        jobs = job_module.get(polled, fields=['jid', 'status', 'runtime'],
+                              timeout=deadline.remaining())
+        by_jid = dict((job.jid, job) for job in jobs)
+        now = time.time()
+        winners = {}
+        losers = []
+        for jid in list(self.unfinished):
+            candidates = [jid] + ([copies[jid]] if jid in copies else [])
+            for c in candidates:
+                if (by_jid[c].status == Job.status_processing and
+                        c not in self.started):
+                    self.started[c] = now
+            done = [c for c in candidates
+                    if by_jid[c].status == Job.status_done]
+            if done:
+                winner = done[0]
+            elif all(by_jid[c].status in Job.finished_statuses
+                     for c in candidates):
+                # Both failed; report the original
+                winner = jid
+            else:
+                continue
+            winners[jid] = winner
+            self.unfinished.remove(jid)
+            if winner != jid:
+                job_module.multyvac.stats.count('speculative_wins', ())
+            if by_jid[winner].status == Job.status_done:
+                self.runtimes.append(by_jid[winner].runtime or 0.0)
+            losers.extend(c for c in candidates if c != winner and
+                          by_jid[c].status not in Job.finished_statuses)
+            job_module._forget_specs(
+                [c for c in candidates if self.forget or c != winner])
+        if losers:
+            job_module.kill(losers)
+        if self.policy is not None:
+            self._speculate(now, deadline)
+        return winners
+
+    def _speculate(self, now, deadline):
+        policy = self.policy
+        size = len(self.batch)
+        threshold = policy.threshold(self.runtimes, size)
+        if threshold is None:
+            return
+        for jid in self.unfinished:
+            if len(self.copies) >= policy.copy_limit(size):
+                break
+            if (jid not in self.copies and jid in self.started and
+                    now - self.started[jid] > threshold):
+                copy = self.job_module._resubmit(
+                    jid, {'speculative_copy_of': jid},
+                    timeout=deadline.remaining())
+                if copy is not None:
+                    self.copies[jid] = copy
+                    self.job_module.multyvac.stats.count(
+                        'speculative_copies', ())
+
+    def close(self):
+        """Kills the duplicates of jobs that have not finished, since
+        nobody is waiting on them anymore."""
+        running = [copy for jid, copy in self.copies.items()
+                   if jid in self.unfinished]
+        if running:
+            self.job_module.kill(running)
+            self.job_module._forget_specs(running)
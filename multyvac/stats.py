@@ -0,0 +1,264 @@
+import bisect
+import contextlib
+import logging
+import socket
+import threading
+import time
+
+_RESOURCE_NAMES = set(['job', 'kill', 'kill_all', 'queue_stats', 'volume',
+                       'mkdir', 'ls', 'rm', 'layer', 'cluster', 'release',
+                       'update_max_duration', 'key', 'activate', 'deactivate',
+                       'report', 'install', 'client_log', 'invoice'])
+
+def endpoint_template(uri):
+    """
+    Returns the uri with ids and names replaced by placeholders, so that
+    requests to the same endpoint can be grouped together. For example,
+    '/volume/data/mkdir' becomes '/volume/:id/mkdir'.
+    """
+    parts = [p if p in _RESOURCE_NAMES else ':id'
+             for p in uri.strip('/').split('/') if p]
+    return '/' + '/'.join(parts)
+
+class Histogram(object):
+    """A histogram with fixed bucket upper bounds, in the style of
+    Prometheus. Not thread-safe by itself."""
+
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                       5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Returns a dict with the count, sum, and a list of
+        (upper bound, cumulative count) pairs ending with infinity."""
+        cumulative = []
+        total = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            cumulative.append((bound, total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': cumulative}
+
+class StatsCollector(object):
+    """
+    Collects metrics about the requests and syncs a Multyvac object makes.
+    Use this through ``Multyvac.stats``.
+
+    Metrics are identified by a name and a tuple of label values:
+
+    * ``request_seconds`` (method, endpoint): histogram of request latency.
+    * ``request_bytes``, ``response_bytes`` (method, endpoint): counters.
+    * ``requests`` (method, endpoint, status): counter.
+    * ``retries`` (method, endpoint): counter.
+    * ``codec_seconds`` (operation,): histogram of time spent in JSON and
+      base64 encoding and decoding.
+    * ``sync_seconds`` (): histogram of rsync duration.
+    * ``submission_queue_depth``, ``submission_in_flight`` (): gauges of
+      jobs waiting in and submitted by a
+      :class:`multyvac.submitter.SubmissionQueue`.
+    * ``speculative_copies``, ``speculative_wins`` (): counters of jobs
+      duplicated by ``wait(speculative=True)``, and of duplicates that
+      finished first.
+    * ``resubmits`` (reason,): counter of jobs resubmitted by
+      ``wait(resubmit=True)``.
+    * ``autoscaler_cores`` (core,): gauge of the cores of active clusters
+      seen by a :class:`multyvac.autoscaler.ClusterAutoscaler`.
+
+    Every request is also passed as an event dict to the functions
+    registered with :meth:`add_hook`.
+    """
+
+    _label_names = {'request_seconds': ('method', 'endpoint'),
+                    'request_bytes': ('method', 'endpoint'),
+                    'response_bytes': ('method', 'endpoint'),
+                    'requests': ('method', 'endpoint', 'status'),
+                    'retries': ('method', 'endpoint'),
+                    'codec_seconds': ('operation',),
+                    'sync_seconds': (),
+                    'sync_retries': (),
+                    'submission_queue_depth': (),
+                    'submission_in_flight': (),
+                    'speculative_copies': (),
+                    'speculative_wins': (),
+                    'resubmits': ('reason',),
+                    'autoscaler_cores': ('core',),
+                    }
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger('multyvac.stats')
+
+    def add_hook(self, hook):
+        """
+        Registers a function to be called with a dict for every request. The
+        dict has the keys method, endpoint, uri, status, seconds,
+        request_bytes, and response_bytes. Status is None if no response was
+        received.
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def observe(self, name, labels, value):
+        """Records value in the histogram name with labels."""
+        with self._lock:
+            key = (name, labels)
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = Histogram()
+            h.observe(value)
+
+    def count(self, name, labels, n=1):
+        """Increments the counter name with labels by n."""
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def gauge(self, name, labels, value):
+        """Sets the gauge name with labels to value."""
+        with self._lock:
+            self._gauges[(name, labels)] = value
+
+    @contextlib.contextmanager
+    def timer(self, operation):
+        """Context manager that records time spent encoding or decoding in
+        codec_seconds. Operation is something like 'json_encode'."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe('codec_seconds', (operation,), time.time() - start)
+
+    def record_request(self, method, uri, status, seconds, request_bytes,
+                       response_bytes):
+        """Records a single attempt at an API request."""
+        endpoint = endpoint_template(uri)
+        labels = (method, endpoint)
+        self.observe('request_seconds', labels, seconds)
+        self.count('request_bytes', labels, request_bytes)
+        self.count('response_bytes', labels, response_bytes)
+        self.count('requests', labels + (str(status),))
+        if self._hooks:
+            event = {'method': method,
+                     'endpoint': endpoint,
+                     'uri': uri,
+                     'status': status,
+                     'seconds': seconds,
+                     'request_bytes': request_bytes,
+                     'response_bytes': response_bytes,
+                     }
+            for hook in list(self._hooks):
+                try:
+                    hook(event)
+                except Exception:
+                    self._logger.exception('Stats hook %r failed', hook)
+
+    def snapshot(self):
+        """
+        Returns a dict with 'counters', 'gauges' and 'histograms', each
+        mapping a metric name to a list of dicts of the form
+        {'labels': {...}, 'value': ...}. Histogram values are as returned by
+        :meth:`Histogram.snapshot`.
+        """
+        with self._lock:
+            return {'counters': self._group(self._counters.items()),
+                    'gauges': self._group(self._gauges.items()),
+                    'histograms': self._group(
+                        (k, h.snapshot()) for k, h in self._histograms.items()),
+                    }
+
+    def _group(self, items):
+        grouped = {}
+        for (name, labels), value in items:
+            label_names = self._label_names.get(
+                name, ['label%d' % i for i in range(len(labels))])
+            grouped.setdefault(name, []).append(
+                {'labels': dict(zip(label_names, labels)), 'value': value})
+        return grouped
+
+    def reset(self):
+        """Clears all metrics."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def to_prometheus(self, prefix='multyvac'):
+        """Returns all metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for kind, metrics in (('counter', snapshot['counters']),
+                              ('gauge', snapshot['gauges'])):
+            for name in sorted(metrics):
+                full_name = '%s_%s' % (prefix, name)
+                if kind == 'counter':
+                    full_name += '_total'
+                lines.append('# TYPE %s %s' % (full_name, kind))
+                for m in metrics[name]:
+                    lines.append('%s%s %s' % (full_name,
+                                              _prometheus_labels(m['labels']),
+                                              m['value']))
+        for name in sorted(snapshot['histograms']):
+            full_name = '%s_%s' % (prefix, name)
+            lines.append('# TYPE %s histogram' % full_name)
+            for m in snapshot['histograms'][name]:
+                for bound, n in m['value']['buckets']:
+                    labels = dict(m['labels'])
+                    labels['le'] = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket%s %d' % (full_name,
+                                                     _prometheus_labels(labels),
+                                                     n))
+                labels = _prometheus_labels(m['labels'])
+                lines.append('%s_sum%s %r' % (full_name, labels,
+                                              m['value']['sum']))
+                lines.append('%s_count%s %d' % (full_name, labels,
+                                                m['value']['count']))
+        return '\n'.join(lines) + '\n'
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in sorted(labels.items()))
+
+class StatsdExporter(object):
+    """
+    Sends every request to a StatsD server as it happens. Register it with
+    ``multyvac.stats.add_hook(StatsdExporter())``.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='multyvac'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, event):
+        name = '%s.request.%s.%s' % (
+            self.prefix,
+            event['method'].lower(),
+            event['endpoint'].strip('/').replace('/', '.').replace(':', '') or 'root',
+        )
+        lines = ['%s.time:%d|ms' % (name, event['seconds'] * 1000),
+                 '%s.status.%s:1|c' % (name, event['status']),
+                 '%s.request_bytes:%d|c' % (name, event['request_bytes']),
+                 '%s.response_bytes:%d|c' % (name, event['response_bytes'])]
+        try:
+            self._sock.sendto('\n'.join(lines), self.address)
+        except socket.error:
+            # Metrics are best effort
+            pass
@@ -0,0 +1,213 @@
+"""
+A client-side queue that limits how many jobs are submitted at once::
+
+    from multyvac.submitter import SubmissionQueue
+    with SubmissionQueue(max_in_flight=500) as q:
+        submissions = [q.submit(f, x) for x in xs]
+    jids = [s.wait() for s in submissions]
+
+Jobs are submitted by a background thread once fewer than ``max_in_flight``
+of them are unfinished, and, with ``max_account_queued``, once the account's
+queue as reported by :meth:`multyvac.job.JobModule.queue_stats` is short
+enough. :meth:`SubmissionQueue.submit` blocks when ``max_pending`` jobs are
+waiting, which pushes back on whatever produces them.
+
+The number of pending and in-flight jobs are reported as the
+``submission_queue_depth`` and ``submission_in_flight`` gauges of
+``Multyvac.stats``.
+"""
+
+import logging
+import Queue
+import threading
+import time
+
+class Submission(object):
+    """A job waiting in a :class:`SubmissionQueue` to be submitted."""
+
+    def __init__(self, method, args, kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.jid = None
+        self.error = None
+        self.finished = False
+        self._submitted = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the job is submitted, and returns its jid. Returns None
+        if it is not submitted within timeout seconds. Raises the exception
+        submitting it raised, if any.
+        """
+        self._submitted.wait(timeout)
+        if self.error:
+            raise self.error
+        return self.jid
+
+    def __repr__(self):
+        return 'Submission(%s)' % (self.jid,)
+
+class SubmissionQueue(object):
+    """Submits jobs in a background thread as capacity frees up. See the
+    module documentation."""
+
+    def __init__(self, multyvac=None, max_in_flight=1000,
+                 max_account_queued=None, max_pending=10000,
+                 poll_interval=2.0, stats_interval=10.0):
+        """
+        :param multyvac: The Multyvac object to use. Defaults to the one used
+            by the top-level functions of the multyvac module.
+        :param max_in_flight: The most jobs from this queue that may be
+            submitted but unfinished.
+        :param max_account_queued: If set, jobs are only submitted while the
+            account has fewer queued jobs than this, counting jobs submitted
+            by anyone.
+        :param max_pending: The most jobs waiting to be submitted before
+            :meth:`submit` blocks.
+        :param poll_interval: Seconds between checks for finished jobs.
+        :param stats_interval: Seconds between calls to queue_stats().
+        """
+        if multyvac is None:
+            import multyvac as _multyvac_module
+            multyvac = _multyvac_module._default()
+        self.multyvac = multyvac
+        self.max_in_flight = max_in_flight
+        self.max_account_queued = max_account_queued
+        self.poll_interval = poll_interval
+        self.stats_interval = stats_interval
+        self._pending = Queue.Queue(max_pending)
+        self._in_flight = {}
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._account_queued = 0
+        self._stats_checked_at = None
+        self._logger = logging.getLogger('multyvac.submitter')
+        self._thread = threading.Thread(target=self._run,
+                                        name='multyvac-submitter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, f, *args, **kwargs):
+        """Queues a call to :meth:`multyvac.job.JobModule.submit`. Returns a
+        :class:`Submission`."""
+        return self._put(self.multyvac.job.submit, (f,) + args, kwargs)
+
+    def shell_submit(self, cmd, **kwargs):
+        """Queues a call to :meth:`multyvac.job.JobModule.shell_submit`.
+        Returns a :class:`Submission`."""
+        return self._put(self.multyvac.job.shell_submit, (cmd,), kwargs)
+
+    def _put(self, method, args, kwargs):
+        if self._closed:
+            raise ValueError('SubmissionQueue is closed')
+        submission = Submission(method, args, kwargs)
+        self._pending.put(submission)
+        self._wakeup.set()
+        return submission
+
+    @property
+    def depth(self):
+        """The number of jobs waiting to be submitted."""
+        return self._pending.qsize()
+
+    @property
+    def in_flight(self):
+        """The number of submitted jobs that have not finished."""
+        return len(self._in_flight)
+
+    def close(self):
+        """Stops accepting jobs. Those already queued are still submitted."""
+        self._closed = True
+        self._wakeup.set()
+
+    def join(self, timeout=None):
+        """Closes the queue, and blocks until every job is submitted and has
+        finished. Returns False if that takes longer than timeout seconds."""
+        self.close()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _run(self):
+        while not (self._closed and self._pending.empty() and
+                   not self._in_flight):
+            self._wakeup.clear()
+            try:
+                self._release()
+                self._poll()
+            except Exception:
+                # Keep going; the API may recover
+                self._logger.exception('Submission queue failed')
+            self._report()
+            self._wakeup.wait(self.poll_interval)
+        self._report()
+
+    def _release(self):
+        """Submits pending jobs while there is capacity."""
+        while len(self._in_flight) < self.max_in_flight:
+            if not self._account_has_capacity():
+                return
+            try:
+                submission = self._pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                submission.jid = submission.method(*submission.args,
+                                                   **submission.kwargs)
+            except Exception as e:
+                submission.error = e
+            else:
+                self._in_flight[submission.jid] = submission
+                self._account_queued += 1
+            submission._submitted.set()
+
+    def _account_has_capacity(self):
+        if self.max_account_queued is None:
+            return True
+        now = time.time()
+        if (self._stats_checked_at is None or
+                now - self._stats_checked_at >= self.stats_interval):
+            self._account_queued = _count_queued(
+                self.multyvac.job.queue_stats())
+            self._stats_checked_at = now
+        return self._account_queued < self.max_account_queued
+
+    def _poll(self):
+        """Frees the capacity of jobs that finished."""
+        if not self._in_flight:
+            return
+        from .job import Job
+        jobs = self.multyvac.job.get(self._in_flight.keys(),
+                                     fields=['jid', 'status'])
+        freed = False
+        for job in jobs:
+            if job.status in Job.finished_statuses:
+                self._in_flight.pop(job.jid).finished = True
+                freed = True
+        if freed and not self._pending.empty():
+            # Release more without waiting for the next poll
+            self._wakeup.set()
+
+    def _report(self):
+        stats = self.multyvac.stats
+        stats.gauge('submission_queue_depth', (), self._pending.qsize())
+        stats.gauge('submission_in_flight', (), len(self._in_flight))
+
+def _count_queued(stats):
+    """Returns the number of queued jobs in the result of queue_stats(),
+    summing over cores if they are broken down by core."""
+    if isinstance(stats, dict):
+        total = 0
+        for key, value in stats.items():
+            if key == 'queued' and isinstance(value, (int, long)):
+                total += value
+            else:
+                total += _count_queued(value)
+        return total
+    return 0
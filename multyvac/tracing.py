@@ -0,0 +1,349 @@
+"""
+Span-based tracing of the client's work, most notably the stages of
+:meth:`multyvac.job.JobModule.submit`: pickling, dependency scanning,
+volume lookup, syncing, and HTTP requests.
+
+Tracing is off until an exporter is added to ``Multyvac.tracer``::
+
+    from multyvac.tracing import OTLPJSONExporter
+    multyvac.tracer.add_exporter(OTLPJSONExporter())
+"""
+
+import atexit
+import collections
+import json
+import logging
+import Queue
+import random
+import threading
+import time
+
+class Span(object):
+    """A timed operation. Spans nest to form a trace."""
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes,
+                 start_time=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_time = start_time if start_time is not None else time.time()
+        self.end_time = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, end_time=None):
+        """Ends the span and hands it to the tracer's exporters."""
+        if self.end_time is None:
+            self.end_time = end_time if end_time is not None else time.time()
+            self.tracer._export(self)
+
+    def __enter__(self):
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.tracer._pop(self)
+        if exc_type is not None:
+            self.error = '%s: %s' % (exc_type.__name__, exc_value)
+        self.end()
+
+    def __repr__(self):
+        return 'Span(%r, %s)' % (self.name, self.span_id)
+
+class _NullSpan(object):
+    """Stands in for a Span when tracing is off, at almost no cost."""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def end(self, end_time=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+_null_span = _NullSpan()
+
+class Tracer(object):
+    """
+    Creates spans and passes finished ones to exporters. Use this through
+    ``Multyvac.tracer``.
+
+    Spans started with :meth:`span` in a ``with`` block become the parent of
+    spans started inside it on the same thread.
+    """
+
+    # Number of submitted jobs whose spans are remembered until they finish
+    max_tracked_jobs = 10000
+
+    def __init__(self):
+        self.exporters = []
+        self._local = threading.local()
+        self._jobs = {}
+        # Tracked jids, oldest first. May hold jids already recorded.
+        self._job_order = collections.deque()
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger('multyvac.tracing')
+
+    @property
+    def enabled(self):
+        return bool(self.exporters)
+
+    def add_exporter(self, exporter):
+        """Adds an exporter, which turns tracing on. An exporter has an
+        export(span) method, and a flush() method called at the end of every
+        trace."""
+        self.exporters.append(exporter)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _push(self, span):
+        self._stack().append(span)
+
+    def _pop(self, span):
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+
+    def current_span(self):
+        """Returns the innermost span active on this thread, or None."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def span(self, name, parent=None, **attributes):
+        """
+        Returns a new span, to be used as a context manager.
+
+        :param parent: The parent span. Defaults to the current span.
+        :param attributes: Arbitrary data about the operation.
+        """
+        if not self.exporters:
+            return _null_span
+        parent = parent or self.current_span()
+        if parent:
+            return Span(self, name, parent.trace_id, parent.span_id,
+                        attributes)
+        else:
+            return Span(self, name, '%032x' % random.getrandbits(128), None,
+                        attributes)
+
+    def track_job(self, jid, span):
+        """Remembers the span that submitted a job, so that the job's queue,
+        overhead, and runtime can be added to its trace once it finishes."""
+        if not isinstance(span, Span):
+            return
+        with self._lock:
+            while len(self._jobs) >= self.max_tracked_jobs:
+                self._jobs.pop(self._job_order.popleft(), None)
+            self._jobs[jid] = span
+            self._job_order.append(jid)
+            if len(self._job_order) > 2 * self.max_tracked_jobs:
+                # Drop the jids of recorded jobs
+                self._job_order = collections.deque(
+                    j for j in self._job_order if j in self._jobs)
+
+    def record_job(self, job):
+        """
+        Adds child spans for the queue delay, overhead delay, and runtime of
+        a finished job to the span that submitted it. Does nothing if the job
+        is not tracked, or lacks any of these, as a job fetched with only
+        some fields does; the job stays tracked until it is fetched whole.
+        """
+        if (job.queue_delay is None or job.overhead_delay is None or
+                job.runtime is None):
+            return
+        with self._lock:
+            parent = self._jobs.pop(job.jid, None)
+        if not parent:
+            return
+        start = parent.end_time or parent.start_time
+        for name, duration in (('job.queue', job.queue_delay),
+                               ('job.overhead', job.overhead_delay),
+                               ('job.runtime', job.runtime)):
+            span = Span(self, name, parent.trace_id, parent.span_id,
+                        {'jid': job.jid, 'status': job.status},
+                        start_time=start)
+            span.end(start + duration)
+            start += duration
+        self._flush()
+
+    def _export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                self._logger.exception('Exporter %r failed', exporter)
+        if span.parent_id is None:
+            self._flush()
+
+    def _flush(self):
+        for exporter in self.exporters:
+            try:
+                exporter.flush()
+            except Exception:
+                self._logger.exception('Exporter %r failed', exporter)
+
+class InMemoryExporter(object):
+    """Keeps finished spans in a list, for inspection in-process."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def flush(self):
+        pass
+
+class OTLPJSONExporter(object):
+    """
+    Sends spans to an OpenTelemetry collector using the OTLP/HTTP JSON
+    protocol. Spans are queued, and a background thread sends them in
+    batches when a trace finishes, and every ``export_interval`` seconds, so
+    that the threads being traced never wait on the collector. Once
+    ``max_queue_size`` spans are waiting, further spans are dropped and
+    counted in ``dropped_spans``.
+    """
+
+    def __init__(self, endpoint='http://localhost:4318/v1/traces',
+                 service_name='multyvac-client', timeout=5.0,
+                 max_queue_size=2048, max_batch_size=512,
+                 export_interval=5.0):
+        """
+        :param timeout: Seconds to wait for the collector on every request.
+        :param max_queue_size: The most spans waiting to be sent.
+        :param max_batch_size: The most spans sent in one request.
+        :param export_interval: The most seconds a span waits before it is
+            sent.
+        """
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self.export_interval = export_interval
+        self.dropped_spans = 0
+        self._queue = Queue.Queue(max_queue_size)
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger('multyvac.tracing')
+
+    def export(self, span):
+        self._start()
+        try:
+            self._queue.put_nowait(span)
+        except Queue.Full:
+            with self._lock:
+                self.dropped_spans += 1
+
+    def flush(self):
+        """Has the background thread send the queued spans now."""
+        self._wake.set()
+
+    def shutdown(self, timeout=None):
+        """Sends the queued spans and stops the background thread. Called
+        when the interpreter exits."""
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        if thread is not None:
+            self._wake.set()
+            thread.join(timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None or self._stopped:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='multyvac-otlp-exporter')
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self.shutdown, self.timeout)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.export_interval)
+            self._wake.clear()
+            self._send_queued()
+            if self._stopped:
+                return
+
+    def _send_queued(self):
+        while True:
+            spans = []
+            while len(spans) < self.max_batch_size:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if not spans:
+                return
+            try:
+                self._send(spans)
+            except Exception:
+                self._logger.exception('Sending %d spans to %s failed',
+                                       len(spans), self.endpoint)
+
+    def _send(self, spans):
+        import requests
+        requests.post(self.endpoint,
+                      data=json.dumps(self.encode(spans)),
+                      headers={'content-type': 'application/json'},
+                      timeout=self.timeout)
+
+    def encode(self, spans):
+        """Returns the OTLP JSON body for a list of spans."""
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': _otlp_attributes(
+                    {'service.name': self.service_name})},
+                'scopeSpans': [{
+                    'scope': {'name': 'multyvac'},
+                    'spans': [_otlp_span(s) for s in spans],
+                }],
+            }],
+        }
+
+def _otlp_span(span):
+    d = {'traceId': span.trace_id,
+         'spanId': span.span_id,
+         'name': span.name,
+         # SPAN_KIND_CLIENT
+         'kind': 3,
+         'startTimeUnixNano': str(int(span.start_time * 1e9)),
+         'endTimeUnixNano': str(int(span.end_time * 1e9)),
+         'attributes': _otlp_attributes(span.attributes),
+         }
+    if span.parent_id:
+        d['parentSpanId'] = span.parent_id
+    if span.error:
+        # STATUS_CODE_ERROR
+        d['status'] = {'code': 2, 'message': span.error}
+    return d
+
+def _otlp_attributes(attributes):
+    encoded = []
+    for key, value in sorted(attributes.items()):
+        if isinstance(value, bool):
+            v = {'boolValue': value}
+        elif isinstance(value, (int, long)):
+            v = {'intValue': str(value)}
+        elif isinstance(value, float):
+            v = {'doubleValue': value}
+        else:
+            v = {'stringValue': str(value)}
+        encoded.append({'key': key, 'value': v})
+    return encoded
@@ -0,0 +1,100 @@
+"""
+Futures for the results of calls that run in the background.
+:class:`concurrent.futures.Future` is used when the ``futures`` backport is
+installed, and a stand-in with the same methods otherwise.
+"""
+
+import threading
+
+try:
+    from concurrent.futures import (
+        CancelledError,
+        Future,
+        TimeoutError,
+    )
+except ImportError:
+    class CancelledError(Exception):
+        pass
+
+    class TimeoutError(Exception):
+        pass
+
+    class Future(object):
+        """A minimal stand-in for :class:`concurrent.futures.Future`."""
+
+        def __init__(self):
+            self._condition = threading.Condition()
+            self._state = 'pending'
+            self._result = None
+            self._exception = None
+            self._callbacks = []
+
+        def cancel(self):
+            with self._condition:
+                if self._state in ('running', 'finished'):
+                    return self._state == 'cancelled'
+                self._state = 'cancelled'
+                self._condition.notify_all()
+            self._invoke_callbacks()
+            return True
+
+        def cancelled(self):
+            return self._state == 'cancelled'
+
+        def running(self):
+            return self._state == 'running'
+
+        def done(self):
+            return self._state in ('cancelled', 'finished')
+
+        def result(self, timeout=None):
+            self._wait(timeout)
+            if self._exception is not None:
+                raise self._exception
+            return self._result
+
+        def exception(self, timeout=None):
+            self._wait(timeout)
+            return self._exception
+
+        def add_done_callback(self, fn):
+            with self._condition:
+                if not self.done():
+                    self._callbacks.append(fn)
+                    return
+            fn(self)
+
+        def set_running_or_notify_cancel(self):
+            with self._condition:
+                if self._state == 'cancelled':
+                    return False
+                self._state = 'running'
+                return True
+
+        def set_result(self, result):
+            with self._condition:
+                self._result = result
+                self._state = 'finished'
+                self._condition.notify_all()
+            self._invoke_callbacks()
+
+        def set_exception(self, exception):
+            with self._condition:
+                self._exception = exception
+                self._state = 'finished'
+                self._condition.notify_all()
+            self._invoke_callbacks()
+
+        def _wait(self, timeout):
+            with self._condition:
+                if not self.done():
+                    self._condition.wait(timeout)
+                if self._state == 'cancelled':
+                    raise CancelledError()
+                if not self.done():
+                    raise TimeoutError()
+
+        def _invoke_callbacks(self):
+            for fn in self._callbacks:
+                fn(self)
+
@@ -0,0 +1,2 @@
+# setup.py reads this with a regular expression, so keep it a plain string.
+__version__ = '0.6.0'
@@ -3,7 +3,9 @@ import json
 import posixpath
 
 from .multyvac import (
+    Deadline,
     Multyvac,
+    MultyvacError,
     MultyvacModel,
     MultyvacModule,
     SyncError,
@@ -13,6 +15,9 @@ from .util.cygwin import regularize_path
 class Volume(MultyvacModel):
     """Represents a Multyvac Volume and its associated operations."""
     
+    # Seconds to try to kill the job a sync went through for
+    kill_timeout = 30.0
+    
     def __init__(self, name, **kwargs):
         """Creates a new volume."""
         MultyvacModel.__init__(self, **kwargs)
@@ -66,7 +71,8 @@ class Volume(MultyvacModel):
                                params={'path': [path]},
                                )
         f = r['files'][0]
-        f['contents'] = base64.b64decode(f['contents'])
+        with self.multyvac.stats.timer('base64_decode'):
+            f['contents'] = base64.b64decode(f['contents'])
         return f
     
     def get_file(self, remote_path, local_path):
@@ -120,12 +126,15 @@ class Volume(MultyvacModel):
                                )
         return MultyvacModule.check_success(r)
 
-    def sync_up(self, local_path, remote_path):
+    def sync_up(self, local_path, remote_path, timeout=None):
         """
         Syncs data up to Multyvac.
         
         :param str local_path: Can be a string or list of strings.
         :param str remote_path: The relative path in the volume to sync to.
+        :param timeout: If the sync, including starting the job that receives
+            it, does not finish in this many seconds, DeadlineExceeded is
+            raised.
         """
         
         if not hasattr(local_path, '__iter__'):
@@ -133,15 +142,19 @@ class Volume(MultyvacModel):
 
         if remote_path.startswith('/'):
             raise ValueError('remote_path cannot be relative to root (/)')
+        deadline = Deadline(timeout)
         jid = self.multyvac.job.shell_submit(
             'python /usr/local/lib/python2.7/dist-packages/multyvacinit/sync.py',
             _name='volume sync up to %s' % self.name,
             _vol=[self.name],
             _tags={'system': 'true'},
+            _timeout=deadline.remaining(),
         )
-        job = self.multyvac.job.get(jid)
         try:
-            if not job.wait_for_open_port(22):
+            job = self.multyvac.job.get(jid, timeout=deadline.remaining())
+            if not job.wait_for_open_port(
+                    22, deadline.remaining_or_raise('Sync')):
+                deadline.check('Sync')
                 raise SyncError(None,
                                 'Failed waiting for job %d to open port' % jid)
             port = job.ports['tcp']['22']['port']
@@ -156,30 +169,38 @@ class Volume(MultyvacModel):
                 ' '.join([regularize_path(p) for p in local_path]),
                 address,
                 posixpath.join(self.mount_path, remote_path),
-                port
+                port,
+                deadline.remaining(),
             )
         finally:
-            job.kill()
+            self._kill_sync_job(jid)
 
-    def sync_down(self, remote_path, local_path):
+    def sync_down(self, remote_path, local_path, timeout=None):
         """
         Syncs data down from Multyvac.
         
         :param str remote_path: The relative path in the volume to sync from.
         :param str local_path: The local path to sync to.
+        :param timeout: If the sync, including starting the job that sends
+            it, does not finish in this many seconds, DeadlineExceeded is
+            raised.
         """
         
         if remote_path.startswith('/'):
             raise ValueError('remote_path cannot be relative to root (/)')
+        deadline = Deadline(timeout)
         jid = self.multyvac.job.shell_submit(
             'python /usr/local/lib/python2.7/dist-packages/multyvacinit/sync.py',
             _name='volume sync down from %s' % self.name,
             _vol=[self.name],
             _tags={'system': 'true'},
+            _timeout=deadline.remaining(),
         )
-        job = self.multyvac.job.get(jid)
         try:
-            if not job.wait_for_open_port(22):
+            job = self.multyvac.job.get(jid, timeout=deadline.remaining())
+            if not job.wait_for_open_port(
+                    22, deadline.remaining_or_raise('Sync')):
+                deadline.check('Sync')
                 raise SyncError(None,
                                 'Failed waiting for job %d to open port' % jid)
             port = job.ports['tcp']['22']['port']
@@ -192,9 +213,21 @@ class Volume(MultyvacModel):
             self.multyvac._sync_down(address,
                                      posixpath.join(self.mount_path, remote_path),
                                      port,
-                                     regularize_path(local_path))
+                                     regularize_path(local_path),
+                                     deadline.remaining())
         finally:
-            job.kill()
+            self._kill_sync_job(jid)
+
+    def _kill_sync_job(self, jid):
+        """Kills the job a sync went through. This is tried even once the
+        sync's deadline has passed, for at most kill_timeout seconds. A
+        failure is logged rather than raised, so that it does not hide the
+        outcome of the sync."""
+        try:
+            self.multyvac.job.kill(jid, timeout=self.kill_timeout)
+        except MultyvacError:
+            self.multyvac.volume._logger.warning('Could not kill sync job %s',
+                                                 jid, exc_info=True)
 
     def __repr__(self):
         return 'Volume(%s)' % repr(self.name)
@@ -202,17 +235,20 @@ class Volume(MultyvacModel):
 class VolumeModule(MultyvacModule):
     """Top-level Volume module. Use this through ``multyvac.volume``."""
     
-    def get(self, name):
+    def get(self, name, timeout=None):
         """
         Returns a Volume object.
         
         :param name: Name of volume.
+        :param timeout: Seconds to wait for Multyvac before raising
+            DeadlineExceeded.
         """
-        vs = self.list(name)
+        vs = self.list(name, timeout=timeout)
         if vs:
             return vs[0]
     
-    def create(self, name, mount_path, mount_type=None, description=None):
+    def create(self, name, mount_path, mount_type=None, description=None,
+               timeout=None):
         """
         Creates a new volume.
         
@@ -221,6 +257,8 @@ class VolumeModule(MultyvacModule):
             volume mounted at.
         :param mount_type: Currently only 'bind' is supported.
         :param description: An optional description of the volume.
+        :param timeout: Seconds to wait for Multyvac before raising
+            DeadlineExceeded.
         """
         
         volume = {'name': name,
@@ -234,22 +272,26 @@ class VolumeModule(MultyvacModule):
         r = self.multyvac._ask(Multyvac._ASK_POST,
                                '/volume',
                                data=json.dumps(payload),
-                               headers=headers)
+                               headers=headers,
+                               timeout=timeout)
         return MultyvacModule.check_success(r)
 
-    def list(self, name=None):
+    def list(self, name=None, timeout=None):
         """
         Returns a list of volume objects.
         
         :param name: A string or list of strings to filter results to only a
             set of volumes. 
+        :param timeout: Seconds to wait for Multyvac before raising
+            DeadlineExceeded.
         """
         params = {}
         if name:
             params['name'] = name
         r = self.multyvac._ask(Multyvac._ASK_GET,
                                '/volume',
-                               params=params)
+                               params=params,
+                               timeout=timeout)
         for volume in r['volumes']:
             volume['created_at'] = MultyvacModule.convert_str_to_datetime(volume['created_at'])
         return [Volume(multyvac=self.multyvac, **v) for v in r['volumes']]
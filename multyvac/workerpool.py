@@ -0,0 +1,460 @@
+"""
+A pool of long-running worker jobs that run many small tasks each, for work
+where the cost of starting a job dwarfs the work itself::
+
+    from multyvac.workerpool import WorkerPool
+    with WorkerPool(size=8, _core='c2') as pool:
+        results = list(pool.map(f, xs))
+        future = pool.submit(g, 1, y=2)
+        print future.result()
+
+Each worker is a job that opens ``port``, which the client connects to once
+:meth:`multyvac.job.Job.wait_for_open_port` finds it open. Tasks are pickled
+and sent over that one connection, prefixed with their length, up to
+``pipeline`` at a time per worker. A function is sent to each worker once,
+and modules it imports stay imported between tasks.
+
+The port is reachable from anywhere, so each pool makes up a random secret
+that its workers are started with. A connection must send the secret before
+anything else, or the worker closes it without unpickling anything.
+
+:meth:`WorkerPool.submit` returns a :class:`concurrent.futures.Future` when
+the ``futures`` backport is installed, and an object with the same methods
+otherwise. A task that raises gets a :class:`TaskError` with the remote
+traceback. If a worker's job fails or its connection is lost, its tasks in
+flight get a :class:`WorkerError`, and the other workers take over the
+queued tasks. Once every worker has failed, queued tasks get a WorkerError
+too.
+
+Workers exit when the pool shuts down, or after ``idle_timeout`` seconds
+without a client connected.
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import Queue
+import socket
+import struct
+import threading
+import time
+
+from .job import JobError
+from .multyvac import MultyvacError
+from .util.futures import (
+    CancelledError,
+    Future,
+    TimeoutError,
+)
+
+class WorkerError(MultyvacError):
+    """A worker's job failed or its connection was lost."""
+    pass
+
+class TaskError(JobError):
+    """An exception raised by a task on a worker."""
+
+    def __init__(self, exc_type, message, traceback):
+        JobError.__init__(self, '%s: %s' % (exc_type, message))
+        self.exc_type = exc_type
+        self.message = message
+        self.traceback = traceback
+
+def worker_main(port, idle_timeout, secret):
+    """
+    Returns the function each worker job runs. It runs on Multyvac, so it
+    must not depend on anything but the standard library.
+
+    The worker accepts one client connection at a time on port. Messages in
+    both directions are prefixed with their length as a 4-byte big-endian
+    integer. The client's first message must be secret, unpickled. The
+    others are pickled tuples:
+
+    * ``('func', key, pickled function)`` adds a function.
+    * ``('task', task id, key, pickled (args, kwargs))`` calls a function,
+      and is answered with ``(task id, True, pickled result)`` or
+      ``(task id, False, (exception type, message, traceback))``.
+    * ``('stop',)`` makes the worker return the number of tasks it ran.
+    """
+    def serve():
+        import pickle
+        import socket
+        import struct
+        import sys
+        import traceback
+
+        def recv_exactly(conn, n):
+            chunks = []
+            while n:
+                chunk = conn.recv(min(n, 1024*1024))
+                if not chunk:
+                    return None
+                chunks.append(chunk)
+                n -= len(chunk)
+            return ''.join(chunks)
+
+        def authenticated(conn):
+            # Only read as much as the secret takes, and not for long, so
+            # that strangers can neither send much nor hold the port.
+            conn.settimeout(10.0)
+            try:
+                header = recv_exactly(conn, 4)
+                if (header is None or
+                        struct.unpack('!I', header)[0] != len(secret)):
+                    return False
+                data = recv_exactly(conn, len(secret))
+            except socket.error:
+                return False
+            if data is None:
+                return False
+            # Compare in constant time
+            diff = 0
+            for a, b in zip(data, secret):
+                diff |= ord(a) ^ ord(b)
+            return diff == 0
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('', port))
+        server.listen(1)
+        server.settimeout(idle_timeout)
+        funcs = {}
+        tasks = 0
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                server.close()
+                return tasks
+            if not authenticated(conn):
+                conn.close()
+                continue
+            conn.settimeout(None)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while True:
+                header = recv_exactly(conn, 4)
+                data = header and recv_exactly(conn,
+                                               struct.unpack('!I', header)[0])
+                if data is None:
+                    # The client went away; wait for another
+                    conn.close()
+                    break
+                message = pickle.loads(data)
+                if message[0] == 'stop':
+                    conn.close()
+                    server.close()
+                    return tasks
+                elif message[0] == 'func':
+                    funcs[message[1]] = pickle.loads(message[2])
+                    continue
+                _, task_id, key, payload = message
+                try:
+                    args, kwargs = pickle.loads(payload)
+                    reply = (task_id, True,
+                             pickle.dumps(funcs[key](*args, **kwargs), 2))
+                except Exception:
+                    exc_type, exc_value = sys.exc_info()[:2]
+                    reply = (task_id, False,
+                             (exc_type.__name__, str(exc_value),
+                              traceback.format_exc()))
+                tasks += 1
+                data = pickle.dumps(reply, 2)
+                conn.sendall(struct.pack('!I', len(data)) + data)
+    return serve
+
+class WorkerPool(object):
+    """Runs tasks on long-running worker jobs. See the module
+    documentation."""
+
+    def __init__(self, size=4, multyvac=None, port=5555, pipeline=2,
+                 startup_timeout=None, idle_timeout=300.0, **kwargs):
+        """
+        :param size: The number of worker jobs.
+        :param multyvac: The Multyvac object to use. Defaults to the one used
+            by the top-level functions of the multyvac module.
+        :param port: The port workers listen on.
+        :param pipeline: The most tasks sent to a worker at once. More than
+            one hides the round trip between tasks.
+        :param startup_timeout: Seconds to wait for each worker to start and
+            open its port.
+        :param idle_timeout: Seconds a worker waits for a client before
+            exiting, so that abandoned workers do not keep running.
+        :param kwargs: Passed to :meth:`multyvac.job.JobModule.submit` for
+            each worker, for example _core or _layer.
+        """
+        if multyvac is None:
+            import multyvac as _multyvac_module
+            multyvac = _multyvac_module._default()
+        self.multyvac = multyvac
+        self.size = size
+        self.port = port
+        self.pipeline = pipeline
+        self.startup_timeout = startup_timeout
+        self._tasks = Queue.Queue()
+        self._task_ids = itertools.count()
+        self._funcs = {}
+        self._lock = threading.Lock()
+        self._live = size
+        self._shutdown = False
+        self._logger = logging.getLogger('multyvac.workerpool')
+        self._secret = os.urandom(32).encode('hex')
+        kwargs.setdefault('_name', 'multyvac-worker')
+        serve = worker_main(port, idle_timeout, self._secret)
+        self.jids = [self.multyvac.job.submit(serve, **dict(kwargs))
+                     for _ in range(size)]
+        self._workers = [_Worker(self, jid) for jid in self.jids]
+
+    def submit(self, f, *args, **kwargs):
+        """Schedules f(*args, **kwargs) on a worker. Returns a Future."""
+        if self._shutdown:
+            raise RuntimeError('WorkerPool is shut down')
+        future = Future()
+        task = (future, f, _dumps((args, kwargs)))
+        # Checked under the lock so that the task cannot be queued after the
+        # last worker failed and emptied the queue
+        with self._lock:
+            if not self._live:
+                raise WorkerError('Every worker failed')
+            self._tasks.put(task)
+        return future
+
+    def map(self, f, *iterables, **kwargs):
+        """
+        Like the built-in map(), but runs f on the workers. Returns an
+        iterator over the results, in order. Like
+        :meth:`concurrent.futures.Executor.map`, every call is scheduled
+        immediately.
+
+        :param timeout: Seconds from the call to map() after which getting a
+            result that is not ready raises TimeoutError.
+        """
+        timeout = kwargs.pop('timeout', None)
+        if kwargs:
+            raise TypeError('Unexpected arguments: %s' % ', '.join(kwargs))
+        end = time.time() + timeout if timeout is not None else None
+        futures = [self.submit(f, *args) for args in zip(*iterables)]
+        def results():
+            try:
+                for future in futures:
+                    if end is None:
+                        yield future.result()
+                    else:
+                        yield future.result(max(end - time.time(), 0))
+            finally:
+                for future in futures:
+                    future.cancel()
+        return results()
+
+    def shutdown(self, wait=True):
+        """Stops the workers once the tasks already submitted have run. With
+        wait, blocks until then."""
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            for _ in self._workers:
+                self._tasks.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown()
+
+    def _func(self, f):
+        """Returns the key and pickled form of f, pickling it only once."""
+        with self._lock:
+            if f not in self._funcs:
+                data = _dumps(f)
+                self._funcs[f] = (hashlib.sha1(data).hexdigest(), data)
+            return self._funcs[f]
+
+    def _worker_failed(self, worker, reason):
+        self._logger.warning('Worker job %s failed: %s', worker.jid, reason)
+        # Runs on a worker's thread, so an error here would leave the pool
+        # counting a failed worker as live
+        try:
+            self.multyvac.job.kill(worker.jid)
+        except Exception as e:
+            self._logger.warning('Could not kill worker job %s: %s',
+                                 worker.jid, e)
+        with self._lock:
+            self._live -= 1
+            live = self._live
+        if not live:
+            # Nobody is left to run the queued tasks
+            while True:
+                try:
+                    task = self._tasks.get_nowait()
+                except Queue.Empty:
+                    break
+                if task and task[0].set_running_or_notify_cancel():
+                    task[0].set_exception(WorkerError('Every worker failed'))
+
+    def _requeue(self, task):
+        """Hands a task that a failed worker took back to the others, or fails
+        it if they will not take it."""
+        with self._lock:
+            # Tasks queued after shutdown() would land behind the workers'
+            # signals to stop.
+            if self._live and not self._shutdown:
+                self._tasks.put(task)
+                return
+        if task[0].set_running_or_notify_cancel():
+            task[0].set_exception(WorkerError('Every worker failed'))
+
+class _Worker(object):
+    """The client side of one worker job: a thread that sends it tasks, and
+    one that receives their results."""
+
+    def __init__(self, pool, jid):
+        self.pool = pool
+        self.jid = jid
+        self.sock = None
+        self._pending = {}
+        self._sent_funcs = set()
+        self._window = threading.Semaphore(pool.pipeline)
+        self._failed = False
+        self._fail_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._send_loop,
+                                       name='multyvac-worker-%s' % jid)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _connect(self):
+        job = self.pool.multyvac.job.get(self.jid)
+        address = job.wait_for_open_port(self.pool.port,
+                                         timeout=self.pool.startup_timeout)
+        if not address:
+            raise WorkerError('Worker job %s is %s without opening port %s'
+                              % (self.jid, job.status, self.pool.port))
+        sock = socket.create_connection((address['address'],
+                                         int(address['port'])))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        secret = self.pool._secret
+        sock.sendall(struct.pack('!I', len(secret)) + secret)
+        return sock
+
+    def _send_loop(self):
+        try:
+            self.sock = self._connect()
+        except Exception as e:
+            self._fail(e)
+            return
+        receiver = threading.Thread(target=self._receive_loop,
+                                    name='multyvac-worker-%s-recv' % self.jid)
+        receiver.daemon = True
+        receiver.start()
+        try:
+            while True:
+                self._window.acquire()
+                if self._failed:
+                    return
+                task = self.pool._tasks.get()
+                if task is None:
+                    break
+                if self._failed:
+                    self.pool._requeue(task)
+                    return
+                future, f, payload = task
+                if not future.set_running_or_notify_cancel():
+                    self._window.release()
+                    continue
+                task_id = next(self.pool._task_ids)
+                self._pending[task_id] = future
+                key, data = self.pool._func(f)
+                if key not in self._sent_funcs:
+                    self._send(('func', key, data))
+                    self._sent_funcs.add(key)
+                self._send(('task', task_id, key, payload))
+            # Let the tasks in flight finish before stopping the worker
+            for _ in range(self.pool.pipeline - 1):
+                self._window.acquire()
+            if self._failed:
+                return
+            self._send(('stop',))
+            receiver.join()
+        except Exception as e:
+            self._fail(e)
+
+    def _receive_loop(self):
+        while True:
+            try:
+                data = _recv_message(self.sock)
+            except Exception as e:
+                self._fail(e)
+                return
+            if data is None:
+                if self._pending:
+                    self._fail(WorkerError('Connection to worker job %s '
+                                           'closed' % self.jid))
+                return
+            task_id, ok, value = pickle.loads(data)
+            future = self._pending.pop(task_id, None)
+            if future is None:
+                # Already failed by _fail()
+                continue
+            if ok:
+                try:
+                    future.set_result(pickle.loads(value))
+                except Exception as e:
+                    future.set_exception(e)
+            else:
+                future.set_exception(TaskError(*value))
+            self._window.release()
+
+    def _send(self, message):
+        data = pickle.dumps(message, 2)
+        self.sock.sendall(struct.pack('!I', len(data)) + data)
+
+    def _fail(self, reason):
+        # Fail the tasks in flight every time, since the send thread may
+        # have added one after an earlier call.
+        for task_id in self._pending.keys():
+            future = self._pending.pop(task_id, None)
+            if future:
+                future.set_exception(WorkerError('Worker job %s failed: %s' %
+                                                 (self.jid, reason)))
+        with self._fail_lock:
+            if self._failed:
+                return
+            self._failed = True
+        if self.sock:
+            self.sock.close()
+        # Wake the send thread if it is waiting for room in the window, so
+        # that it sees the failure and stops.
+        for _ in range(self.pool.pipeline):
+            self._window.release()
+        self.pool._worker_failed(self, reason)
+
+def _dumps(obj):
+    """Pickles obj with CloudPickler, so that functions defined in
+    __main__ and lambdas can be sent."""
+    from StringIO import StringIO
+    from .util.cloudpickle import CloudPickler
+    s = StringIO()
+    CloudPickler(s, 2).dump(obj)
+    return s.getvalue()
+
+def _recv_message(sock):
+    """Returns the next length-prefixed message, or None if the connection
+    closed."""
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    return _recv_exactly(sock, struct.unpack('!I', header)[0])
+
+def _recv_exactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1024*1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return ''.join(chunks)
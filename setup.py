@@ -1,3 +1,5 @@
+import re
+
 from setuptools import setup
 
 # We disable requirements.txt parsing for now since users are having problems
@@ -6,11 +8,16 @@ from setuptools import setup
 # parse_requirements() returns generator of pip.req.InstallRequirement objects
 #install_reqs = [str(ir.req) for ir in parse_requirements('requirements.txt')]
 
-install_reqs = ['requests>=1.1.0', 'ConcurrentLogHandler>=0.9.1']
+# Read the version without importing multyvac, whose dependencies may not be
+# installed yet.
+with open('multyvac/version.py') as f:
+    version = re.search(r"__version__ = '(.*)'", f.read()).group(1)
+
+install_reqs = ['requests>=2.4.0', 'ConcurrentLogHandler>=0.9.1']
 
 dist = setup(
     name='vac',
-    version='0.6.0',
+    version=version,
     description='Multyvac fork for Python',
     author='Cloudpipe',
     author_email='cloudpipe@googlegroups.com',
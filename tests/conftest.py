@@ -0,0 +1,22 @@
+import pytest
+
+import multyvac
+from multyvac.mock_server import MockServer
+from multyvac.ratelimit import RateLimiter
+
+@pytest.fixture
+def server():
+    server = MockServer(workers=4).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def client(server, tmpdir, monkeypatch):
+    """A Multyvac object talking to the mock server, with its configuration
+    and logs in a temporary directory."""
+    monkeypatch.setenv('HOME', str(tmpdir))
+    m = multyvac.Multyvac(api_key='mock', api_secret_key='mock',
+                          api_url=server.url)
+    # Keep rate limits learned by one test from slowing down the others
+    m.rate_limiter = RateLimiter()
+    return m
@@ -0,0 +1,48 @@
+from multyvac.asyncclient import AsyncMultyvac
+
+def double(x):
+    return x * 2
+
+def sleep(seconds):
+    import time
+    time.sleep(seconds)
+    return seconds
+
+def test_submit_get_and_wait(client):
+    with AsyncMultyvac(client, poll_interval=0.1) as async_client:
+        jid = async_client.job.submit(
+            double, 21, _ignore_module_dependencies=True).result(timeout=30)
+        jobs = async_client.job.wait([jid]).result(timeout=30)
+        assert [job.get_result() for job in jobs] == [42]
+        job = async_client.job.get(jid).result(timeout=30)
+        assert job.status == 'done'
+
+def test_waits_share_batched_polls(client, monkeypatch):
+    # The jobs outlast the start of both waits
+    jids = [client.job.submit(sleep, 1, _ignore_module_dependencies=True)
+            for _ in range(4)]
+    requests = []
+    get = client.job.get
+    def counting_get(jid, fields=None, timeout=None):
+        requests.append((jid, fields))
+        return get(jid, fields=fields, timeout=timeout)
+    monkeypatch.setattr(client.job, 'get', counting_get)
+    with AsyncMultyvac(client, poll_interval=0.1) as async_client:
+        first = async_client.job.wait(jids[:3])
+        second = async_client.job.wait(jids[2:])
+        assert ([job.jid for job in first.result(timeout=30)] == jids[:3])
+        assert ([job.jid for job in second.result(timeout=30)] == jids[2:])
+    status_polls = [jids_polled for jids_polled, fields in requests
+                    if fields == ['jid', 'status']]
+    # A poll asks for the jobs of both waits at once
+    assert sorted(jids) in [sorted(polled) for polled in status_polls]
+    full_gets = [jids_got for jids_got, fields in requests if fields is None]
+    # Each job is got in full only once, though two waits wanted jids[2]
+    assert sum(len(got) for got in full_gets) == len(jids)
+
+def test_wait_times_out_with_none(client):
+    jid = client.job.shell_submit('sleep 30')
+    with AsyncMultyvac(client, poll_interval=0.1) as async_client:
+        assert async_client.job.wait([jid], timeout=0.5).result(
+            timeout=10) is None
+    client.job.kill(jid)
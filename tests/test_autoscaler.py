@@ -0,0 +1,88 @@
+import time
+
+from multyvac.autoscaler import ClusterAutoscaler
+
+def fill_queue(client, queued):
+    """Submits jobs for the mock server's 4 workers, and queued more."""
+    jids = [client.job.shell_submit('sleep 30') for _ in range(4 + queued)]
+    for _ in range(100):
+        if client.job.queue_stats().get('c1', {}).get('processing') == 4:
+            return jids
+        time.sleep(0.05)
+    raise AssertionError('jobs did not start')
+
+def active(server):
+    return sorted(cid for cid, c in server.api.clusters.items()
+                  if c['state'] != 'released')
+
+def autoscaler(client, **kwargs):
+    kwargs.setdefault('cores_per_cluster', 4)
+    return ClusterAutoscaler(client, core='c1', **kwargs)
+
+def test_provisions_for_queued_jobs(client, server):
+    fill_queue(client, 6)
+    scaler = autoscaler(client, max_cores=8)
+    scaler.step()
+    assert active(server) == [1, 2]
+    assert sorted(scaler.owned) == [1, 2]
+    assert scaler.core_hours == 8.0
+    # Within the cooldown, and at max_cores
+    scaler.step()
+    assert active(server) == [1, 2]
+    gauge = client.stats.snapshot()['gauges']['autoscaler_cores']
+    assert gauge == [{'labels': {'core': 'c1'}, 'value': 8}]
+
+def test_limits(client, server):
+    fill_queue(client, 20)
+    autoscaler(client, max_cores=4).step()
+    assert active(server) == [1]
+    autoscaler(client, max_cores=64, max_core_hours=8.0).step()
+    assert active(server) == [1, 2, 3]
+
+def test_waits_for_the_queue_to_build_up(client, server):
+    fill_queue(client, 1)
+    scaler = autoscaler(client, queued_threshold=5, wait_threshold=0.3)
+    scaler.step()
+    assert active(server) == []
+    time.sleep(0.3)
+    scaler.step()
+    assert active(server) == [1]
+
+def test_releases_idle_clusters(client, server):
+    jids = fill_queue(client, 8)
+    scaler = autoscaler(client, min_cores=8, idle_timeout=0.0,
+                        scale_down_cooldown=0.0)
+    scaler.step()
+    assert active(server) == [1, 2]
+    # Clusters provisioned by others count towards min_cores, but are never
+    # released
+    client.cluster.provision('c1', 4)
+    client.job.kill(jids)
+    for _ in range(3):
+        scaler.step()
+    assert active(server) == [2, 3]
+    assert scaler.owned.keys() == [2]
+
+def test_extends_clusters_near_their_end(client, server):
+    fill_queue(client, 1)
+    scaler = autoscaler(client, max_core_hours=8.0)
+    scaler.step()
+    assert server.api.clusters[1]['max_duration'] == 1.0
+    # As if provisioned 55 minutes ago
+    scaler.owned[1] -= 55 * 60
+    scaler.step()
+    assert server.api.clusters[1]['max_duration'] == 2.0
+    assert scaler.core_hours == 8.0
+    scaler.owned[1] -= 60 * 60
+    scaler.step()
+    assert server.api.clusters[1]['max_duration'] == 2.0
+
+def test_background_thread_releases_on_exit(client, server):
+    fill_queue(client, 2)
+    with autoscaler(client, poll_interval=0.05):
+        for _ in range(100):
+            if active(server):
+                break
+            time.sleep(0.05)
+        assert active(server) == [1]
+    assert active(server) == []
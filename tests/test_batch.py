@@ -0,0 +1,40 @@
+import functools
+
+import pytest
+
+from multyvac.job import JobModule
+
+def double(x):
+    return x * 2
+
+def test_estimate_key_ignores_location():
+    assert JobModule._func_name(double, location=False) == 'test_batch.double'
+    assert ' at ' in JobModule._func_name(double)
+    partial = functools.partial(double, 1)
+    assert (JobModule._func_name(partial, location=False) ==
+            'partial_of_test_batch.double')
+
+def test_fname_tag_fits_tag_limit():
+    def f():
+        pass
+    f.__name__ = 'x' * 200
+    fname = JobModule._fname_tag(f)
+    assert len(fname) == 100
+    assert fname.endswith('...')
+
+@pytest.mark.parametrize('chunksize', [0, -1, 1.5, 'big', True])
+def test_bad_chunksize_is_rejected_before_submitting(client, server,
+                                                     chunksize):
+    requests = server.counts['requests']
+    with pytest.raises(ValueError):
+        client.job.map(double, range(10), chunksize=chunksize)
+    with pytest.raises(ValueError):
+        client.job.imap(double, range(10), chunksize=chunksize)
+    with pytest.raises(ValueError):
+        client.job.imap_unordered(double, range(10), chunksize=chunksize)
+    assert server.counts['requests'] == requests
+
+def test_map_with_chunks(client):
+    results = client.job.map(double, range(10), chunksize=3,
+                             _ignore_module_dependencies=True)
+    assert results == [x * 2 for x in range(10)]
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from multyvac.dag import (
+    Dag,
+    DagError,
+    Node,
+)
+
+def add(x, y):
+    return x + y
+
+def fail():
+    raise ValueError('failed on purpose')
+
+def test_results_flow_to_children(client):
+    dag = Dag(client, poll_interval=0.1)
+    a = dag.submit(add, 1, 2, _ignore_module_dependencies=True)
+    b = dag.submit(add, a, 10, _ignore_module_dependencies=True)
+    c = dag.submit(add, b, a, _ignore_module_dependencies=True)
+    assert dag.run(timeout=60)
+    assert (a.result(), b.result(), c.result()) == (3, 13, 16)
+
+def test_failure_cancels_dependents_only(client):
+    dag = Dag(client, poll_interval=0.1)
+    bad = dag.submit(fail, _ignore_module_dependencies=True)
+    child = dag.submit(add, bad, 1, _ignore_module_dependencies=True)
+    other = dag.submit(add, 1, 1, _ignore_module_dependencies=True)
+    assert not dag.run(timeout=60)
+    assert bad.state == Node.state_failed
+    assert child.state == Node.state_cancelled
+    assert other.state == Node.state_done
+    with pytest.raises(DagError):
+        child.result()
+
+def test_fail_fast_records_finished_jobs_and_cancels_the_rest(client):
+    dag = Dag(client, fail_fast=True, poll_interval=0.1)
+    bad = dag.submit(fail, _ignore_module_dependencies=True)
+    quick = dag.submit(add, 1, 1, _ignore_module_dependencies=True)
+    slow = dag.shell_submit('sleep 30')
+    after = dag.shell_submit('true', _depends_on=[slow])
+    assert not dag.run(timeout=60)
+    assert bad.state == Node.state_failed
+    assert quick.state in (Node.state_done, Node.state_cancelled)
+    if quick.state == Node.state_done:
+        assert quick.result() == 2
+    assert slow.state == Node.state_cancelled
+    assert after.state == Node.state_cancelled
+    assert client.job.get(slow.jid).status == 'killed'
+
+def test_timeout_kills_running_jobs_and_returns_false(client, server):
+    dag = Dag(client, poll_interval=0.1)
+    slow = dag.shell_submit('sleep 30')
+    after = dag.shell_submit('true', _depends_on=[slow])
+    server.latency = 0.5
+    start = time.time()
+    assert not dag.run(timeout=1)
+    assert time.time() - start < 3
+    assert slow.state == Node.state_cancelled
+    assert slow.reason == 'timed out'
+    assert after.state == Node.state_cancelled
+    server.latency = 0
+    assert client.job.get(slow.jid).status == 'killed'
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from multyvac import DeadlineExceeded
+from multyvac.volume import Volume
+
+def test_get_raises_within_timeout(client, server):
+    jid = client.job.shell_submit('true')
+    server.latency = 2.0
+    start = time.time()
+    with pytest.raises(DeadlineExceeded):
+        client.job.get(jid, timeout=0.5)
+    assert time.time() - start < 1.5
+
+def test_wait_gives_up_within_timeout(client, server):
+    jid = client.job.shell_submit('sleep 30')
+    try:
+        start = time.time()
+        assert client.job.wait([jid], timeout=0.5) is None
+        assert time.time() - start < 1.5
+        # Also while stuck in a request
+        server.latency = 2.0
+        start = time.time()
+        assert client.job.wait([jid], timeout=0.5) is None
+        assert time.time() - start < 1.5
+    finally:
+        server.latency = 0.0
+        client.job.kill(jid)
+
+def test_sync_raises_once_deadline_passes_before_port_opens(client,
+                                                           monkeypatch):
+    # A job that runs without ever opening port 22
+    jid = client.job.shell_submit('sleep 30')
+    get = client.job.get
+    def slow_get(*args, **kwargs):
+        job = get(*args, **kwargs)
+        time.sleep(0.6)
+        return job
+    monkeypatch.setattr(client.job, 'shell_submit',
+                        lambda *args, **kwargs: jid)
+    monkeypatch.setattr(client.job, 'get', slow_get)
+    volume = Volume('data', mount_path='/data', multyvac=client)
+    start = time.time()
+    with pytest.raises(DeadlineExceeded):
+        volume.sync_up('.', 'x', timeout=0.5)
+    assert time.time() - start < 5
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import threading
+
+import multyvac
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import os
+import multyvac
+config_path = os.path.expanduser('~/.multyvac')
+assert multyvac._multyvac is None
+assert not os.path.exists(config_path)
+jid = multyvac.shell_submit('echo hello')
+assert multyvac._multyvac is not None
+assert os.path.exists(config_path)
+multyvac.wait([jid], timeout=30)
+print multyvac.get(jid).get_result().strip()
+print multyvac.config.api_url
+"""
+
+def test_import_does_not_touch_the_filesystem(server, tmpdir):
+    env = dict(os.environ, HOME=str(tmpdir), PYTHONPATH=ROOT,
+               MULTYVAC_API_KEY='mock', MULTYVAC_API_SECRET_KEY='mock',
+               MULTYVAC_API_URL=server.url)
+    p = subprocess.Popen([sys.executable, '-c', SCRIPT], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    assert p.returncode == 0, stderr
+    assert stdout.split() == ['hello', server.url]
+
+def test_default_is_created_once(monkeypatch):
+    created = []
+    gate = threading.Event()
+    def factory():
+        gate.wait()
+        created.append(object())
+        return created[-1]
+    monkeypatch.setattr(multyvac, '_multyvac', None)
+    monkeypatch.setattr(multyvac, 'Multyvac', factory)
+    defaults = []
+    threads = [threading.Thread(
+        target=lambda: defaults.append(multyvac._default()))
+        for _ in range(8)]
+    for t in threads:
+        t.start()
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(created) == 1
+    assert defaults == created * 8
+
+def test_top_level_names_follow_the_default(client, server, monkeypatch):
+    monkeypatch.setattr(multyvac, '_multyvac', client)
+    jid = multyvac.shell_submit('true')
+    assert multyvac.get(jid).jid == jid
+    assert multyvac.config.api_url == server.url
+    assert multyvac.volume.list() == []
+    multyvac.config.api_url = 'http://elsewhere'
+    assert client.config.api_url == 'http://elsewhere'
@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+def submit(client, n, name=None):
+    return [client.job.shell_submit('true', _name=name) for _ in range(n)]
+
+def count_gets(client):
+    gets = []
+    client.stats.add_hook(
+        lambda e: e['method'] == 'GET' and gets.append(e['uri']))
+    return gets
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_pages_through_every_job_newest_first(client, prefetch):
+    jids = submit(client, 25)
+    gets = count_gets(client)
+    jobs = list(client.job.iter_jobs(page_size=10, prefetch=prefetch))
+    assert [job.jid for job in jobs] == sorted(jids, reverse=True)
+    assert len(gets) == 3
+
+def test_stops_after_a_full_last_page(client):
+    submit(client, 20)
+    gets = count_gets(client)
+    assert len(list(client.job.iter_jobs(page_size=10))) == 20
+    # The third request finds nothing
+    assert len(gets) == 3
+
+def test_filters_and_fields(client):
+    named = submit(client, 3, name='wanted')
+    submit(client, 3)
+    jobs = list(client.job.iter_jobs(filters={'name': 'wanted'},
+                                     fields=['status'], page_size=2))
+    assert [job.jid for job in jobs] == sorted(named, reverse=True)
+    assert all(job.status is not None and job.cmd is None for job in jobs)
+
+def test_prefetch_stays_one_page_ahead(client):
+    submit(client, 50)
+    gets = count_gets(client)
+    jobs = client.job.iter_jobs(page_size=10)
+    next(jobs)
+    jobs.close()
+    time.sleep(0.5)
+    # The page being consumed, and at most the next two: one handed over
+    # and one fetched before the producer saw that iteration stopped
+    assert len(gets) <= 3
+
+def test_unknown_filter_raises_when_called(client):
+    with pytest.raises(ValueError):
+        client.job.iter_jobs(filters={'tag': 'x'})
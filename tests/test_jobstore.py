@@ -0,0 +1,69 @@
+from multyvac.jobstore import JobStore
+
+def record(jid, size=100, **tags):
+    return {'jid': jid, 'status': 'done', 'tags': tags, 'result': 'x' * size}
+
+def test_get_and_find(tmpdir):
+    store = JobStore(str(tmpdir.join('jobs.db')))
+    store.put('account', [record(1, name='a'), record(2, kind='b')])
+    assert sorted(store.get('account', [1, 2, 3])) == [1, 2]
+    assert store.get('other', [1]) == {}
+    assert [j['jid'] for j in store.find('account', tags={'kind': 'b'})] == [2]
+
+def test_evicts_least_recently_used(tmpdir):
+    store = JobStore(str(tmpdir.join('jobs.db')), max_bytes=2000)
+    store.put('account', [record(1)])
+    for jid in range(2, 20):
+        # Keep the first record in use
+        store.get('account', [1])
+        store.put('account', [record(jid)])
+    assert store.size() <= 2000
+    assert 1 in store.get('account', [1])
+    assert 2 not in store.get('account', [2])
+
+def test_keeps_size_without_summing_on_every_put(tmpdir, monkeypatch):
+    store = JobStore(str(tmpdir.join('jobs.db')), recount_interval=1000)
+    sums = []
+    size = store.size
+    def counting_size():
+        sums.append(True)
+        return size()
+    monkeypatch.setattr(store, 'size', counting_size)
+    for jid in range(50):
+        store.put('account', [record(jid)])
+    # Storing a job again does not count it twice
+    store.put('account', [record(0)])
+    assert len(sums) == 1
+    assert store._size == size()
+
+def double(x):
+    return x * 2
+
+def test_list_stored_searches_without_requests(client, server, tmpdir):
+    client.job.enable_store(str(tmpdir.join('jobs.db')))
+    jids = [client.job.submit(double, i, _name='double',
+                              _tags={'batch': str(i % 2)},
+                              _ignore_module_dependencies=True)
+            for i in range(4)]
+    other = client.job.submit(double, 9, _ignore_module_dependencies=True)
+    client.job.wait(jids + [other], timeout=30)
+    requests = server.counts['requests']
+    jobs = client.job.list_stored(name='double')
+    assert [job.jid for job in jobs] == sorted(jids, reverse=True)
+    assert jobs[0].name == 'double'
+    jobs = client.job.list_stored(name='double', tags={'batch': '1'})
+    assert [job.jid for job in jobs] == [jids[3], jids[1]]
+    assert len(client.job.list_stored(status='done', limit=2)) == 2
+    assert server.counts['requests'] == requests
+
+def test_list_by_jid_is_served_from_store(client, server, tmpdir):
+    client.job.enable_store(str(tmpdir.join('jobs.db')))
+    jids = [client.job.submit(double, i, _ignore_module_dependencies=True)
+            for i in range(3)]
+    client.job.wait(jids, timeout=30)
+    requests = server.counts['requests']
+    jobs = client.job.list(jid=jids)
+    assert sorted(job.jid for job in jobs) == sorted(jids)
+    assert server.counts['requests'] == requests
+    assert len(client.job.list(status='done')) == 3
+    assert server.counts['requests'] == requests + 1
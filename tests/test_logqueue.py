@@ -0,0 +1,71 @@
+import logging
+import os
+import Queue
+import time
+
+import multyvac
+from multyvac.logqueue import (
+    QueueHandler,
+    QueueListener,
+)
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    return logger
+
+def test_listener_writes_records_formatted_when_logged():
+    target = ListHandler()
+    target.setLevel(logging.INFO)
+    listener = QueueListener(Queue.Queue(), target)
+    listener.start()
+    logger = make_logger('test_logqueue.listener',
+                         QueueHandler(listener.queue))
+    data = ['before']
+    logger.info('data is %r', data)
+    data[0] = 'after'
+    logger.debug('below the handler level')
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logger.exception('failed')
+    listener.stop()
+    assert [r.getMessage() for r in target.records] == [
+        "data is ['before']", 'failed']
+    assert 'ValueError: boom' in target.records[1].exc_text
+    assert target.records[1].exc_info is None
+
+def test_full_queue_drops_records_instead_of_blocking():
+    handler = QueueHandler(Queue.Queue(2))
+    logger = make_logger('test_logqueue.full', handler)
+    start = time.time()
+    for i in range(5):
+        logger.info('record %d', i)
+    assert time.time() - start < 1
+    assert handler.dropped == 3
+    assert handler.queue.qsize() == 2
+
+def test_client_errors_reach_the_log_file(client, tmpdir):
+    log_path = os.path.join(client.config.get_multyvac_path(), 'log',
+                            'multyvac.log')
+    assert log_path.startswith(str(tmpdir))
+    # A second client with the same log file does not start another writer
+    listener = multyvac.multyvac._log_listeners[log_path]
+    other = multyvac.Multyvac(api_key='mock', api_secret_key='mock',
+                              api_url=client.config.api_url)
+    assert multyvac.multyvac._log_listeners[log_path] is listener
+    other._logger.error('logged by the client')
+    listener.stop()
+    with open(log_path) as f:
+        assert 'logged by the client' in f.read()
@@ -0,0 +1,69 @@
+import os
+import time
+
+from multyvac.memo import LocalMemoCache
+
+def entry_count(path):
+    return len([name for name in os.listdir(path) if name.endswith('.json')])
+
+def test_evicts_oldest_entries(tmpdir):
+    cache = LocalMemoCache(str(tmpdir), max_entries=10)
+    for i in range(25):
+        cache.put('key%d' % i, {'jid': i})
+    assert entry_count(str(tmpdir)) <= 10
+    assert cache.get('key24')['jid'] == 24
+    assert cache.get('key0') is None
+
+def test_evicts_by_size(tmpdir):
+    cache = LocalMemoCache(str(tmpdir), max_bytes=2000)
+    for i in range(20):
+        cache.put('key%d' % i, {'jid': i, 'result': 'x' * 200})
+    size = sum(os.path.getsize(str(tmpdir.join(name)))
+               for name in os.listdir(str(tmpdir)))
+    assert size <= 2000
+
+def test_tracks_size_without_listing_on_every_write(tmpdir, monkeypatch):
+    cache = LocalMemoCache(str(tmpdir), max_entries=100, rescan_interval=1000)
+    listings = []
+    listdir = os.listdir
+    def counting_listdir(path):
+        listings.append(path)
+        return listdir(path)
+    monkeypatch.setattr(os, 'listdir', counting_listdir)
+    for i in range(50):
+        cache.put('key%d' % i, {'jid': i})
+    assert len(listings) == 1
+    assert cache._count == 50
+
+def test_add_keeps_existing_entry(tmpdir):
+    cache = LocalMemoCache(str(tmpdir))
+    cache.add('key', {'jid': 1})
+    stored_at = cache.get('key')['stored_at']
+    time.sleep(0.01)
+    cache._present.clear()
+    cache.add('key', {'jid': 2})
+    entry = cache.get('key')
+    assert entry['jid'] == 1
+    assert entry['stored_at'] == stored_at
+
+def test_expired_entries_are_not_used(tmpdir):
+    cache = LocalMemoCache(str(tmpdir), ttl=0)
+    cache.put('key', {'jid': 1})
+    time.sleep(0.01)
+    assert cache.get('key') is None
+    assert entry_count(str(tmpdir)) == 0
+
+def double(x):
+    return x * 2
+
+def test_memoized_submit_returns_finished_job(client, tmpdir):
+    client.job.enable_memoization(LocalMemoCache(str(tmpdir.join('memo'))))
+    jid = client.job.submit(double, 21, _memoize=True,
+                            _ignore_module_dependencies=True)
+    assert client.job.wait([jid], timeout=30)[0].get_result() == 42
+    again = client.job.submit(double, 21, _memoize=True,
+                              _ignore_module_dependencies=True)
+    assert again == jid
+    other = client.job.submit(double, 1, _memoize=True,
+                              _ignore_module_dependencies=True)
+    assert other != jid
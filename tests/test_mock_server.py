@@ -0,0 +1,34 @@
+import time
+
+import pytest
+
+from multyvac import RequestError
+from multyvac.mock_server import (
+    MockServer,
+    _Handler,
+)
+
+def test_unexpected_handler_error_returns_500(client, monkeypatch):
+    def fail(self):
+        raise KeyError('bug')
+    monkeypatch.setattr(_Handler, 'job_queue_stats', fail)
+    with pytest.raises(RequestError) as info:
+        client.job.queue_stats()
+    assert info.value.http_status_code == 500
+    assert 'KeyError' in info.value.message
+
+def test_unknown_route_returns_404(client):
+    with pytest.raises(RequestError) as info:
+        client._ask(client._ASK_GET, '/nothing')
+    assert info.value.http_status_code == 404
+
+def test_stop_kills_jobs_and_joins_workers():
+    server = MockServer(workers=2).start()
+    jid, = server.api.submit([{'cmd': 'sleep 30'}])
+    while server.api.jobs[jid]['status'] != 'processing':
+        time.sleep(0.01)
+    start = time.time()
+    server.stop()
+    assert time.time() - start < 5
+    assert not any(t.is_alive() for t in server.api._workers)
+    assert server.api.jobs[jid]['status'] == 'killed'
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from multyvac.packing import ClusterPacker
+
+def add_jobs(packer, jobs):
+    return [packer.shell_submit('sleep %s' % (seconds / 10.0),
+                                _multicore=cores, _estimate=seconds)
+            for cores, seconds in jobs]
+
+JOBS = [(2, 2), (1, 1), (2, 4), (1, 1), (2, 2)]
+
+def test_plan_is_longest_first_filling_gaps(client):
+    packer = ClusterPacker(4, multyvac=client)
+    jobs = add_jobs(packer, JOBS)
+    schedule, makespan, utilization = packer.plan()
+    assert [(start, job.estimate, job.multicore)
+            for start, job in schedule] == [(0.0, 4, 2), (0.0, 2, 2),
+                                             (2.0, 2, 2), (4.0, 1, 1),
+                                             (4.0, 1, 1)]
+    assert makespan == 5.0
+    assert utilization == 18 / 20.0
+    assert set(job for _, job in schedule) == set(jobs)
+
+def test_run_never_holds_more_cores_than_the_cluster(client, server):
+    cluster = client.cluster.get(client.cluster.provision('c2', 4))
+    packer = ClusterPacker(cluster, multyvac=client, poll_interval=0.05)
+    jobs = add_jobs(packer, JOBS)
+    most = [0]
+    done = threading.Event()
+    def sample():
+        while not done.is_set():
+            with server.api._lock:
+                held = sum(job['multicore'] for job in server.api.jobs.values()
+                           if job['status'] in ('queued', 'processing'))
+            most[0] = max(most[0], held)
+            time.sleep(0.01)
+    t = threading.Thread(target=sample)
+    t.start()
+    try:
+        report = packer.run()
+    finally:
+        done.set()
+        t.join()
+    assert most[0] == 4
+    assert all(job.job.status == 'done' for job in jobs)
+    assert all(job.job.core == 'c2' for job in jobs)
+    # The longest job was submitted first
+    assert min(jobs, key=lambda j: j.jid).estimate == 4
+    assert report.planned_makespan == 5.0
+    assert report.makespan >= 0.5
+    assert 0 < report.utilization <= 1
+
+def test_jobs_must_fit_and_have_an_estimate(client):
+    packer = ClusterPacker(4, multyvac=client)
+    with pytest.raises(ValueError):
+        packer.shell_submit('true', _multicore=8, _estimate=1)
+    with pytest.raises(ValueError):
+        packer.shell_submit('true')
@@ -0,0 +1,47 @@
+import os
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+def names(stats):
+    return set(func[2] for func in stats.stats)
+
+def test_profile_is_returned_with_the_result(client):
+    jid = client.job.submit(busy, 1000, _profile=True,
+                            _ignore_module_dependencies=True)
+    client.job.wait([jid], timeout=30)
+    job = client.job.get(jid)
+    assert job.get_result() == busy(1000)
+    assert 'busy' in names(job.profile)
+
+def test_unprofiled_job_has_no_profile(client):
+    jid = client.job.submit(busy, 10, _ignore_module_dependencies=True)
+    client.job.wait([jid], timeout=30)
+    assert client.job.get(jid).profile is None
+
+def test_aggregate_profile(client):
+    jids = [client.job.submit(busy, 1000, _profile=True,
+                              _ignore_module_dependencies=True)
+            for _ in range(2)]
+    plain = client.job.submit(busy, 10, _ignore_module_dependencies=True)
+    client.job.wait(jids + [plain], timeout=30)
+    stats = client.job.aggregate_profile(jids + [plain])
+    busy_calls = [calls for func, (_, calls, _, _, _) in stats.stats.items()
+                  if func[2] == 'busy']
+    assert busy_calls == [2]
+    assert client.job.aggregate_profile([plain]) is None
+
+def test_profile_dumped_to_a_volume(client, tmpdir):
+    # The mock server runs jobs on this host, so the job writes the profile
+    # to tmpdir, from where it is uploaded to the volume mounted there.
+    client.volume.create('profiles', str(tmpdir))
+    path = str(tmpdir.join('busy.prof'))
+    jid = client.job.submit(busy, 1000, _profile=path,
+                            _ignore_module_dependencies=True)
+    client.job.wait([jid], timeout=30)
+    assert os.path.exists(path)
+    with open(path, 'rb') as f:
+        client.volume.get('profiles').put_contents(f.read(), 'busy.prof')
+    job = client.job.get(jid)
+    assert job.get_result() == busy(1000)
+    assert 'busy' in names(job.profile)
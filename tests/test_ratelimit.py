@@ -0,0 +1,67 @@
+import threading
+import time
+
+from multyvac.mock_server import MockServer
+from multyvac.ratelimit import (
+    RateLimiter,
+    TokenBucket,
+)
+
+def test_waiting_requests_are_served_in_order():
+    bucket = TokenBucket(rate=10.0, burst=1.0)
+    assert bucket.acquire() == 0
+    assert bucket.acquire(timeout=0) is None
+    served = []
+    def acquire(i):
+        bucket.acquire()
+        served.append(i)
+    threads = []
+    for i in range(4):
+        thread = threading.Thread(target=acquire, args=(i,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    # Each request reserved its own token rather than racing for the next
+    assert served == range(4)
+
+def test_measured_rate_uses_actual_span():
+    limiter = RateLimiter()
+    for _ in range(5):
+        limiter.observe(RateLimiter.class_poll, 200, {})
+    # Five requests well within a second were sent much faster than 5/s
+    assert limiter._measured_rate(RateLimiter.class_poll) > 50
+
+def test_rate_climbs_back_past_last_known_limit():
+    limiter = RateLimiter()
+    c = RateLimiter.class_poll
+    limiter.observe(c, 429, {})
+    limiter._last_limit[c] = 20.0
+    limiter.observe(c, 200, {})
+    assert limiter.stats()[c]['rate'] < 20.0
+    limiter._last_decrease[c] -= 5.0
+    limiter.observe(c, 200, {})
+    assert limiter.stats()[c]['rate'] > 20.0
+
+def test_throughput_against_rate_limited_server(client):
+    server = MockServer(rate_limit=20, burst=5).start()
+    try:
+        client.config.api_url = server.url
+        slowest = [0.0]
+        def run():
+            for _ in range(15):
+                start = time.time()
+                client.job.queue_stats()
+                slowest[0] = max(slowest[0], time.time() - start)
+        start = time.time()
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 60 requests take 3 seconds at the server's limit
+        assert time.time() - start < 10
+        assert slowest[0] < 5
+    finally:
+        server.stop()
@@ -0,0 +1,78 @@
+import time
+
+from multyvac.job import Job
+from multyvac.resubmit import ResubmitPolicy
+
+def fails_once(tmpdir, name):
+    """A command that fails the first time it runs, and succeeds after."""
+    marker = tmpdir.join(name)
+    return 'test -e %s || (touch %s; exit 1)' % (marker, marker)
+
+def finish_as(server, jid, **fields):
+    """Waits for a mock job to finish, then changes its record, since the
+    mock server never stalls a job or runs out of memory."""
+    for _ in range(100):
+        with server.api._lock:
+            job = server.api.jobs[jid]
+            if job['status'] in Job.finished_statuses:
+                collected = fields.pop('collected', {})
+                job.update(fields)
+                job['collected'].update(collected)
+                return
+        time.sleep(0.05)
+    raise AssertionError('job %s did not finish' % jid)
+
+def test_policy_changes(client):
+    def job(**kwargs):
+        return Job(1, multyvac=client, **kwargs)
+    policy = ResubmitPolicy(cores=['c1', 'c2'], multicore_factor=2,
+                            max_multicore=4)
+    oom = job(status='error', core='c1', multicore=2,
+              collected={'memory_failcnt': 3})
+    assert policy.reason(oom) == ResubmitPolicy.reason_memory
+    assert policy.changes(oom, ResubmitPolicy.reason_memory) == {
+        'core': 'c2', 'multicore': 4}
+    oom = job(status='error', core='c2', multicore=4,
+              collected={'memory_failcnt': 3})
+    assert policy.changes(oom, ResubmitPolicy.reason_memory) == {}
+    assert policy.reason(job(status='error', collected={})) is None
+    assert policy.reason(job(status='stalled')) == 'stalled'
+    assert ResubmitPolicy(on_stalled=False).reason(
+        job(status='stalled')) is None
+
+def test_failed_jobs_are_resubmitted(client, server, tmpdir):
+    client.job.enable_resubmission()
+    ok = client.job.shell_submit('true')
+    stalled = client.job.shell_submit(fails_once(tmpdir, 'stalled'))
+    oom = client.job.shell_submit(fails_once(tmpdir, 'oom'), _core='c1')
+    finish_as(server, stalled, status='stalled')
+    finish_as(server, oom, collected={'memory_failcnt': 7})
+    policy = ResubmitPolicy(cores=['c1', 'c2'])
+    jobs = client.job.wait([ok, stalled, oom], timeout=30, resubmit=policy)
+    assert jobs[0].jid == ok
+    assert [job.status for job in jobs] == ['done'] * 3
+    assert jobs[1].tags['resubmit_of'] == str(stalled)
+    assert jobs[1].tags['attempt'] == '2'
+    assert jobs[1].tags['resubmit_history'] == '%s:stalled' % stalled
+    assert jobs[2].tags['resubmit_history'] == '%s:memory' % oom
+    assert jobs[2].core == 'c2'
+    counters = dict((m['labels']['reason'], m['value']) for m in
+                    client.stats.snapshot()['counters']['resubmits'])
+    assert counters == {'stalled': 1, 'memory': 1}
+
+def test_attempts_are_limited(client, server, tmpdir):
+    client.job.enable_resubmission()
+    stalled = client.job.shell_submit(fails_once(tmpdir, 'stalled'))
+    finish_as(server, stalled, status='stalled')
+    jobs = client.job.wait([stalled], timeout=30,
+                           resubmit=ResubmitPolicy(max_attempts=1))
+    assert jobs[0].jid == stalled
+    assert jobs[0].status == 'stalled'
+
+def test_core_hours_limit(client, server, tmpdir):
+    client.job.enable_resubmission()
+    stalled = client.job.shell_submit(fails_once(tmpdir, 'stalled'))
+    finish_as(server, stalled, status='stalled', runtime=3600.0)
+    jobs = client.job.wait([stalled], timeout=30,
+                           resubmit=ResubmitPolicy(max_core_hours=0.5))
+    assert jobs[0].jid == stalled
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from multyvac import (
+    CircuitOpenError,
+    RequestError,
+)
+from multyvac.retry import (
+    CircuitBreaker,
+    RetryPolicy,
+)
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.state_open
+    assert not breaker.allow()
+
+def test_breaker_lets_one_probe_through_when_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.state_half_open
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.state_closed
+    assert breaker.allow()
+
+def test_released_probe_lets_another_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    policy = RetryPolicy(breaker=breaker)
+    breaker.allow()
+    breaker.record_failure()
+    retry = policy.begin()
+    assert retry.allow()
+    # The attempt ended without an outcome, as with an unexpected exception
+    retry.release()
+    assert breaker.allow()
+
+def test_failing_api_opens_breaker(client, server):
+    client.retry_policy = RetryPolicy(
+        max_attempts=1, breaker=CircuitBreaker(failure_threshold=2,
+                                               reset_timeout=60))
+    server.error_rate = 1.0
+    for _ in range(2):
+        with pytest.raises(RequestError):
+            client.job.queue_stats()
+    with pytest.raises(CircuitOpenError):
+        client.job.queue_stats()
+    requests = server.counts['requests']
+    with pytest.raises(CircuitOpenError):
+        client.job.queue_stats()
+    assert server.counts['requests'] == requests
+
+def test_unexpected_error_does_not_leave_breaker_half_open(client,
+                                                           monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    client.retry_policy = RetryPolicy(breaker=breaker)
+    breaker.allow()
+    breaker.record_failure()
+
+    def fail(*args, **kwargs):
+        raise KeyError('unexpected')
+    with monkeypatch.context() as m:
+        m.setattr(client, '_ask_helper', fail)
+        with pytest.raises(KeyError):
+            client.job.queue_stats()
+    assert breaker.state == CircuitBreaker.state_half_open
+    client.job.queue_stats()
+    assert breaker.state == CircuitBreaker.state_closed
+
+def test_retries_transient_errors(client, server):
+    client.retry_policy = RetryPolicy(max_attempts=20, base_delay=0.01,
+                                      min_delay=0.0)
+    server.error_rate = 0.5
+    start = time.time()
+    for _ in range(5):
+        client.job.queue_stats()
+    assert server.counts['errors'] > 0
+    assert time.time() - start < 30
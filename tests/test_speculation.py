@@ -0,0 +1,53 @@
+from multyvac.speculation import SpeculationPolicy
+
+def test_policy():
+    policy = SpeculationPolicy(quantile=0.75, multiplier=1.5, min_runtime=1.0,
+                               max_copies=0.1)
+    assert policy.threshold([], 4) is None
+    assert policy.threshold([2.0, 4.0], 4) is None
+    assert policy.threshold([2.0, 4.0, 30.0], 4) == 6.0
+    assert policy.threshold([0.1, 0.1, 0.2], 4) == 1.0
+    assert policy.copy_limit(4) == 1
+    assert policy.copy_limit(25) == 3
+
+def straggler(tmpdir):
+    """A command that is slow the first time it runs, and fast after."""
+    return 'mkdir %s && sleep 30 || true' % tmpdir.join('started')
+
+def test_straggler_is_duplicated_and_loses(client, tmpdir):
+    client.job.enable_resubmission()
+    quick = [client.job.shell_submit('true') for _ in range(3)]
+    slow = client.job.shell_submit(straggler(tmpdir))
+    policy = SpeculationPolicy(min_runtime=0.5)
+    jobs = client.job.wait(quick + [slow], timeout=30, speculative=policy)
+    assert [job.jid for job in jobs[:3]] == quick
+    copy = jobs[3]
+    assert copy.jid != slow
+    assert copy.status == 'done'
+    assert copy.tags['speculative_copy_of'] == slow
+    assert client.job.get(slow).status == 'killed'
+    counters = client.stats.snapshot()['counters']
+    assert counters['speculative_copies'][0]['value'] == 1
+    assert counters['speculative_wins'][0]['value'] == 1
+
+def test_timeout_kills_copies(client):
+    client.job.enable_resubmission()
+    quick = [client.job.shell_submit('true') for _ in range(3)]
+    slow = client.job.shell_submit('sleep 30')
+    policy = SpeculationPolicy(min_runtime=0.5)
+    assert client.job.wait(quick + [slow], timeout=4,
+                           speculative=policy) is None
+    copies = [job for job in client.job.list(limit=10)
+              if (job.tags or {}).get('speculative_copy_of') == slow]
+    assert len(copies) == 1
+    assert client.job.get(copies[0].jid).status == 'killed'
+    client.job.kill(slow)
+
+def test_jobs_submitted_before_resubmission_are_not_duplicated(client):
+    quick = [client.job.shell_submit('true') for _ in range(3)]
+    slow = client.job.shell_submit('sleep 2')
+    client.job.enable_resubmission()
+    policy = SpeculationPolicy(min_runtime=0.5)
+    jobs = client.job.wait(quick + [slow], timeout=30, speculative=policy)
+    assert jobs[3].jid == slow
+    assert 'speculative_copies' not in client.stats.snapshot()['counters']
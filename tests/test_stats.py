@@ -0,0 +1,70 @@
+from multyvac.retry import RetryPolicy
+from multyvac.stats import (
+    StatsCollector,
+    endpoint_template,
+)
+
+def test_endpoint_template():
+    assert endpoint_template('/job') == '/job'
+    assert endpoint_template('/job/kill') == '/job/kill'
+    assert endpoint_template('/volume/data/mkdir') == '/volume/:id/mkdir'
+    assert endpoint_template('/layer/base/') == '/layer/:id'
+
+def test_requests_are_recorded_and_passed_to_hooks(client, server):
+    events = []
+    def failing_hook(event):
+        raise ValueError('hooks cannot break requests')
+    client.stats.add_hook(failing_hook)
+    client.stats.add_hook(events.append)
+    jid = client.job.shell_submit('true')
+    client.job.get(jid)
+    assert [(e['method'], e['endpoint'], e['status']) for e in events] == [
+        ('POST', '/job', 200), ('GET', '/job', 200)]
+    assert events[0]['request_bytes'] > 0
+    assert events[1]['response_bytes'] > 0
+    assert all(e['seconds'] >= 0 for e in events)
+
+    snapshot = client.stats.snapshot()
+    requests = dict((tuple(sorted(m['labels'].items())), m['value'])
+                    for m in snapshot['counters']['requests'])
+    assert requests[(('endpoint', '/job'), ('method', 'GET'),
+                     ('status', '200'))] == 1
+    latency = snapshot['histograms']['request_seconds']
+    assert sum(m['value']['count'] for m in latency) == 2
+    codecs = set(m['labels']['operation']
+                 for m in snapshot['histograms']['codec_seconds'])
+    assert set(['json_encode', 'json_decode']) <= codecs
+
+    client.stats.remove_hook(events.append)
+    client.job.get(jid)
+    assert len(events) == 2
+
+def test_retries_are_counted_per_endpoint(client, server):
+    client.retry_policy = RetryPolicy(max_attempts=20, base_delay=0.01,
+                                      min_delay=0.0)
+    server.error_rate = 0.5
+    while not server.counts['errors']:
+        client.job.queue_stats()
+    server.error_rate = 0.0
+    retries = client.stats.snapshot()['counters']['retries']
+    assert retries == [{'labels': {'method': 'GET',
+                                   'endpoint': '/job/queue_stats'},
+                        'value': server.counts['errors']}]
+
+def test_prometheus_exposition():
+    stats = StatsCollector()
+    stats.observe('request_seconds', ('GET', '/job'), 0.2)
+    stats.count('requests', ('GET', '/job', '200'))
+    stats.gauge('submission_in_flight', (), 3)
+    text = stats.to_prometheus()
+    assert ('multyvac_requests_total{endpoint="/job",method="GET",'
+            'status="200"} 1') in text
+    assert 'multyvac_submission_in_flight 3' in text
+    assert ('multyvac_request_seconds_bucket{endpoint="/job",le="0.25",'
+            'method="GET"} 1') in text
+    assert ('multyvac_request_seconds_bucket{endpoint="/job",le="0.1",'
+            'method="GET"} 0') in text
+    assert 'multyvac_request_seconds_count{endpoint="/job",method="GET"} 1' \
+        in text
+    stats.reset()
+    assert stats.to_prometheus() == '\n'
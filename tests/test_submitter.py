@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from multyvac.submitter import (
+    SubmissionQueue,
+    _count_queued,
+)
+
+def unfinished(server):
+    with server.api._lock:
+        return len([job for job in server.api.jobs.values()
+                    if job['status'] in ('queued', 'processing')])
+
+def test_limits_jobs_in_flight(client, server):
+    q = SubmissionQueue(client, max_in_flight=2, poll_interval=0.05)
+    submissions = [q.shell_submit('sleep 0.2') for _ in range(6)]
+    q.close()
+    most = 0
+    while q._thread.is_alive():
+        most = max(most, unfinished(server))
+        time.sleep(0.02)
+    assert most == 2
+    assert q.join(10)
+    assert all(s.wait(0) and s.finished for s in submissions)
+    stats = client.stats.snapshot()['gauges']
+    assert stats['submission_in_flight'][0]['value'] == 0
+    assert stats['submission_queue_depth'][0]['value'] == 0
+
+def test_waits_for_the_account_queue(client):
+    # The mock server runs 4 jobs at once, so 2 of these stay queued
+    others = [client.job.shell_submit('sleep 30') for _ in range(6)]
+    time.sleep(0.5)
+    q = SubmissionQueue(client, max_account_queued=2, poll_interval=0.05,
+                        stats_interval=0.1)
+    submission = q.shell_submit('true')
+    assert submission.wait(0.5) is None
+    client.job.kill(others)
+    assert submission.wait(5) is not None
+    assert q.join(10)
+
+def test_errors_are_raised_by_wait(client):
+    with SubmissionQueue(client, poll_interval=0.05) as q:
+        bad = q.shell_submit('true', _no_such_option=True)
+        good = q.shell_submit('true')
+    with pytest.raises(TypeError):
+        bad.wait(5)
+    assert good.wait(5) is not None
+    with pytest.raises(ValueError):
+        q.shell_submit('true')
+    assert q.join(10)
+
+def test_count_queued():
+    assert _count_queued({'c1': {'queued': 2, 'processing': 1},
+                          'c2': {'queued': 3, 'processing': 0}}) == 5
+    assert _count_queued({'queued': 4, 'processing': 1}) == 4
+    assert _count_queued({}) == 0
@@ -0,0 +1,65 @@
+import time
+
+from multyvac.tracing import (
+    InMemoryExporter,
+    OTLPJSONExporter,
+)
+
+def add(x, y):
+    return x + y
+
+def traced(client):
+    exporter = InMemoryExporter()
+    client.tracer.add_exporter(exporter)
+    return exporter
+
+def names(exporter):
+    return [s.name for s in exporter.spans]
+
+def wait_partial(client, jid):
+    """Waits for a job the way BatchPoller does, fetching only some
+    fields."""
+    for _ in range(100):
+        job = client.job.get([jid], fields=['jid', 'status', 'runtime'])[0]
+        if job.status == 'done':
+            return job
+        time.sleep(0.1)
+    raise AssertionError('job %s did not finish' % jid)
+
+def test_submit_stages_nest_under_submit(client):
+    exporter = traced(client)
+    client.job.submit(add, 1, 2, _ignore_module_dependencies=True)
+    by_name = dict((s.name, s) for s in exporter.spans)
+    submit = by_name['submit']
+    assert submit.parent_id is None
+    assert by_name['pickle'].parent_id == submit.span_id
+    assert by_name['http'].parent_id == submit.span_id
+    assert by_name['http'].trace_id == submit.trace_id
+
+def test_job_timing_waits_for_the_full_record(client):
+    exporter = traced(client)
+    jid = client.job.submit(add, 1, 2, _ignore_module_dependencies=True)
+    submit = [s for s in exporter.spans if s.name == 'submit'][0]
+    assert wait_partial(client, jid).runtime is not None
+    assert not [n for n in names(exporter) if n.startswith('job.')]
+    client.job.get(jid)
+    timing = [s for s in exporter.spans if s.name.startswith('job.')]
+    assert [s.name for s in timing] == ['job.queue', 'job.overhead',
+                                        'job.runtime']
+    assert all(s.parent_id == submit.span_id for s in timing)
+    # Laid end to end
+    assert timing[0].end_time == timing[1].start_time
+    assert timing[1].end_time == timing[2].start_time
+    # Recorded once
+    client.job.get(jid)
+    assert len([n for n in names(exporter) if n.startswith('job.')]) == 3
+
+def test_otlp_encoding(client):
+    exporter = traced(client)
+    client.job.submit(add, 1, 2, _ignore_module_dependencies=True)
+    body = OTLPJSONExporter().encode(exporter.spans)
+    spans = body['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert len(spans) == len(exporter.spans)
+    submit = [s for s in spans if s['name'] == 'submit'][0]
+    assert 'parentSpanId' not in submit
+    assert int(submit['endTimeUnixNano']) >= int(submit['startTimeUnixNano'])
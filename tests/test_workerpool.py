@@ -0,0 +1,95 @@
+import pickle
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from multyvac import MultyvacError
+from multyvac.job import Job
+from multyvac.workerpool import (
+    TaskError,
+    WorkerError,
+    WorkerPool,
+    _Worker,
+)
+
+def square(x):
+    return x * x
+
+def fail(x):
+    raise ValueError('failed on %s' % x)
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+@pytest.fixture
+def local_ports(monkeypatch):
+    """The mock server runs worker jobs on this host without reporting their
+    ports, so find them open by connecting to them."""
+    def wait_for_open_port(job, port, timeout=None):
+        job.wait([Job.status_processing] + Job.finished_statuses, timeout)
+        end = time.time() + 10
+        while job.status == Job.status_processing and time.time() < end:
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                return {'address': '127.0.0.1', 'port': port}
+            except socket.error:
+                time.sleep(0.05)
+                job.update()
+        return False
+    monkeypatch.setattr(Job, 'wait_for_open_port', wait_for_open_port)
+
+def make_pool(client, **kwargs):
+    kwargs.setdefault('size', 1)
+    kwargs.setdefault('idle_timeout', 5)
+    return WorkerPool(multyvac=client, port=free_port(), startup_timeout=30,
+                      _ignore_module_dependencies=True, **kwargs)
+
+def test_map_and_submit(client, local_ports):
+    with make_pool(client, pipeline=3) as pool:
+        assert list(pool.map(square, range(20))) == [x * x for x in range(20)]
+        assert pool.submit(square, 7).result(30) == 49
+        with pytest.raises(TaskError) as e:
+            pool.submit(fail, 3).result(30)
+        assert e.value.exc_type == 'ValueError'
+        assert 'failed on 3' in e.value.traceback
+    # Each worker job returns once the pool shuts down
+    for jid in pool.jids:
+        job = client.job.get(jid)
+        assert job.wait(timeout=10) == Job.status_done
+
+def test_failed_workers_fail_queued_tasks_even_if_kill_fails(client,
+                                                             monkeypatch):
+    monkeypatch.setattr(Job, 'wait_for_open_port',
+                        lambda job, port, timeout=None: False)
+    def kill(jid, timeout=None):
+        raise MultyvacError('kill failed')
+    monkeypatch.setattr(client.job, 'kill', kill)
+    # Workers that nobody connects to exit after idle_timeout
+    pool = make_pool(client, size=2, idle_timeout=0.5)
+    future = pool.submit(square, 2)
+    with pytest.raises(WorkerError):
+        future.result(10)
+    with pytest.raises(WorkerError):
+        pool.submit(square, 3)
+    pool.shutdown()
+
+def test_reply_for_a_task_already_failed_is_skipped():
+    # A worker whose tasks in flight were failed by _fail() can still get
+    # their replies before the connection closes.
+    worker = object.__new__(_Worker)
+    worker.jid = 1
+    worker._pending = {}
+    worker._window = threading.Semaphore(0)
+    worker.sock, remote = socket.socketpair()
+    data = pickle.dumps((5, True, pickle.dumps(25, 2)), 2)
+    remote.sendall(struct.pack('!I', len(data)) + data)
+    remote.close()
+    worker._receive_loop()
+    assert not worker._window.acquire(False)